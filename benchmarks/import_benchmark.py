@@ -0,0 +1,54 @@
+"""
+Time the import of each data_retrieval module in a fresh interpreter, and
+list the heavy dependencies each one pulls in.
+
+Usage
+-----
+    $ python benchmarks/import_benchmark.py [repeats]
+"""
+import subprocess
+import sys
+
+MODULES = ['data_retrieval', 'data_retrieval.nwis', 'data_retrieval.codes',
+           'data_retrieval.streamstats', 'data_retrieval.wqp',
+           'data_retrieval.nadp', 'data_retrieval.utils']
+
+HEAVY = ['numpy', 'pandas', 'requests', 'gdal', 'osgeo']
+
+SCRIPT = '''
+import sys, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(elapsed, ','.join(m for m in {heavy!r} if m in sys.modules))
+'''
+
+
+def time_import(module, repeats):
+    """Best of repeats import times in seconds, and the heavy modules loaded.
+    """
+    times = []
+    for _ in range(repeats):
+        out = subprocess.run([sys.executable, '-c',
+                              SCRIPT.format(module=module, heavy=HEAVY)],
+                             capture_output=True, text=True, check=True)
+        elapsed, loaded = out.stdout.split(' ', 1)
+        times.append(float(elapsed))
+
+    return min(times), loaded.strip()
+
+
+def main(repeats=5):
+    print('{:30} {:>10}  {}'.format('module', 'ms', 'heavy imports'))
+    for module in MODULES:
+        try:
+            elapsed, loaded = time_import(module, repeats)
+        except subprocess.CalledProcessError:
+            print('{:30} {:>10}'.format(module, 'failed'))
+            continue
+
+        print('{:30} {:10.1f}  {}'.format(module, elapsed * 1000, loaded))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
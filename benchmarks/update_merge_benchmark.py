@@ -0,0 +1,70 @@
+"""
+Compare run time and peak memory of utils.update_merge against the original
+merge-and-suffix implementation.
+
+Usage
+-----
+    $ python benchmarks/update_merge_benchmark.py [n_rows]
+"""
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from data_retrieval.utils import update_merge
+
+
+def legacy_update_merge(left, right, on=None, **kwargs):
+    """The original implementation, na_only=True branch.
+    """
+    df = left.merge(right, how='outer', on=on, **kwargs)
+
+    for column in df.columns:
+        if column[-2:] == '_x':
+            name = column[:-2]
+            df[name] = df[name+'_x'].fillna(df[name+'_y'])
+            df.drop([name + '_x', name + '_y'], axis=1, inplace=True)
+
+    return df
+
+
+def make_frames(n_rows, n_sites=1000, seed=0):
+    rng = np.random.RandomState(seed)
+    sites = np.repeat(['{:08d}'.format(i) for i in range(n_sites)],
+                      n_rows // n_sites)
+    times = np.tile(pd.date_range('2018-01-01', periods=n_rows // n_sites,
+                                  freq='15min'), n_sites)
+
+    archived = pd.DataFrame({'site_no': sites, 'datetime': times,
+                             '00060': rng.normal(size=len(sites)),
+                             '00060_cd': 'A'})
+    archived.loc[archived.sample(frac=0.1, random_state=seed).index, '00060'] = np.nan
+
+    # revisions cover the second half of the record plus new rows
+    revised = archived.iloc[len(archived) // 2:].copy()
+    revised['00060'] = rng.normal(size=len(revised))
+    revised['datetime'] += pd.Timedelta('1D')
+    return archived, revised
+
+
+def measure(func, *args, **kwargs):
+    tracemalloc.start()
+    start = time.perf_counter()
+    func(*args, **kwargs)
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+if __name__ == '__main__':
+    n_rows = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    archived, revised = make_frames(n_rows)
+    on = ['site_no', 'datetime']
+
+    for name, func in [('legacy', legacy_update_merge),
+                       ('update_merge', update_merge)]:
+        elapsed, peak = measure(func, archived, revised, on=on)
+        print('{:<14}{:>8.2f} s{:>10.1f} MB'.format(name, elapsed, peak / 2**20))
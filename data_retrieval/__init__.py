@@ -0,0 +1,22 @@
+"""
+Retrieve data from NWIS, the Water Quality Portal, StreamStats, and NADP.
+
+Submodules are imported when first used, e.g. data_retrieval.nwis, so that
+importing the package does not import pandas, requests, or GDAL.
+"""
+import importlib
+
+_SUBMODULES = ['aggregate', 'bulk', 'catalog', 'cli', 'codes', 'crosswalk',
+               'nadp', 'nwis', 'remotezip', 'shared', 'stats', 'streamstats',
+               'trends', 'utils', 'watch', 'wqp', 'wqp_schema']
+
+
+def __getattr__(name):
+    if name in _SUBMODULES:
+        return importlib.import_module('.' + name, __name__)
+
+    raise AttributeError('module {!r} has no attribute {!r}'.format(__name__, name))
+
+
+def __dir__():
+    return sorted(list(globals()) + _SUBMODULES)
@@ -0,0 +1,244 @@
+"""
+Aggregate instantaneous values (iv) to hourly, daily, or other fixed
+intervals.
+
+Bins are assigned with integer arithmetic on the (site_no, datetime) index
+returned by nwis.get_iv, and every site is reduced in one pass with
+numpy.ufunc.reduceat. Because get_iv output is already sorted by site and
+time, no sort or groupby is needed.
+
+Example
+-------
+>>> iv = nwis.get_iv(sites=['03339000', '05447500'], startDT='2018-01-01',
+                     endDT='2018-01-31')
+>>> aggregate.aggregate(iv, freq='1h')
+>>> aggregate.aggregate(iv, freq='1D', completeness=0.9, dv_columns=True)
+"""
+import numpy as np
+import pandas as pd
+
+from data_retrieval.nwis import format_response
+from data_retrieval.utils import _level_codes
+
+SITENO_COL = 'site_no'
+DATETIME_COL = 'datetime'
+
+STATS = ['mean', 'min', 'max', 'count']
+
+# column suffixes used by the dv service, see nwis.read_json
+DV_STATS = {'mean': 'Mean', 'min': 'Minimum', 'max': 'Maximum'}
+
+
+def aggregate(df, freq='1D', stats=('mean', 'min', 'max'), completeness=None,
+              interval=None, dv_columns=False):
+    """Aggregates time series to fixed intervals for each site.
+
+    Parameters
+    ----------
+    df : DataFrame
+        Indexed by (site_no, datetime), or by datetime with a site_no column,
+        as returned by nwis.get_iv. Columns ending in _cd are treated as
+        qualifiers of the column they are named after.
+
+    freq : string or Timedelta
+        Length of each interval, e.g. '15min', '1h', or '1D'. Intervals are
+        aligned to midnight in the local time of the index, and keep its
+        time zone.
+
+    stats : list
+        Statistics to compute: any of 'mean', 'min', 'max', and 'count'.
+
+    completeness : float, optional
+        Minimum fraction of the expected number of values in an interval.
+        Statistics for less complete intervals are set to NaN.
+
+    interval : string or Timedelta, optional
+        Sampling interval used to compute the expected number of values.
+        By default the median interval at each site.
+
+    dv_columns : boolean, default False
+        Name columns like the dv service (00060_Mean, 00060_Mean_cd, ...)
+        instead of 00060_mean.
+
+    Returns
+    -------
+    DataFrame formatted like get_iv or get_dv output, with one row per site
+    and interval that contains data. Qualifiers of all values in an
+    interval are carried forward to its statistics.
+    """
+    for stat in stats:
+        if stat not in STATS:
+            raise TypeError('Unrecognized statistic: {}'.format(stat))
+
+    if dv_columns and 'count' in stats:
+        raise TypeError('The dv service has no count statistic')
+
+    freq = pd.Timedelta(freq).value
+
+    if isinstance(df.index, pd.MultiIndex):
+        # reuse the codes of the site level rather than hashing site numbers
+        level = df.index.names.index(SITENO_COL)
+        site_codes = np.asarray(_level_codes(df.index, level), dtype='int64')
+        sites = df.index.levels[level]
+        times, tz = _wall_time(df.index.get_level_values(DATETIME_COL))
+
+    else:
+        site_codes, sites = pd.factorize(df[SITENO_COL], sort=True)
+        times, tz = _wall_time(df.index)
+
+    # values without a time belong to no interval
+    valid = ~np.isnat(times.view('datetime64[ns]'))
+    if not valid.all():
+        df = df[valid]
+        site_codes, times = site_codes[valid], times[valid]
+
+    bins = times // freq
+
+    if len(bins):
+        # one integer key per (site, interval); get_iv output is already sorted
+        key = site_codes * (bins.max() - bins.min() + 1) + (bins - bins.min())
+
+        if len(key) > 1 and (np.diff(key) < 0).any():
+            order = np.argsort(key, kind='mergesort')
+            df = df.take(order)
+            key, site_codes, times, bins = (key[order], site_codes[order],
+                                            times[order], bins[order])
+
+        starts = np.flatnonzero(np.concatenate([[True], key[1:] != key[:-1]]))
+
+    else:
+        # no intervals, but the same columns
+        starts = np.array([], dtype='intp')
+
+    out = pd.DataFrame({SITENO_COL: np.asarray(sites)[site_codes[starts]],
+                        DATETIME_COL: _localize(bins[starts] * freq, tz)})
+
+    if completeness is not None:
+        expected = freq / _sampling_interval(site_codes, times, len(sites),
+                                             interval)[site_codes[starts]]
+
+    value_columns = [column for column in df.columns
+                     if column != SITENO_COL and not column.endswith('_cd')
+                     and np.issubdtype(df[column].dtype, np.number)]
+
+    for column in value_columns:
+        values = df[column].values.astype('float64')
+        valid = ~np.isnan(values)
+        count = np.add.reduceat(valid, starts)
+
+        with np.errstate(invalid='ignore'):
+            reduced = {'count': count,
+                       'mean': np.add.reduceat(np.where(valid, values, 0),
+                                               starts) / count,
+                       'min': np.fmin.reduceat(values, starts),
+                       'max': np.fmax.reduceat(values, starts)}
+
+        if completeness is not None:
+            incomplete = count < completeness * expected
+            for stat in ('mean', 'min', 'max'):
+                reduced[stat][incomplete] = np.nan
+
+        qualifiers = None
+        if column + '_cd' in df:
+            qualifiers = _carry_qualifiers(df[column + '_cd'].values, starts)
+
+        for stat in stats:
+            name = _column_name(column, stat, dv_columns)
+            out[name] = reduced[stat]
+
+            if qualifiers is not None and stat != 'count':
+                out[name + '_cd'] = qualifiers
+
+    return format_response(out)
+
+
+def _column_name(column, stat, dv_columns):
+    if dv_columns:
+        return '{}_{}'.format(column, DV_STATS[stat])
+
+    return '{}_{}'.format(column, stat)
+
+
+def _wall_time(datetimes):
+    """Returns datetimes as int64 nanoseconds of local (wall clock) time,
+    and their time zone; None if they are naive or their UTC offsets
+    differ, e.g. between sites in different time zones.
+    """
+    try:
+        datetimes = pd.DatetimeIndex(datetimes)
+
+    except (TypeError, ValueError):
+        # mixed offsets are held as an object index of Timestamps
+        datetimes = pd.DatetimeIndex([time.replace(tzinfo=None)
+                                      for time in datetimes])
+
+    tz = datetimes.tz
+    if tz is not None:
+        datetimes = datetimes.tz_localize(None)
+
+    return datetimes.values.astype('datetime64[ns]').astype('int64'), tz
+
+
+def _localize(times, tz):
+    """Interval starts (int64 nanoseconds of wall clock time) as datetimes in
+    the time zone of the input.
+    """
+    times = pd.DatetimeIndex(times.astype('datetime64[ns]'))
+
+    if tz is None:
+        return times
+
+    # a start repeated or skipped by a daylight saving change is taken as the
+    # first occurrence, or shifted to the next valid time
+    return times.tz_localize(tz, ambiguous=np.ones(len(times), dtype=bool),
+                             nonexistent='shift_forward')
+
+
+def _sampling_interval(site_codes, times, n_sites, interval=None):
+    """Sampling interval in nanoseconds at each site.
+    """
+    if interval is not None:
+        return np.full(n_sites, pd.Timedelta(interval).value, dtype='float64')
+
+    same_site = site_codes[1:] == site_codes[:-1]
+    steps = pd.Series(np.diff(times)[same_site])
+    median = steps.groupby(site_codes[1:][same_site]).median()
+
+    return median.reindex(np.arange(n_sites)).values
+
+
+def _carry_qualifiers(qualifiers, starts):
+    """Combines the qualifier codes of every value in each interval.
+
+    Codes are comma separated, as returned by nwis.read_json. An interval
+    is provisional (P) if any of its values are provisional, in which case
+    the approved (A) code is dropped.
+    """
+    codes, uniques = pd.factorize(qualifiers)
+
+    # P and A lead, as in the service's own qualifier lists
+    flags = sorted({flag.strip() for unique in uniques
+                    for flag in str(unique).split(',') if flag.strip()},
+                   key=lambda flag: (flag not in ('P', 'A'), flag))
+
+    # which flags each unique qualifier string contains
+    has_flag = np.zeros((len(uniques) + 1, len(flags)), dtype=bool)
+    for i, unique in enumerate(uniques):
+        for flag in str(unique).split(','):
+            if flag.strip():
+                has_flag[i, flags.index(flag.strip())] = True
+
+    # missing qualifiers (code -1) index the empty last row
+    present = np.logical_or.reduceat(has_flag[codes], starts, axis=0)
+
+    if 'P' in flags and 'A' in flags:
+        present[:, flags.index('A')] &= ~present[:, flags.index('P')]
+
+    # pack each interval's flags into an integer and label each combination
+    packed = present.dot(1 << np.arange(len(flags), dtype='int64'))
+    combos, inverse = np.unique(packed, return_inverse=True)
+    labels = np.array([', '.join(flag for i, flag in enumerate(flags)
+                                 if combo >> i & 1) or np.nan
+                       for combo in combos], dtype=object)
+
+    return labels[inverse.ravel()]
@@ -0,0 +1,340 @@
+"""
+Resumable bulk downloads from NWIS and the Water Quality Portal.
+
+A manifest lists jobs, each a service, a list of sites, a date range, and
+any other query parameters. Each job is expanded into work units of at most
+`batch_size` sites and one date `window`, which are downloaded by a pool of
+workers with nwis.get_record, or wqp.get_results for the 'wqp' service.
+Every unit is written to its own file in a partitioned directory
+
+    <output>/service=<service>/year=<year>/part-<key>.parquet
+
+and recorded in a SQLite checkpoint once written, so an interrupted run
+picks up where it stopped: units already completed are skipped, and units
+that failed are tried again. Units the service has no data for (HTTP 404)
+are completed without a file; requests it rejects (HTTP 400) fail.
+
+Example manifest (json)
+-----------------------
+{"jobs": [
+    {"service": "dv", "sites": ["03339000", "05531500"],
+     "start": "2000-01-01", "end": "2017-12-31", "window": "1826D",
+     "parameterCd": "00060"},
+    {"service": "wqp", "sites": ["USGS-03339000"],
+     "start": "2000-01-01", "end": "2017-12-31",
+     "characteristicName": "Nitrate"}
+]}
+
+Sites of 'wqp' jobs are WQP site ids, agency code and site number joined by
+a hyphen.
+
+    $ data-retrieval bulk manifest.json --output pulls
+"""
+import hashlib
+import importlib.util
+import json
+import os
+import sqlite3
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timezone
+
+import pandas as pd
+
+from data_retrieval import nwis, wqp
+
+CHECKPOINT_FILE = 'checkpoint.sqlite'
+FORMATS = ['parquet', 'csv']
+
+BATCH_SIZE = 10
+WINDOW = '365D'
+
+# manifest job keys that are not passed on as query parameters
+JOB_KEYS = ['service', 'sites', 'start', 'end', 'window', 'batch_size']
+
+
+def read_manifest(path):
+    """Reads a json manifest of jobs.
+    """
+    with open(path) as f:
+        manifest = json.load(f)
+
+    if 'jobs' not in manifest:
+        raise ValueError('Manifest {} has no jobs'.format(path))
+
+    return manifest
+
+
+def expand(manifest):
+    """Splits the jobs of a manifest into work units.
+
+    Returns
+    -------
+    list of dicts with keys service, sites, start, end and params, where
+    params holds the other query parameters of the job.
+    """
+    units = []
+
+    for job in manifest['jobs']:
+        service = job.get('service')
+        if service != 'wqp' and service not in \
+                nwis.WATERSERVICES_SERVICES + nwis.WATERDATA_SERVICES:
+            raise TypeError('Unrecognized service: {}'.format(service))
+
+        sites = job.get('sites')
+        if not sites:
+            raise TypeError('Job must list sites: {}'.format(job))
+
+        sites = [sites] if isinstance(sites, str) else [str(site) for site in sites]
+        batch_size = job.get('batch_size', BATCH_SIZE)
+        params = {key: value for key, value in job.items() if key not in JOB_KEYS}
+
+        for start, end in _windows(job.get('start'), job.get('end'),
+                                   job.get('window', WINDOW)):
+            for i in range(0, len(sites), batch_size):
+                units.append({'service': service,
+                              'sites': sites[i:i + batch_size],
+                              'start': start, 'end': end,
+                              'params': params})
+
+    return units
+
+
+def unit_key(unit):
+    """Identifies a work unit by a hash of its contents.
+    """
+    text = json.dumps(unit, sort_keys=True, default=str)
+    return hashlib.sha1(text.encode()).hexdigest()
+
+
+def fetch_unit(unit):
+    """Downloads one work unit.
+
+    Returns
+    -------
+    DataFrame, or None if there were no data.
+    """
+    if unit['service'] == 'wqp':
+        params = dict(unit['params'], siteid=';'.join(unit['sites']))
+        if unit['start']:
+            params['startDateLo'] = _wqp_date(unit['start'])
+        if unit['end']:
+            params['startDateHi'] = _wqp_date(unit['end'])
+
+        return wqp.get_results(**params)
+
+    return nwis.get_record(sites=unit['sites'], start=unit['start'],
+                           end=unit['end'], service=unit['service'],
+                           **unit['params'])
+
+
+class Checkpoint():
+    """SQLite record of completed and failed work units.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS units ('
+            'key TEXT PRIMARY KEY, unit TEXT, status TEXT, rows INTEGER, '
+            'bytes INTEGER, seconds REAL, path TEXT, error TEXT, updated TEXT)')
+        self.connection.commit()
+
+    def completed(self):
+        """Keys of the units completed in this or earlier runs.
+        """
+        cursor = self.connection.execute(
+            "SELECT key FROM units WHERE status IN ('done', 'empty')")
+        return {key for key, in cursor}
+
+    def record(self, key, unit, status, rows=0, bytes=0, seconds=0.0,
+               path=None, error=None):
+        self.connection.execute(
+            'INSERT OR REPLACE INTO units VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            (key, json.dumps(unit, default=str), status, rows, bytes, seconds,
+             path, error, datetime.now(timezone.utc).isoformat()))
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+
+def run(manifest, output, checkpoint=None, max_workers=4, format='parquet',
+        log=sys.stderr):
+    """Downloads the work units of a manifest that are not yet completed.
+
+    Parameters
+    ----------
+    manifest : dict or string
+        Manifest, or the path of a json manifest.
+
+    output : string
+        Directory the partitioned output is written to.
+
+    checkpoint : string, optional
+        Path of the SQLite checkpoint; output/checkpoint.sqlite by default.
+
+    max_workers : int
+        Number of units downloaded at once.
+
+    format : string
+        'parquet', which needs pyarrow or fastparquet, or 'csv'.
+
+    log : file, optional
+        Where a line is written as each unit finishes; None for no progress.
+
+    Returns
+    -------
+    dict summarizing the run; see format_summary.
+    """
+    if format not in FORMATS:
+        raise TypeError('Unrecognized format: {}'.format(format))
+
+    if format == 'parquet' and not any(importlib.util.find_spec(engine)
+                                       for engine in ['pyarrow', 'fastparquet']):
+        raise ImportError("Writing parquet requires pyarrow or fastparquet; "
+                          "install one or use format='csv'")
+
+    if isinstance(manifest, str):
+        manifest = read_manifest(manifest)
+
+    units = {unit_key(unit): unit for unit in expand(manifest)}
+
+    os.makedirs(output, exist_ok=True)
+    checkpoint = Checkpoint(checkpoint or os.path.join(output, CHECKPOINT_FILE))
+    completed = checkpoint.completed() & set(units)
+    pending = [key for key in units if key not in completed]
+
+    summary = {'units': len(units), 'skipped': len(completed), 'done': 0,
+               'empty': 0, 'failed': 0, 'rows': 0, 'bytes': 0}
+    started = time.monotonic()
+
+    def work(key):
+        start = time.monotonic()
+        df = fetch_unit(units[key])
+        path = _write(df, output, key, units[key], format)
+
+        rows = 0 if df is None else len(df)
+        size = 0 if path is None else os.path.getsize(path)
+        return rows, size, time.monotonic() - start, path
+
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {executor.submit(work, key): key for key in pending}
+
+            for future in as_completed(futures):
+                key = futures[future]
+                unit = units[key]
+
+                try:
+                    rows, size, seconds, path = future.result()
+
+                except Exception as e:
+                    # including requests the service rejected (HTTP 400)
+                    checkpoint.record(key, unit, 'failed', error=repr(e))
+                    summary['failed'] += 1
+                    status = 'failed: {!r}'.format(e)
+
+                else:
+                    if path is None:
+                        # the service had no data (HTTP 404, or no rows)
+                        checkpoint.record(key, unit, 'empty', seconds=seconds)
+                        summary['empty'] += 1
+                        status = 'no data'
+
+                    else:
+                        checkpoint.record(key, unit, 'done', rows, size,
+                                          seconds, path)
+                        summary['done'] += 1
+                        summary['rows'] += rows
+                        summary['bytes'] += size
+                        status = '{} rows in {:.1f} s'.format(rows, seconds)
+
+                if log is not None:
+                    finished = (summary['skipped'] + summary['done']
+                                + summary['empty'] + summary['failed'])
+                    print('[{}/{}] {} {} {}..{}: {}'.format(
+                        finished, summary['units'], unit['service'],
+                        _describe(unit['sites']), unit['start'], unit['end'],
+                        status), file=log)
+
+    finally:
+        checkpoint.close()
+
+    summary['seconds'] = time.monotonic() - started
+    return summary
+
+
+def format_summary(summary):
+    """Describes the result and throughput of a run.
+    """
+    seconds = max(summary['seconds'], 1e-9)
+
+    return '\n'.join([
+        '{units} units: {done} downloaded, {empty} without data, '
+        '{skipped} already complete, {failed} failed'.format(**summary),
+        '{} rows, {:.1f} MB written in {:.1f} s'.format(
+            summary['rows'], summary['bytes'] / 1e6, summary['seconds']),
+        '{:.0f} rows/s, {:.2f} MB/s, {:.2f} units/s'.format(
+            summary['rows'] / seconds, summary['bytes'] / 1e6 / seconds,
+            summary['done'] / seconds)])
+
+
+def _write(df, output, key, unit, format):
+    """Writes the data of a unit to its partition, then renames it into
+    place, so an interrupted write leaves no partial file.
+    """
+    if df is None or len(df) == 0:
+        return None
+
+    year = unit['start'][:4] if unit['start'] else 'all'
+    directory = os.path.join(output, 'service={}'.format(unit['service']),
+                             'year={}'.format(year))
+    os.makedirs(directory, exist_ok=True)
+
+    path = os.path.join(directory, 'part-{}.{}'.format(key[:16], format))
+    df = df.reset_index() if _named_index(df) else df.reset_index(drop=True)
+
+    if format == 'parquet':
+        df.to_parquet(path + '.tmp', index=False)
+    else:
+        df.to_csv(path + '.tmp', index=False)
+
+    os.replace(path + '.tmp', path)
+    return path
+
+
+def _named_index(df):
+    return any(name is not None for name in df.index.names)
+
+
+def _windows(start, end, window):
+    """Splits start to end (YYYY-MM-DD, inclusive) into consecutive windows
+    that do not overlap.
+    """
+    if start is None:
+        return [(None, end)]
+
+    start = pd.Timestamp(start)
+    end = pd.Timestamp(end) if end else pd.Timestamp.today().normalize()
+    window = pd.Timedelta(window) if window else end - start + pd.Timedelta('1D')
+
+    windows = []
+    while start <= end:
+        stop = min(start + window - pd.Timedelta('1D'), end)
+        windows.append((start.strftime('%Y-%m-%d'), stop.strftime('%Y-%m-%d')))
+        start = stop + pd.Timedelta('1D')
+
+    return windows
+
+
+def _wqp_date(date):
+    return pd.Timestamp(date).strftime('%m-%d-%Y')
+
+
+def _describe(sites):
+    if len(sites) == 1:
+        return sites[0]
+
+    return '{}+{}'.format(sites[0], len(sites) - 1)
@@ -0,0 +1,475 @@
+"""
+Local catalog of NWIS sites for nearest-gage, radius, bounding box, HUC, and
+parameter queries without a request to NWIS.
+
+A SiteCatalog is built from nwis.get_info output, saved to a directory, and
+indexed in memory by site number, by HUC (for prefix queries), by
+parameter code (from the series catalog), and spatially with a KD-tree on
+site coordinates. refresh() requests only sites modified since the catalog
+was built or last refreshed.
+
+Example
+-------
+>>> catalog = SiteCatalog.from_nwis(stateCd='il', siteType='ST')
+>>> catalog.save('il_sites')
+>>> catalog = SiteCatalog.load('il_sites')
+>>> catalog.nearest(41.88, -87.63, k=5)
+>>> catalog.within(41.88, -87.63, radius_km=10, parameterCd='00060')
+>>> catalog.huc('0712', parameterCd='00060')
+>>> catalog.refresh()
+"""
+import heapq
+import json
+import math
+import os
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+
+from data_retrieval import nwis
+from data_retrieval.utils import update_merge
+
+SITENO_COL = 'site_no'
+LAT_COL = 'dec_lat_va'
+LON_COL = 'dec_long_va'
+HUC_COL = 'huc_cd'
+PARAM_COL = 'parm_cd'
+DATA_TYPE_COL = 'data_type_cd'
+
+EARTH_RADIUS_KM = 6371.0088
+
+SITES_FILE = 'sites.csv'
+SERIES_FILE = 'series.csv'
+METADATA_FILE = 'catalog.json'
+
+# read as strings so codes keep their leading zeros
+STRING_COLUMNS = [SITENO_COL, HUC_COL, PARAM_COL, 'agency_cd', 'state_cd',
+                  'county_cd', 'district_cd', 'stat_cd', 'loc_cd', 'ts_id']
+CODE_WIDTHS = {HUC_COL: 8, 'state_cd': 2, 'county_cd': 3, 'district_cd': 2}
+
+
+class SiteCatalog():
+    """Indexed table of NWIS sites and their periods of record.
+    """
+    def __init__(self, sites, series=None, modified=None, query=None):
+        """
+        Parameters
+        ----------
+        sites : DataFrame
+            Site attributes with one row per site, e.g.
+            nwis.get_info(siteOutput='expanded', ...).
+
+        series : DataFrame, optional
+            Period of record of each parameter at each site, e.g.
+            nwis.get_info(seriesCatalogOutput='true', ...).
+
+        modified : string, optional
+            ISO 8601 time the catalog was last brought up to date.
+
+        query : dict, optional
+            The get_info parameters the catalog was built with, reused by
+            refresh.
+        """
+        self.sites = _clean(sites).drop_duplicates(SITENO_COL) \
+                                  .sort_values(SITENO_COL).reset_index(drop=True)
+        self.series = None if series is None else _clean(series)
+        self.modified = modified
+        self.query = query or {}
+        self._build_index()
+
+    @classmethod
+    def from_nwis(cls, **kwargs):
+        """Builds a catalog from get_info.
+
+        NWIS does not return expanded site attributes and the series
+        catalog in one request, so both are requested.
+
+        Parameters
+        ----------
+        kwargs : get_info parameters, which must include a major filter
+            such as stateCd, huc, or bBox.
+        """
+        modified = _now()
+        sites = nwis.get_info(siteOutput='expanded', **kwargs)
+        series = nwis.get_info(seriesCatalogOutput='true', **kwargs)
+
+        return cls(sites, series, modified=modified, query=kwargs)
+
+    @classmethod
+    def load(cls, path):
+        """Loads a catalog saved with save.
+        """
+        with open(os.path.join(path, METADATA_FILE)) as f:
+            metadata = json.load(f)
+
+        sites = _read_csv(os.path.join(path, SITES_FILE))
+        series = None
+        if os.path.exists(os.path.join(path, SERIES_FILE)):
+            series = _read_csv(os.path.join(path, SERIES_FILE))
+
+        return cls(sites, series, modified=metadata['modified'],
+                   query=metadata['query'])
+
+    def save(self, path):
+        """Saves the catalog as csv tables in the directory path.
+        """
+        os.makedirs(path, exist_ok=True)
+
+        self.sites.to_csv(os.path.join(path, SITES_FILE), index=False)
+        if self.series is not None:
+            self.series.to_csv(os.path.join(path, SERIES_FILE), index=False)
+
+        with open(os.path.join(path, METADATA_FILE), 'w') as f:
+            json.dump({'modified': self.modified, 'query': self.query}, f)
+
+    def refresh(self, **kwargs):
+        """Updates sites modified since the catalog was last brought up to
+        date, using get_info's modifiedSince.
+
+        Parameters
+        ----------
+        kwargs : get_info parameters; by default those the catalog was
+            built with.
+
+        Returns
+        -------
+        Number of sites added or updated.
+        """
+        kwargs = {**self.query, **kwargs}
+        modified = _now()
+
+        since = 'PT{}H'.format(max(math.ceil(
+            (pd.Timestamp(modified) - pd.Timestamp(self.modified))
+            / pd.Timedelta(hours=1)), 1))
+
+        sites = nwis.get_info(siteOutput='expanded', modifiedSince=since, **kwargs)
+
+        if sites is None or sites.empty:
+            self.modified = modified
+            return 0
+
+        sites = _clean(sites)
+        self.sites = update_merge(self.sites, sites, on=SITENO_COL, upsert=True)
+
+        if self.series is not None:
+            series = nwis.get_info(seriesCatalogOutput='true',
+                                   modifiedSince=since, **kwargs)
+            keep = ~self.series[SITENO_COL].isin(sites[SITENO_COL])
+            self.series = pd.concat([self.series[keep], _clean(series)],
+                                    ignore_index=True)
+
+        self.modified = modified
+        self._build_index()
+        return len(sites)
+
+    def __len__(self):
+        return len(self.sites)
+
+    def __contains__(self, site_no):
+        return site_no in self._rows
+
+    def get(self, site_no):
+        """Attributes of one site, as a Series.
+        """
+        return self.sites.iloc[self._rows.get_loc(site_no)]
+
+    def nearest(self, lat, lon, k=1, parameterCd=None, data_type=None):
+        """The k sites nearest a point.
+
+        Parameters
+        ----------
+        lat, lon : float
+            Decimal degrees.
+
+        k : int
+            Number of sites.
+
+        parameterCd, data_type : string, optional
+            Only consider sites with a period of record for this parameter,
+            and data type (e.g. 'dv', 'uv', 'qw').
+
+        Returns
+        -------
+        DataFrame of sites ordered by distance, with a distance_km column.
+        """
+        mask = self._parameter_mask(parameterCd, data_type)
+        rows = self._tree.nearest(_unit_vector(lat, lon), k, mask)
+        return self._with_distance(rows, lat, lon)
+
+    def within(self, lat, lon, radius_km, parameterCd=None, data_type=None):
+        """Sites within radius_km of a point, ordered by distance.
+
+        See nearest.
+        """
+        # chord length of the great circle distance
+        chord = 2 * math.sin(min(radius_km / EARTH_RADIUS_KM, math.pi) / 2)
+
+        rows = self._tree.within(_unit_vector(lat, lon), chord)
+        rows = self._filter(rows, parameterCd, data_type)
+        out = self._with_distance(rows, lat, lon)
+        return out[out['distance_km'] <= radius_km]
+
+    def bbox(self, west, south, east, north, parameterCd=None, data_type=None):
+        """Sites within a longitude and latitude bounding box.
+        """
+        start = np.searchsorted(self._lat_sorted, south, side='left')
+        end = np.searchsorted(self._lat_sorted, north, side='right')
+
+        rows = self._lat_order[start:end]
+        lon = self._lon[rows]
+        rows = np.sort(rows[(lon >= west) & (lon <= east)])
+
+        return self.sites.iloc[self._filter(rows, parameterCd, data_type)]
+
+    def huc(self, prefix, parameterCd=None, data_type=None):
+        """Sites whose hydrologic unit code starts with prefix, e.g. '0712'.
+        """
+        first = np.searchsorted(self._hucs, prefix, side='left')
+        last = np.searchsorted(self._hucs, prefix + '~', side='left')
+        rows = np.sort(self._huc_order[self._huc_starts[first]:self._huc_starts[last]])
+
+        return self.sites.iloc[self._filter(rows, parameterCd, data_type)]
+
+    def parameter(self, parameterCd, data_type=None):
+        """Sites with a period of record for parameterCd.
+        """
+        return self.sites.iloc[self._parameter_rows(parameterCd, data_type)]
+
+    def _build_index(self):
+        sites = self.sites
+
+        self._rows = pd.Index(sites[SITENO_COL])
+
+        lat = sites[LAT_COL].values.astype('float64')
+        self._lon = sites[LON_COL].values.astype('float64')
+        located = np.flatnonzero(~np.isnan(lat) & ~np.isnan(self._lon))
+
+        self._lat_order = located[np.argsort(lat[located], kind='mergesort')]
+        self._lat_sorted = lat[self._lat_order]
+        self._lat = lat
+
+        self._tree = _KDTree(_unit_vector(lat[located], self._lon[located]),
+                             located)
+
+        # rows grouped by HUC, with the sorted HUCs for prefix searches
+        huc = sites[HUC_COL] if HUC_COL in sites else pd.Series(np.nan, sites.index)
+        codes, self._hucs = pd.factorize(huc, sort=True)
+        self._hucs = np.asarray(self._hucs, dtype='U')
+        self._huc_order = np.argsort(codes, kind='mergesort')
+        self._huc_starts = np.searchsorted(codes[self._huc_order],
+                                           np.arange(len(self._hucs) + 1))
+
+        self._parameters = {}
+        if self.series is not None and PARAM_COL in self.series:
+            rows = self._rows.get_indexer(self.series[SITENO_COL])
+            valid = rows >= 0
+            series = pd.DataFrame({'row': rows[valid],
+                                   PARAM_COL: self.series[PARAM_COL].values[valid]})
+            keys = [PARAM_COL]
+
+            if DATA_TYPE_COL in self.series:
+                series[DATA_TYPE_COL] = self.series[DATA_TYPE_COL].values[valid]
+                keys.append([PARAM_COL, DATA_TYPE_COL])
+
+            for key in keys:
+                for name, group in series.groupby(key)['row']:
+                    self._parameters[name] = np.unique(group.values)
+
+    def _parameter_rows(self, parameterCd, data_type=None):
+        if self.series is None:
+            raise ValueError('The catalog has no series catalog')
+
+        key = parameterCd if data_type is None else (parameterCd, data_type)
+        return self._parameters.get(key, np.array([], dtype='int64'))
+
+    def _parameter_mask(self, parameterCd, data_type):
+        if parameterCd is None:
+            return None
+
+        mask = np.zeros(len(self.sites), dtype=bool)
+        mask[self._parameter_rows(parameterCd, data_type)] = True
+        return mask
+
+    def _filter(self, rows, parameterCd, data_type):
+        if parameterCd is None:
+            return rows
+
+        return rows[np.isin(rows, self._parameter_rows(parameterCd, data_type))]
+
+    def _with_distance(self, rows, lat, lon):
+        out = self.sites.iloc[rows].copy()
+        out['distance_km'] = _haversine(lat, lon, self._lat[rows], self._lon[rows])
+        return out.sort_values('distance_km', kind='mergesort')
+
+
+class _KDTree():
+    """Static KD-tree of points in 3-d, for nearest and radius queries.
+
+    Nodes are stored in arrays; the points of node i are
+    ids[start[i]:end[i]], and leaves hold at most leaf_size points.
+    """
+    def __init__(self, points, ids, leaf_size=128):
+        self.points = points
+        self.ids = np.asarray(ids)
+        self.order = np.arange(len(points))
+
+        start, end, children = [], [], []
+        stack = [(0, len(points), -1, 0)]
+
+        while stack:
+            lo, hi, parent, side = stack.pop()
+            node = len(start)
+            if parent >= 0:
+                children[parent][side] = node
+
+            start.append(lo)
+            end.append(hi)
+            children.append([-1, -1])
+
+            if hi - lo > leaf_size:
+                # split at the median of the widest dimension of a sample
+                sample = points[self.order[lo:hi:max((hi - lo) // 1024, 1)]]
+                dim = np.argmax(sample.max(axis=0) - sample.min(axis=0))
+                mid = (lo + hi) // 2
+                part = np.argpartition(points[self.order[lo:hi], dim], mid - lo)
+                self.order[lo:hi] = self.order[lo:hi][part]
+                stack.append((mid, hi, node, 1))
+                stack.append((lo, mid, node, 0))
+
+        self.start = np.array(start)
+        self.end = np.array(end)
+        self.children = np.array(children)
+        self.sorted_points = points[self.order]
+
+        # bounding boxes of the leaves, then of each parent from its
+        # children, which are always numbered after it
+        self.lower = np.zeros((len(start), 3))
+        self.upper = np.zeros((len(start), 3))
+
+        leaves = np.flatnonzero((self.children[:, 0] < 0)
+                                & (self.end > self.start))
+        if len(leaves):
+            self.lower[leaves] = np.minimum.reduceat(self.sorted_points,
+                                                     self.start[leaves])
+            self.upper[leaves] = np.maximum.reduceat(self.sorted_points,
+                                                     self.start[leaves])
+
+        lower, upper = self.lower, self.upper
+        for node in np.flatnonzero(self.children[:, 0] >= 0)[::-1]:
+            left, right = self.children[node]
+            lower[node] = np.minimum(lower[left], lower[right])
+            upper[node] = np.maximum(upper[left], upper[right])
+
+    def _box_distance(self, node, point):
+        gap = np.maximum(np.maximum(self.lower[node] - point,
+                                    point - self.upper[node]), 0)
+        return math.sqrt(gap.dot(gap))
+
+    def nearest(self, point, k, mask=None):
+        """Ids of the k points nearest point, skipping ids where mask is
+        False.
+        """
+        best = []  # max-heap of (-distance, id)
+        queue = [(0.0, 0)]
+
+        while queue:
+            distance, node = heapq.heappop(queue)
+            if len(best) == k and distance > -best[0][0]:
+                break
+
+            left, right = self.children[node]
+            if left >= 0:
+                for child in (left, right):
+                    heapq.heappush(queue, (self._box_distance(child, point), child))
+                continue
+
+            lo, hi = self.start[node], self.end[node]
+            ids = self.ids[self.order[lo:hi]]
+            d = np.sqrt(((self.sorted_points[lo:hi] - point) ** 2).sum(axis=1))
+            if mask is not None:
+                keep = mask[ids]
+                ids, d = ids[keep], d[keep]
+
+            for dist, i in zip(d, ids):
+                if len(best) < k:
+                    heapq.heappush(best, (-dist, i))
+                elif dist < -best[0][0]:
+                    heapq.heapreplace(best, (-dist, i))
+
+        return np.array([i for _, i in sorted(best, reverse=True)], dtype='int64')
+
+    def within(self, point, radius):
+        """Ids of the points within radius of point.
+        """
+        found = []
+        stack = [0]
+
+        while stack:
+            node = stack.pop()
+            if self._box_distance(node, point) > radius:
+                continue
+
+            left, right = self.children[node]
+            if left >= 0:
+                stack.extend((left, right))
+                continue
+
+            lo, hi = self.start[node], self.end[node]
+            d = ((self.sorted_points[lo:hi] - point) ** 2).sum(axis=1)
+            found.append(self.ids[self.order[lo:hi]][d <= radius ** 2])
+
+        if not found:
+            return np.array([], dtype='int64')
+
+        return np.sort(np.concatenate(found))
+
+
+def _unit_vector(lat, lon):
+    """Converts decimal degrees to points on the unit sphere.
+    """
+    lat, lon = np.radians(lat), np.radians(lon)
+    return np.stack([np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon),
+                     np.sin(lat)], axis=-1)
+
+
+def _haversine(lat, lon, lats, lons):
+    """Great circle distance in km from one point to arrays of points.
+    """
+    lat, lon, lats, lons = map(np.radians, (lat, lon, lats, lons))
+    a = (np.sin((lats - lat) / 2) ** 2
+         + np.cos(lat) * np.cos(lats) * np.sin((lons - lon) / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+
+def _clean(df):
+    """Keeps codes as strings and coordinates as floats.
+    """
+    df = df.reset_index() if SITENO_COL not in df else df.copy()
+
+    for column in STRING_COLUMNS:
+        if column in df and pd.api.types.is_numeric_dtype(df[column]):
+            # codes read as numbers lose their leading zeros
+            values = df[column]
+            valid = values.notnull().values
+            codes = values.values[valid].astype('int64').astype('U')
+            if column in CODE_WIDTHS:
+                codes = np.char.zfill(codes, CODE_WIDTHS[column])
+
+            df[column] = np.nan
+            df[column] = df[column].astype(object)
+            df.loc[valid, column] = codes.astype(object)
+
+    for column in (LAT_COL, LON_COL):
+        if column in df:
+            df[column] = pd.to_numeric(df[column], errors='coerce')
+
+    return df
+
+
+def _read_csv(path):
+    return _clean(pd.read_csv(path, dtype={column: str for column in STRING_COLUMNS}))
+
+
+def _now():
+    return datetime.now(timezone.utc).isoformat()
@@ -0,0 +1,48 @@
+"""
+The data-retrieval command.
+
+    $ data-retrieval bulk manifest.json --output pulls
+
+See data_retrieval.bulk for the manifest format.
+"""
+import argparse
+import sys
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='data-retrieval',
+        description='Download data from NWIS and the Water Quality Portal.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    bulk = subparsers.add_parser(
+        'bulk', help='download the jobs of a manifest, resuming where a '
+                     'previous run stopped')
+    bulk.add_argument('manifest', help='json manifest of jobs')
+    bulk.add_argument('-o', '--output', default='.',
+                      help='directory for the partitioned output')
+    bulk.add_argument('--checkpoint',
+                      help='SQLite checkpoint; OUTPUT/checkpoint.sqlite by default')
+    bulk.add_argument('-w', '--workers', type=int, default=4,
+                      help='number of concurrent downloads')
+    bulk.add_argument('--format', choices=['parquet', 'csv'], default='parquet',
+                      help='output format')
+    bulk.add_argument('-q', '--quiet', action='store_true',
+                      help='do not report each unit')
+
+    args = parser.parse_args(argv)
+
+    # imported here so that --help does not import pandas
+    from data_retrieval import bulk as bulk_download
+
+    summary = bulk_download.run(args.manifest, args.output,
+                                checkpoint=args.checkpoint,
+                                max_workers=args.workers, format=args.format,
+                                log=None if args.quiet else sys.stderr)
+    print(bulk_download.format_summary(summary))
+
+    return 1 if summary['failed'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,2 +1,4 @@
 from data_retrieval.codes.states import *
 from data_retrieval.codes.timezones import *
+from data_retrieval.codes.qualifiers import *
+from data_retrieval.codes.parameters import *
@@ -0,0 +1,37 @@
+"""
+Frequently used NWIS parameter codes.
+
+This is only a starting set; CodeStore.refresh downloads the full table
+with nwis.get_pmcodes.
+"""
+
+parameter_codes = {
+    '00010': {'name': 'Temperature, water, degrees Celsius',
+              'group': 'Physical', 'units': 'deg C'},
+    '00020': {'name': 'Temperature, air, degrees Celsius',
+              'group': 'Physical', 'units': 'deg C'},
+    '00045': {'name': 'Precipitation, total, inches',
+              'group': 'Physical', 'units': 'in'},
+    '00060': {'name': 'Discharge, cubic feet per second',
+              'group': 'Physical', 'units': 'ft3/s'},
+    '00065': {'name': 'Gage height, feet',
+              'group': 'Physical', 'units': 'ft'},
+    '00095': {'name': 'Specific conductance, water, unfiltered, microsiemens '
+                      'per centimeter at 25 degrees Celsius',
+              'group': 'Physical', 'units': 'uS/cm @25C'},
+    '00300': {'name': 'Dissolved oxygen, water, unfiltered, milligrams per liter',
+              'group': 'Inorganics, Major, Non-metals', 'units': 'mg/l'},
+    '00400': {'name': 'pH, water, unfiltered, field, standard units',
+              'group': 'Physical', 'units': 'std units'},
+    '63680': {'name': 'Turbidity, water, unfiltered, monochrome near infra-red '
+                      'LED light, 780-900 nm, detection angle 90 +-2.5 degrees, '
+                      'formazin nephelometric units (FNU)',
+              'group': 'Physical', 'units': 'FNU'},
+    '72019': {'name': 'Depth to water level, feet below land surface',
+              'group': 'Physical', 'units': 'ft'},
+    '80154': {'name': 'Suspended sediment concentration, milligrams per liter',
+              'group': 'Sediment', 'units': 'mg/l'},
+    '99133': {'name': 'Nitrate plus nitrite, water, in situ, milligrams per '
+                      'liter as nitrogen',
+              'group': 'Nutrient', 'units': 'mg/l as N'},
+}
@@ -0,0 +1,26 @@
+"""
+Qualification codes of NWIS instantaneous and daily values, as returned in
+the _cd columns of get_iv and get_dv.
+"""
+
+qualifier_codes = {
+    'A': 'Approved for publication -- Processing and review completed.',
+    'P': 'Provisional data subject to revision.',
+    'e': 'Value has been estimated.',
+    '<': 'Actual value is known to be less than reported value.',
+    '>': 'Actual value is known to be greater than reported value.',
+    'R': 'Records for these data have been revised.',
+    'Bkw': 'Flow affected by backwater.',
+    'Dis': 'Data-collection discontinued.',
+    'Dry': 'Dry.',
+    'Eqp': 'Equipment malfunction.',
+    'Fld': 'Flood damage.',
+    'Ice': 'Ice affected.',
+    'Mnt': 'Maintenance in progress.',
+    'Pr': 'Partial-record site.',
+    'Rat': 'Rating being developed or revised.',
+    'Ssn': 'Parameter monitored seasonally.',
+    'Zfl': 'Zero flow.',
+    '***': 'Temporarily unavailable.',
+    '--': 'Parameter not determined.',
+}
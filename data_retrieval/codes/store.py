@@ -0,0 +1,252 @@
+"""
+Versioned local store of NWIS reference tables: parameter codes, value
+qualification codes, time zone codes, and state codes.
+
+Each table is a json file holding a dict keyed by code, so lookups are a
+single dict access and need no request. Refreshing a table writes a new
+version beside the old ones and makes it current; earlier versions stay
+available. Tables that have never been refreshed are served from the
+copies bundled with the package.
+
+The store lives in ~/.cache/data_retrieval/codes, or the directory named by
+the DATA_RETRIEVAL_CODES environment variable.
+
+Example
+-------
+>>> store = CodeStore()
+>>> store.lookup('parameters', '00060')['units']
+'ft3/s'
+>>> store.refresh(['parameters'])
+
+or from the command line
+
+    $ python -m data_retrieval.codes.store refresh parameters
+"""
+import argparse
+import json
+import os
+import re
+from datetime import datetime, timezone
+
+from data_retrieval.codes.parameters import parameter_codes
+from data_retrieval.codes.qualifiers import qualifier_codes
+from data_retrieval.codes.states import state_names
+from data_retrieval.codes.timezones import tz
+
+BUNDLED = {'parameters': parameter_codes,
+           'qualifiers': qualifier_codes,
+           'timezones': tz,
+           'states': state_names}
+
+TABLES = list(BUNDLED)
+
+INDEX_FILE = 'index.json'
+BUNDLED_VERSION = 'bundled'
+
+
+def default_path():
+    return os.environ.get('DATA_RETRIEVAL_CODES',
+                          os.path.join(os.path.expanduser('~'), '.cache',
+                                       'data_retrieval', 'codes'))
+
+
+class CodeStore():
+    """Reference tables keyed by code, loaded on first use.
+    """
+    def __init__(self, path=None, versions=None):
+        """
+        Parameters
+        ----------
+        path : string, optional
+            Directory of the store. See default_path.
+
+        versions : dict, optional
+            Version to use for each table, e.g. {'parameters': '20180124'};
+            the current version otherwise.
+        """
+        self.path = path or default_path()
+        self.pinned = versions or {}
+        self._tables = {}
+
+    def version(self, table):
+        """The version of table in use; 'bundled' if it was never refreshed.
+        """
+        if table in self.pinned:
+            return self.pinned[table]
+
+        return self._index().get(table, {}).get('current', BUNDLED_VERSION)
+
+    def versions(self, table):
+        """All stored versions of table, oldest first.
+        """
+        return self._index().get(table, {}).get('versions', [])
+
+    def table(self, table):
+        """The dict of code to record for table.
+        """
+        if table not in TABLES:
+            raise TypeError('Unrecognized table: {}'.format(table))
+
+        if table not in self._tables:
+            version = self.version(table)
+
+            if version == BUNDLED_VERSION:
+                self._tables[table] = BUNDLED[table]
+            else:
+                with open(self._filename(table, version)) as f:
+                    self._tables[table] = json.load(f)
+
+        return self._tables[table]
+
+    def lookup(self, table, code, default=None):
+        """The record of code in table.
+        """
+        return self.table(table).get(code, default)
+
+    def units(self, parameterCd):
+        """Units of a parameter code, or None if the code is unknown.
+        """
+        record = self.lookup('parameters', parameterCd)
+        return record.get('units') if record else None
+
+    def column_units(self, columns):
+        """Units of NWIS data columns, from the parameter codes in their names.
+
+        Columns named like read_json output (00060, 00060_Mean) or rdb
+        output (69928_00060, 69929_00060_00003, where the parameter code
+        follows the time series id) are recognized. Qualifier (_cd) columns
+        are skipped.
+
+        Returns
+        -------
+        dict of column to units.
+        """
+        units = {}
+
+        for column in columns:
+            column = str(column)
+            if column.endswith('_cd'):
+                continue
+
+            codes = [token for token in column.split('_')
+                     if re.fullmatch(r'\d{5}', token)]
+            if not codes:
+                continue
+
+            code = codes[1] if len(codes) > 1 else codes[0]
+            unit = self.units(code)
+            if unit:
+                units[column] = unit
+
+        return units
+
+    def refresh(self, tables=None):
+        """Downloads or rebuilds tables and makes the new versions current.
+
+        Parameter codes are downloaded with nwis.get_pmcodes. The other
+        tables are written from the copies bundled with the package.
+
+        Returns
+        -------
+        dict of table to new version.
+        """
+        tables = TABLES if tables is None else tables
+        for table in tables:
+            if table not in TABLES:
+                raise TypeError('Unrecognized table: {}'.format(table))
+
+        index = self._index()
+        version = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+        os.makedirs(self.path, exist_ok=True)
+
+        for table in tables:
+            if table == 'parameters':
+                data = _download_parameters()
+            else:
+                data = BUNDLED[table]
+
+            _write_json(self._filename(table, version), data)
+
+            entry = index.setdefault(table, {'versions': []})
+            entry['versions'].append(version)
+            entry['current'] = version
+            self._tables.pop(table, None)
+
+        _write_json(os.path.join(self.path, INDEX_FILE), index)
+        return {table: version for table in tables}
+
+    def _index(self):
+        filename = os.path.join(self.path, INDEX_FILE)
+        if not os.path.exists(filename):
+            return {}
+
+        with open(filename) as f:
+            return json.load(f)
+
+    def _filename(self, table, version):
+        return os.path.join(self.path, '{}-{}.json'.format(table, version))
+
+
+def _download_parameters():
+    from data_retrieval.nwis import get_pmcodes
+
+    df = get_pmcodes()
+    columns = {'parameter_nm': 'name', 'parameter_group_nm': 'group',
+               'parameter_units': 'units', 'casrn': 'casrn',
+               'srsname': 'srsname'}
+    df = df.rename(columns=columns)
+    df = df.astype(object).where(df.notnull(), None)
+
+    return {code: {key: record[key] for key in columns.values() if key in record}
+            for code, record in zip(df['parameter_cd'],
+                                    df.to_dict(orient='records'))}
+
+
+def _write_json(filename, data):
+    with open(filename + '.tmp', 'w') as f:
+        json.dump(data, f)
+
+    os.replace(filename + '.tmp', filename)
+
+
+_default_store = None
+
+
+def default_store():
+    """The CodeStore at default_path, shared by read_json and read_rdb.
+    """
+    global _default_store
+    if _default_store is None:
+        _default_store = CodeStore()
+
+    return _default_store
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m data_retrieval.codes.store',
+        description='Manage the local store of NWIS reference tables.')
+    parser.add_argument('--path', help='store directory')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    refresh = subparsers.add_parser('refresh', help='download or rebuild tables')
+    refresh.add_argument('tables', nargs='*',
+                         help='any of {}; all by default'.format(', '.join(TABLES)))
+
+    subparsers.add_parser('versions', help='list stored versions')
+
+    args = parser.parse_args(argv)
+    store = CodeStore(args.path)
+
+    if args.command == 'refresh':
+        for table, version in store.refresh(args.tables or None).items():
+            print('{}: {}'.format(table, version))
+
+    else:
+        for table in TABLES:
+            print('{}: {} (stored: {})'.format(table, store.version(table),
+                                             ', '.join(store.versions(table)) or 'none'))
+
+
+if __name__ == '__main__':
+    main()
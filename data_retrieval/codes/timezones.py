@@ -1,7 +1,88 @@
 """
 Time zone information
+
+Maps time zone abbreviations to UTC offsets. The table is written out as
+a literal, grouped by offset, so nothing is parsed on import.
 """
 
+tz = {
+    'Y': '-1200',
+    'X': '-1100', 'NUT': '-1100', 'SST': '-1100',
+    'W': '-1000', 'CKT': '-1000', 'HAST': '-1000', 'HST': '-1000',
+    'TAHT': '-1000', 'TKT': '-1000',
+    'V': '-0900', 'AKST': '-0900', 'GAMT': '-0900', 'GIT': '-0900',
+    'HADT': '-0900', 'HNY': '-0900',
+    'U': '-0800', 'AKDT': '-0800', 'CIST': '-0800', 'HAY': '-0800',
+    'HNP': '-0800', 'PST': '-0800', 'PT': '-0800',
+    'T': '-0700', 'HAP': '-0700', 'HNR': '-0700', 'MST': '-0700',
+    'PDT': '-0700',
+    'S': '-0600', 'CST': '-0600', 'EAST': '-0600', 'GALT': '-0600',
+    'HAR': '-0600', 'HNC': '-0600', 'MDT': '-0600',
+    'R': '-0500', 'CDT': '-0500', 'COT': '-0500', 'EASST': '-0500',
+    'ECT': '-0500', 'EST': '-0500', 'ET': '-0500', 'HAC': '-0500',
+    'HNE': '-0500', 'PET': '-0500',
+    'Q': '-0400', 'AST': '-0400', 'BOT': '-0400', 'CLT': '-0400',
+    'COST': '-0400', 'EDT': '-0400', 'FKT': '-0400', 'GYT': '-0400',
+    'HAE': '-0400', 'HNA': '-0400', 'PYT': '-0400',
+    'P': '-0300', 'ADT': '-0300', 'ART': '-0300', 'BRT': '-0300',
+    'CLST': '-0300', 'FKST': '-0300', 'GFT': '-0300', 'HAA': '-0300',
+    'PMST': '-0300', 'PYST': '-0300', 'SRT': '-0300', 'UYT': '-0300',
+    'WGT': '-0300',
+    'O': '-0200', 'BRST': '-0200', 'FNT': '-0200', 'PMDT': '-0200',
+    'UYST': '-0200', 'WGST': '-0200',
+    'N': '-0100', 'AZOT': '-0100', 'CVT': '-0100', 'EGT': '-0100',
+    'Z': '+0000', 'EGST': '+0000', 'GMT': '+0000', 'UTC': '+0000',
+    'WET': '+0000', 'WT': '+0000',
+    'A': '+0100', 'CET': '+0100', 'DFT': '+0100', 'WAT': '+0100',
+    'WEDT': '+0100', 'WEST': '+0100',
+    'B': '+0200', 'CAT': '+0200', 'CEDT': '+0200', 'CEST': '+0200',
+    'EET': '+0200', 'SAST': '+0200', 'WAST': '+0200',
+    'C': '+0300', 'EAT': '+0300', 'EEDT': '+0300', 'EEST': '+0300',
+    'IDT': '+0300', 'MSK': '+0300',
+    'D': '+0400', 'AMT': '+0400', 'AZT': '+0400', 'GET': '+0400',
+    'GST': '+0400', 'KUYT': '+0400', 'MSD': '+0400', 'MUT': '+0400',
+    'RET': '+0400', 'SAMT': '+0400', 'SCT': '+0400',
+    'E': '+0500', 'AMST': '+0500', 'AQTT': '+0500', 'AZST': '+0500',
+    'HMT': '+0500', 'MAWT': '+0500', 'MVT': '+0500', 'PKT': '+0500',
+    'TFT': '+0500', 'TJT': '+0500', 'TMT': '+0500', 'UZT': '+0500',
+    'YEKT': '+0500',
+    'F': '+0600', 'ALMT': '+0600', 'BIOT': '+0600', 'BTT': '+0600',
+    'IOT': '+0600', 'KGT': '+0600', 'NOVT': '+0600', 'OMST': '+0600',
+    'YEKST': '+0600',
+    'G': '+0700', 'CXT': '+0700', 'DAVT': '+0700', 'HOVT': '+0700',
+    'ICT': '+0700', 'KRAT': '+0700', 'NOVST': '+0700', 'OMSST': '+0700',
+    'THA': '+0700', 'WIB': '+0700',
+    'H': '+0800', 'ACT': '+0800', 'AWST': '+0800', 'BDT': '+0800',
+    'BNT': '+0800', 'CAST': '+0800', 'HKT': '+0800', 'IRKT': '+0800',
+    'KRAST': '+0800', 'MYT': '+0800', 'PHT': '+0800', 'SGT': '+0800',
+    'ULAT': '+0800', 'WITA': '+0800', 'WST': '+0800',
+    'I': '+0900', 'AWDT': '+0900', 'IRKST': '+0900', 'JST': '+0900',
+    'KST': '+0900', 'PWT': '+0900', 'TLT': '+0900', 'WDT': '+0900',
+    'WIT': '+0900', 'YAKT': '+0900',
+    'K': '+1000', 'AEST': '+1000', 'ChST': '+1000', 'PGT': '+1000',
+    'VLAT': '+1000', 'YAKST': '+1000', 'YAPT': '+1000',
+    'L': '+1100', 'AEDT': '+1100', 'LHDT': '+1100', 'MAGT': '+1100',
+    'NCT': '+1100', 'PONT': '+1100', 'SBT': '+1100', 'VLAST': '+1100',
+    'VUT': '+1100',
+    'M': '+1200', 'ANAST': '+1200', 'ANAT': '+1200', 'FJT': '+1200',
+    'GILT': '+1200', 'MAGST': '+1200', 'MHT': '+1200', 'NZST': '+1200',
+    'PETST': '+1200', 'PETT': '+1200', 'TVT': '+1200', 'WFT': '+1200',
+    'FJST': '+1330', 'NZDT': '+1330',
+    'NFT': '+1130',
+    'ACDT': '+1030', 'LHST': '+1030',
+    'ACST': '+0930',
+    'CCT': '+0630', 'MMT': '+0630',
+    'NPT': '+0545',
+    'SLT': '+0530',
+    'AFT': '+0430', 'IRDT': '+0430',
+    'IRST': '+0330',
+    'HAT': '-0230', 'NDT': '-0230',
+    'HNT': '-0330', 'NST': '-0330', 'NT': '-0330',
+    'HLV': '-0430', 'VET': '-0430',
+    'MART': '-0930', 'MIT': '-0930',
+}
+
+# the same table as text, one offset per line followed by its abbreviations
 tz_str = '''-1200 Y
 -1100 X NUT SST
 -1000 W CKT HAST HST TAHT TKT
@@ -40,9 +121,3 @@ tz_str = '''-1200 Y
 -0330 HNT NST NT
 -0430 HLV VET
 -0930 MART MIT'''
-
-tz = {}
-for tz_descr in map(str.split, tz_str.split('\n')):
-    tz_offset = tz_descr[0]
-    for tz_code in tz_descr[1:]:
-        tz[tz_code] = tz_offset
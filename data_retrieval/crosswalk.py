@@ -0,0 +1,228 @@
+"""
+Crosswalk between NWIS sites and Water Quality Portal (WQP) sites.
+
+WQP identifies a site by its agency code and site number joined by a
+hyphen, e.g. USGS-03339000 for NWIS site 03339000. The functions here build
+those identifiers from NWIS frames or site lists, request WQP results for
+many sites in as few requests as the URL length allows, concurrently, and
+join the results to NWIS instantaneous values (iv) by site and nearest time.
+
+Example
+-------
+>>> sites = nwis.get_info(stateCd='il', parameterCd='00060')
+>>> results = crosswalk.get_results(sites, characteristicName='Nitrate',
+...                                 startDateLo='01-01-2017')
+>>> iv = nwis.get_iv(sites=list(sites['site_no']), startDT='2017-01-01',
+...                  parameterCd='00060')
+>>> crosswalk.join_iv(results, iv, tolerance='30min')
+"""
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from data_retrieval import wqp
+from data_retrieval.utils import mmerge_asof
+
+SITENO_COL = 'site_no'
+AGENCY_COL = 'agency_cd'
+SITEID_COL = 'MonitoringLocationIdentifier'
+DATETIME_COL = 'datetime'
+WQP_DATETIME_COL = 'ActivityStartDateTime'
+
+DEFAULT_AGENCY = 'USGS'
+
+# length of the url-encoded siteid parameter of one request, chosen to keep
+# the whole url well within the 8 KB that servers commonly accept
+MAX_SITEID_LENGTH = 6000
+# separator of siteid values, ';', is url-encoded as %3B
+SEPARATOR_LENGTH = 3
+
+
+def crosswalk(sites, agency=DEFAULT_AGENCY):
+    """Table of NWIS site numbers and their WQP site identifiers.
+
+    Parameters
+    ----------
+    sites : DataFrame or list
+        NWIS frame with a site_no column or index level (and optionally
+        agency_cd), or a list of site numbers, which may be prefixed with an
+        agency code and a colon, e.g. 'USGS:03339000'.
+
+    agency : string
+        Agency code of sites that do not give one.
+
+    Returns
+    -------
+    DataFrame with columns agency_cd, site_no, and MonitoringLocationIdentifier,
+    one row per site.
+    """
+    if isinstance(sites, pd.DataFrame):
+        df = sites.reset_index() if SITENO_COL in sites.index.names else sites
+
+        if SITENO_COL not in df:
+            raise TypeError('sites has no {} column'.format(SITENO_COL))
+
+        site_no = df[SITENO_COL].astype(str)
+        agencies = df[AGENCY_COL].astype(str) if AGENCY_COL in df else agency
+
+        table = pd.DataFrame({AGENCY_COL: agencies, SITENO_COL: site_no})
+
+    else:
+        sites = [sites] if isinstance(sites, str) else sites
+        pairs = [str(site).split(':', 1) if ':' in str(site) else (agency, str(site))
+                 for site in sites]
+        table = pd.DataFrame(pairs, columns=[AGENCY_COL, SITENO_COL])
+
+    table = table.drop_duplicates().reset_index(drop=True)
+    table[SITEID_COL] = table[AGENCY_COL] + '-' + table[SITENO_COL]
+
+    return table
+
+
+def siteid_batches(siteids, max_length=MAX_SITEID_LENGTH):
+    """Packs WQP site identifiers into batches for the siteid parameter.
+
+    Identifiers are taken in sorted order and each batch is filled until the
+    next identifier would make its url-encoded length exceed max_length.
+    Site identifiers of one agency have nearly equal lengths, so this gives
+    the fewest batches.
+
+    Returns
+    -------
+    list of lists of site identifiers.
+    """
+    batches = []
+    batch, length = [], 0
+
+    for siteid in sorted(set(siteids)):
+        size = len(siteid) + (SEPARATOR_LENGTH if batch else 0)
+
+        if batch and length + size > max_length:
+            batches.append(batch)
+            batch, length = [], 0
+            size = len(siteid)
+
+        batch.append(siteid)
+        length += size
+
+    if batch:
+        batches.append(batch)
+
+    return batches
+
+
+def get_results(sites, agency=DEFAULT_AGENCY, max_workers=4, retries=2,
+                max_length=MAX_SITEID_LENGTH, **kwargs):
+    """Requests WQP results for NWIS sites.
+
+    The sites are packed into batches (see siteid_batches), which are
+    requested concurrently with wqp.get_results.
+
+    Parameters
+    ----------
+    sites : DataFrame or list
+        NWIS sites; see crosswalk.
+
+    agency : string
+        Agency code of sites that do not give one.
+
+    max_workers : int
+        Number of batches requested at once.
+
+    retries : int
+        Number of times a failed request is retried.
+
+    kwargs : other wqp.get_results parameters, e.g. characteristicName or
+        startDateLo.
+
+    Returns
+    -------
+    DataFrame of results with a site_no column added.
+    """
+    table = crosswalk(sites, agency=agency)
+    batches = siteid_batches(table[SITEID_COL], max_length=max_length)
+
+    usecols = kwargs.get('usecols')
+    if usecols is not None and SITEID_COL not in usecols:
+        kwargs['usecols'] = [SITEID_COL] + list(usecols)
+
+    def fetch(batch):
+        return wqp.get_results(siteid=';'.join(batch), retries=retries, **kwargs)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        frames = [frame for frame in executor.map(fetch, batches)
+                  if frame is not None]
+
+    df = wqp.concat_frames(frames)
+
+    if df.empty:
+        return df
+
+    # map each distinct identifier once, as there are many results per site
+    site_no = pd.Series(table[SITENO_COL].values, index=table[SITEID_COL].values)
+    codes, uniques = pd.factorize(df[SITEID_COL].astype(object))
+    mapped = site_no.reindex(uniques).values
+    df[SITENO_COL] = np.append(mapped, None)[codes]
+
+    return df
+
+
+def join_iv(results, iv, tolerance='30min', direction='nearest',
+            datetime=WQP_DATETIME_COL):
+    """Joins WQP results to the NWIS iv value of the same site nearest in
+    time.
+
+    Results and values are matched on site_no and time (UTC) with
+    utils.mmerge_asof, which searches the values of each site for its
+    results, without joining site by site.
+
+    Parameters
+    ----------
+    results : DataFrame
+        WQP results with a site_no column, e.g. from get_results.
+
+    iv : DataFrame
+        NWIS iv values indexed by site_no and datetime, or by datetime with
+        a site_no column, as returned by nwis.get_iv.
+
+    tolerance : string or Timedelta, optional
+        Largest time difference of a match; values further away are NaN.
+
+    direction : string ('backward', 'forward', or 'nearest')
+        Whether to match the last value before, the first after, or the
+        closest value to each result.
+
+    datetime : string
+        Column of results holding the time of each result.
+
+    Returns
+    -------
+    DataFrame of results indexed by site_no and datetime, with the matching
+    iv columns; results without a time are dropped.
+    """
+    left = results.rename(columns={datetime: DATETIME_COL})
+    left = _site_time_index(left)
+    right = _site_time_index(iv)
+
+    if tolerance is not None:
+        tolerance = pd.Timedelta(tolerance)
+
+    return mmerge_asof(left, right, tolerance=tolerance, direction=direction,
+                       suffixes=('', '_iv'))
+
+
+def _site_time_index(df):
+    """Indexes df by site_no and UTC datetime.
+    """
+    df = df.reset_index() if any(name is not None for name in df.index.names) \
+        else df
+
+    for column in (SITENO_COL, DATETIME_COL):
+        if column not in df:
+            raise TypeError('Frame has no {} column or index level'.format(column))
+
+    df = df.assign(**{SITENO_COL: df[SITENO_COL].astype(str),
+                      DATETIME_COL: pd.to_datetime(df[DATETIME_COL], utc=True)})
+
+    return df.set_index([SITENO_COL, DATETIME_COL])
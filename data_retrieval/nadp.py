@@ -16,6 +16,7 @@ Notes
 -----
 Gridded data on NADP is served as zipped tif files. Functions in this module will either download and extract the data,
 when a path is specified, or open the data as a GDAL memory-mmapped file when no path is specified.
+GDAL is imported only when a grid is opened, so the rest of the module works without it.
 
 
 Todo list
@@ -25,16 +26,20 @@ Todo list
 - add tests
 """
 
-import requests
+import json
 import zipfile
-import io
 import os
 import re
-import gdal
+import numpy as np
+import pandas as pd
 
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from os.path import basename
 from uuid import uuid4
 
+from data_retrieval.remotezip import open_zip
+
 NADP_URL = 'https://nadp.slh.wisc.edu'
 NADP_MAP_EXT = 'maplib/grids'
 
@@ -43,16 +48,25 @@ NTN_DEP_PARAMS  = ['H','So4','NO3','NH4','Ca','Mg','K','Na','Cl','Br','N','SPlus
 
 NTN_MEAS_TYPE = ['conc','dep','precip'] #concentration or deposition
 
+SITENO_COL = 'site_no'
+
+CUBE_FILE = 'cube.npy'
+METADATA_FILE = 'metadata.json'
+
 
 class GDALMemFile():
     """Creates a GDAL memmory-mapped file
 
-    Modeled after rasterio function of same name
+    Modeled after rasterio function of same name. Used as a context manager,
+    the in-memory file is unlinked on exit, so looping over many grids does
+    not accumulate memory.
 
     Example
     ------
-    >>> with GDALMemFile(buf).open() as dataset:
-            # do something
+    >>> with GDALMemFile(buf) as memfile:
+            window, (xoff, yoff) = memfile.read_window(100, 200, 50, 50)
+            grid = memfile.array()
+            roi = grid[1000:1100, 2000:2200] # reads only the blocks needed
 
     TODO
     ----
@@ -66,16 +80,198 @@ class GDALMemFile():
             Buffer containing gdal formatted data.
         """
         self.buf = buf
+        self.name = None
+        self.dataset = None
 
     def open(self):
-        """
+        """Opens the buffer as a GDAL dataset.
+
+        Call close (or use GDALMemFile as a context manager) to free the
+        in-memory file.
 
         see gist.github.com/jleinonen/5781308 gdal_mmap.py
         """
-        mmap_name = '/vsimem/' + uuid4().hex #vsimem is special GDAL string
-        gdal.FileFromMemBuffer(mmap_name, self.buf)
+        import gdal
+
+        if self.name is None:
+            self.name = '/vsimem/' + uuid4().hex #vsimem is special GDAL string
+            gdal.FileFromMemBuffer(self.name, self.buf)
+
+        self.dataset = gdal.Open(self.name)
+        return self.dataset
+
+    def close(self):
+        """Closes the dataset and unlinks the in-memory file.
+        """
+        import gdal
+
+        # GDAL closes a dataset when its last reference is dropped
+        self.dataset = None
+
+        if self.name is not None:
+            gdal.Unlink(self.name)
+            self.name = None
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def read_window(self, xoff, yoff, xsize, ysize, band=1):
+        """Reads a window expanded outward to whole blocks.
+
+        GDAL decodes whole blocks, so aligning a window to them costs no
+        extra decoding.
+
+        Parameters
+        ----------
+        xoff, yoff : int
+            Column and row of the upper left corner of the window.
+
+        xsize, ysize : int
+            Number of columns and rows in the window.
+
+        band : int
+
+        Returns
+        -------
+        array : numpy.ndarray
+            Values of the block-aligned window.
+
+        offset : tuple
+            Column and row of the upper left corner of array.
+        """
+        raster = self.dataset.GetRasterBand(band)
+        block_x, block_y = raster.GetBlockSize()
+
+        x0 = max(xoff // block_x * block_x, 0)
+        y0 = max(yoff // block_y * block_y, 0)
+        x1 = min(-(-(xoff + xsize) // block_x) * block_x, raster.XSize)
+        y1 = min(-(-(yoff + ysize) // block_y) * block_y, raster.YSize)
+
+        return raster.ReadAsArray(x0, y0, x1 - x0, y1 - y0), (x0, y0)
+
+    def array(self, band=1, cache_size=64):
+        """Returns a LazyArray of band.
+        """
+        return LazyArray(self.dataset.GetRasterBand(band), cache_size)
+
+
+class LazyArray():
+    """Read-only 2-d array of a GDAL band that reads blocks on demand.
+
+    Indexing with integers and slices reads and decodes only the blocks
+    the selection touches. The most recently used blocks are cached.
+    """
+    def __init__(self, band, cache_size=64):
+        """
+        Arguments
+        ---------
+        band : gdal.Band
+
+        cache_size : int
+            Number of decoded blocks to keep.
+        """
+        self.band = band
+        self.shape = (band.YSize, band.XSize)
+        self.block_size = tuple(reversed(band.GetBlockSize())) # rows, cols
+        self.cache_size = cache_size
+        self._blocks = OrderedDict()
+        self._dtype = None
+
+    @property
+    def dtype(self):
+        # read once, so that indexing does not keep the first block cached
+        if self._dtype is None:
+            self._dtype = self._block(0, 0).dtype
+        return self._dtype
+
+    def __array__(self, dtype=None, copy=None):
+        out = self[:, :]
+        return out if dtype is None else out.astype(dtype)
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key, slice(None))
+
+        if len(key) != 2:
+            raise IndexError('LazyArray is 2-dimensional')
+
+        ranges = []
+        for k, size in zip(key, self.shape):
+            if isinstance(k, slice):
+                start, stop, step = k.indices(size)
+                if step < 0:
+                    raise IndexError('Negative steps are not supported')
+                ranges.append((start, max(stop, start), step))
+            else:
+                k = k + size if k < 0 else k
+                if not 0 <= k < size:
+                    raise IndexError('Index {} out of range'.format(k))
+                ranges.append((k, k + 1, None))
+
+        (r0, r1, r_step), (c0, c1, c_step) = ranges
+        block_rows, block_cols = self.block_size
+        out = np.empty((r1 - r0, c1 - c0), dtype=self.dtype)
+
+        for by in range(r0 // block_rows, -(-r1 // block_rows)):
+            for bx in range(c0 // block_cols, -(-c1 // block_cols)):
+                block = self._block(by, bx)
+                y, x = by * block_rows, bx * block_cols
+
+                ys, ye = max(r0, y), min(r1, y + block.shape[0])
+                xs, xe = max(c0, x), min(c1, x + block.shape[1])
+                out[ys - r0:ye - r0, xs - c0:xe - c0] = block[ys - y:ye - y, xs - x:xe - x]
+
+        return out[0 if r_step is None else slice(None, None, r_step),
+                   0 if c_step is None else slice(None, None, c_step)]
+
+    def points(self, rows, cols):
+        """Values at arrays of row and column positions.
+
+        Points are grouped by block so each block is read once. If the band
+        has a nodata value, values are float64 with nodata set to NaN.
+        """
+        rows, cols = np.asarray(rows), np.asarray(cols)
+        block_rows, block_cols = self.block_size
+        n_block_cols = -(-self.shape[1] // block_cols)
+
+        keys = rows // block_rows * n_block_cols + cols // block_cols
+        order = np.argsort(keys, kind='mergesort')
+        blocks, starts = np.unique(keys[order], return_index=True)
+
+        out = np.empty(len(rows), dtype=self.dtype)
+        for key, group in zip(blocks, np.split(order, starts[1:])):
+            by, bx = divmod(int(key), n_block_cols)
+            out[group] = self._block(by, bx)[rows[group] - by * block_rows,
+                                             cols[group] - bx * block_cols]
+
+        nodata = self.band.GetNoDataValue()
+        if nodata is not None:
+            missing = out == nodata
+            out = out.astype('float64')
+            out[missing] = np.nan
+
+        return out
+
+    def _block(self, by, bx):
+        if (by, bx) in self._blocks:
+            self._blocks.move_to_end((by, bx))
+            return self._blocks[(by, bx)]
 
-        return gdal.Open(mmap_name)
+        block_rows, block_cols = self.block_size
+        y, x = by * block_rows, bx * block_cols
+        block = self.band.ReadAsArray(x, y,
+                                      min(block_cols, self.shape[1] - x),
+                                      min(block_rows, self.shape[0] - y))
+
+        self._blocks[(by, bx)] = block
+        if len(self._blocks) > self.cache_size:
+            self._blocks.popitem(last=False)
+
+        return block
 
 
 class NADP_ZipFile(zipfile.ZipFile):
@@ -160,21 +356,393 @@ def get_annual_NTN_map(measurement_type, measurement=None, year=None, path=None)
     return GDALMemFile(z.tif())
 
 
-def get_zip(url, filename):
-    """Gets a ZipFile at url and returns it
+def get_NTN_cube(path, measurement_type, measurement=None, start_year=None,
+                 end_year=None, max_workers=4):
+    """Stacks annual NTN maps into a RasterCube stored at path.
+
+    Years are downloaded in parallel and each grid is written to the cube
+    as soon as it is decoded. Years already in the cube are not downloaded
+    again, so an interrupted build resumes where it stopped.
+
+    Parameters
+    ----------
+    path : string
+        Directory of the cube.
+
+    measurement_type : string
+        The type of measurement (concentration, deposition, or precip)
+
+    measurement : string
+        The measured constituent to return.
+
+    start_year, end_year : int
+        First and last year of the cube.
+
+    max_workers : int
+        Number of years downloaded at once.
 
     Returns
     -------
-    ZipFile
+    RasterCube
 
-    TODO
-    ----
+    Examples
+    --------
+    >>> cube = get_NTN_cube('no3_conc', 'conc', 'NO3', 1994, 2016)
+    >>> trend = cube.reduce(np.nanmean)
+    """
+    def get_map(year):
+        return get_annual_NTN_map(measurement_type, measurement, str(year))
+
+    return build_cube(path, range(start_year, end_year + 1), get_map,
+                      max_workers=max_workers)
+
+
+def get_MDN_cube(path, measurement_type, start_year=None, end_year=None,
+                 max_workers=4):
+    """Stacks annual MDN maps into a RasterCube stored at path.
+
+    See get_NTN_cube.
+    """
+    def get_map(year):
+        return get_annual_MDN_map(measurement_type, str(year))
+
+    return build_cube(path, range(start_year, end_year + 1), get_map,
+                      max_workers=max_workers)
+
+
+def build_cube(path, years, get_map, max_workers=4):
+    """Writes the grid of each year into a memory-mapped cube at path.
+
+    Parameters
+    ----------
+    path : string
+        Directory of the cube.
+
+    years : list
+        Years of the cube, in order.
+
+    get_map : function
+        Returns the GDALMemFile of a year.
+
+    max_workers : int
+        Number of years fetched at once.
+
+    Returns
+    -------
+    RasterCube
+    """
+    years = [int(year) for year in years]
+    os.makedirs(path, exist_ok=True)
+
+    metadata = _read_metadata(path)
+    values = None
+
+    if metadata is not None:
+        if metadata['years'] != years:
+            raise ValueError('The cube at {} has years {}'.format(path, metadata['years']))
+        values = np.load(os.path.join(path, CUBE_FILE), mmap_mode='r+')
+
+    complete = set(metadata['complete']) if metadata else set()
+    todo = [year for year in years if year not in complete]
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for year, grid, geotransform, projection in executor.map(
+                lambda year: (year,) + _read_grid(get_map(year)), todo):
+
+            if values is None:
+                metadata = {'years': years, 'geotransform': list(geotransform),
+                            'projection': projection, 'complete': []}
+                values = np.lib.format.open_memmap(
+                    os.path.join(path, CUBE_FILE), mode='w+', dtype='float32',
+                    shape=(len(years),) + grid.shape)
+                values[:] = np.nan
+
+            if grid.shape != values.shape[1:]:
+                raise ValueError('The {} grid has shape {}, expected {}'
+                                 .format(year, grid.shape, values.shape[1:]))
+
+            values[years.index(year)] = grid
+            values.flush()
+
+            metadata['complete'].append(year)
+            _write_metadata(path, metadata)
+
+    del values
+    return RasterCube(path)
+
+
+def _read_grid(memfile):
+    """Decodes the first band of a GDALMemFile and frees it.
+
+    Returns
+    -------
+    grid : float32 array with nodata set to NaN
+    geotransform : tuple
+    projection : string
+    """
+    with memfile:
+        band = memfile.dataset.GetRasterBand(1)
+        grid = band.ReadAsArray().astype('float32')
+        nodata = band.GetNoDataValue()
+
+        if nodata is not None:
+            grid[grid == nodata] = np.nan
+
+        return grid, memfile.dataset.GetGeoTransform(), memfile.dataset.GetProjection()
+
+
+def _read_metadata(path):
+    filename = os.path.join(path, METADATA_FILE)
+    if not os.path.exists(filename):
+        return None
+
+    with open(filename) as f:
+        return json.load(f)
+
+
+def _write_metadata(path, metadata):
+    filename = os.path.join(path, METADATA_FILE)
+
+    with open(filename + '.tmp', 'w') as f:
+        json.dump(metadata, f)
+
+    os.replace(filename + '.tmp', filename)
+
+
+class RasterCube():
+    """Stack of annual grids in a memory-mapped array, with coordinates.
+
+    Modeled after xarray.DataArray: values has dimensions (time, y, x), and
+    time, y and x hold the year and the projected coordinates of the pixel
+    centers. Values are read from disk only when they are used; years that
+    have not been built are NaN.
+
+    Example
+    ------
+    >>> cube = RasterCube('no3_conc')
+    >>> cube.sel(time=2016)             # one year
+    >>> cube.isel(y=100, x=200)         # time series of one pixel
+    >>> cube.reduce(np.nanmax)          # per-pixel statistic of every year
     """
-    req = requests.get(url + filename)
-    req.raise_for_status()
+    dims = ('time', 'y', 'x')
+
+    def __init__(self, path, mode='r'):
+        """
+        Arugments
+        ---------
+        path : string
+            Directory of the cube, as written by build_cube.
+
+        mode : string
+            'r' for read only or 'r+' to allow changes.
+        """
+        metadata = _read_metadata(path)
+        if metadata is None:
+            raise IOError('No cube at {}'.format(path))
+
+        self.path = path
+        self.values = np.load(os.path.join(path, CUBE_FILE), mmap_mode=mode)
+        self.geotransform = tuple(metadata['geotransform'])
+        self.projection = metadata['projection']
+        self.complete = metadata['complete']
+
+        x0, dx, _, y0, _, dy = self.geotransform
+        self.time = np.array(metadata['years'])
+        self.y = y0 + dy * (np.arange(self.values.shape[1]) + 0.5)
+        self.x = x0 + dx * (np.arange(self.values.shape[2]) + 0.5)
+
+    @property
+    def shape(self):
+        return self.values.shape
+
+    @property
+    def coords(self):
+        return {'time': self.time, 'y': self.y, 'x': self.x}
+
+    def isel(self, time=slice(None), y=slice(None), x=slice(None)):
+        """Selects by position along each dimension.
+        """
+        return self.values[time, y, x]
+
+    def sel(self, time=None, y=None, x=None):
+        """Selects the year time and the pixels nearest the coordinates y, x.
+        """
+        index = {}
+        for dim, value in (('time', time), ('y', y), ('x', x)):
+            if value is not None:
+                index[dim] = int(np.abs(self.coords[dim] - value).argmin())
+
+        return self.isel(**index)
+
+    def reduce(self, func, rows=256, **kwargs):
+        """Applies func along time for every pixel, a band of rows at a time.
+
+        Parameters
+        ----------
+        func : function
+            Called as func(array, axis=0, **kwargs), e.g. np.nanmean.
+
+        rows : int
+            Number of rows read from disk at a time.
+
+        Returns
+        -------
+        2-d array of the result at each pixel.
+        """
+        out = None
+
+        for start in range(0, self.shape[1], rows):
+            result = func(np.asarray(self.values[:, start:start + rows]), axis=0,
+                          **kwargs)
+            if out is None:
+                out = np.empty(self.shape[1:], dtype=result.dtype)
+            out[start:start + rows] = result
+
+        return out
+
+    def to_xarray(self):
+        """Returns the cube as an xarray.DataArray backed by the memory map.
+        """
+        import xarray
+
+        return xarray.DataArray(self.values, coords=self.coords, dims=self.dims)
+
 
-    #z = zipfile.ZipFile(io.BytesIO(req.content))
-    z = NADP_ZipFile(io.BytesIO(req.content))
-    return z
+def sample_sites(source, sites, method='nearest', lat_col='dec_lat_va',
+                 lon_col='dec_long_va', band=1):
+    """Samples grids at site locations.
 
+    Pixel positions of all sites are computed at once from the geotransform,
+    and only the blocks (or memory-mapped pages) containing sites are read.
 
+    Parameters
+    ----------
+    source : RasterCube or GDALMemFile
+        A cube of annual grids, or an open GDALMemFile.
+
+    sites : DataFrame
+        Site locations in decimal degrees, e.g. nwis.get_info output. Rows
+        are labeled by the site_no column if there is one.
+
+    method : string
+        'nearest' for the value of the pixel containing each site, or
+        'bilinear' to interpolate between the four nearest pixel centers,
+        ignoring missing pixels.
+
+    lat_col, lon_col : string
+        Columns of latitude and longitude.
+
+    band : int
+        Band sampled from a GDALMemFile.
+
+    Returns
+    -------
+    DataFrame with one row per site and one column per year of a
+    RasterCube, or a Series for a GDALMemFile. Sites outside the grid are
+    NaN, as are pixels equal to the nodata value of a GDALMemFile band.
+    """
+    if method not in ('nearest', 'bilinear'):
+        raise TypeError('Unrecognized method: {}'.format(method))
+
+    if isinstance(source, RasterCube):
+        geotransform, projection = source.geotransform, source.projection
+        shape = source.shape[1:]
+
+        def gather(rows, cols):
+            return source.values[:, rows, cols].T.astype('float64')
+
+    else:
+        geotransform = source.dataset.GetGeoTransform()
+        projection = source.dataset.GetProjection()
+        array = source.array(band)
+        shape = array.shape
+
+        def gather(rows, cols):
+            return array.points(rows, cols).astype('float64')[:, None]
+
+    if geotransform[2] or geotransform[4]:
+        raise ValueError('Rotated grids are not supported')
+
+    x, y = _project(sites[lon_col].values.astype('float64'),
+                    sites[lat_col].values.astype('float64'), projection)
+
+    # fractional pixel positions; pixel (i, j) spans [i, i + 1) x [j, j + 1)
+    row = (y - geotransform[3]) / geotransform[5]
+    col = (x - geotransform[0]) / geotransform[1]
+    inside = (row >= 0) & (row < shape[0]) & (col >= 0) & (col < shape[1])
+
+    if method == 'nearest':
+        values = gather(row[inside].astype('int64'), col[inside].astype('int64'))
+
+    else:
+        # interpolate between pixel centers, clamping at the edges
+        row, col = row[inside] - 0.5, col[inside] - 0.5
+        row0 = np.floor(row).astype('int64')
+        col0 = np.floor(col).astype('int64')
+        wy = (row - row0)[:, None]
+        wx = (col - col0)[:, None]
+
+        total = 0
+        weights = 0
+        for dr, dc, w in ((0, 0, (1 - wy) * (1 - wx)), (0, 1, (1 - wy) * wx),
+                          (1, 0, wy * (1 - wx)), (1, 1, wy * wx)):
+            corner = gather(np.clip(row0 + dr, 0, shape[0] - 1),
+                            np.clip(col0 + dc, 0, shape[1] - 1))
+            valid = ~np.isnan(corner)
+            total = total + np.where(valid, corner * w, 0)
+            weights = weights + valid * w
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            values = np.where(weights > 0, total / weights, np.nan)
+
+    out = np.full((len(sites), values.shape[1]), np.nan)
+    out[inside] = values
+
+    index = sites[SITENO_COL] if SITENO_COL in sites else sites.index
+
+    if isinstance(source, RasterCube):
+        return pd.DataFrame(out, index=pd.Index(index),
+                            columns=pd.Index(source.time, name='year'))
+
+    return pd.Series(out[:, 0], index=pd.Index(index))
+
+
+def _project(lon, lat, projection):
+    """Transforms longitude and latitude into the grid's projection.
+    """
+    if not projection:
+        return lon, lat
+
+    import osr
+
+    srs = osr.SpatialReference(wkt=projection)
+    if srs.IsGeographic():
+        return lon, lat
+
+    wgs84 = osr.SpatialReference()
+    wgs84.ImportFromEPSG(4326)
+
+    if hasattr(osr, 'OAMS_TRADITIONAL_GIS_ORDER'):
+        # GDAL 3 otherwise expects latitude first
+        wgs84.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+        srs.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+
+    transform = osr.CoordinateTransformation(wgs84, srs)
+    points = np.array(transform.TransformPoints(np.column_stack([lon, lat]).tolist()))
+
+    return points[:, 0], points[:, 1]
+
+
+def get_zip(url, filename):
+    """Gets a ZipFile at url and returns it
+
+    The archive is read with HTTP Range requests, so only its central
+    directory and the members that are read are downloaded. If the server
+    does not support Range requests, the archive is streamed to a temporary
+    file.
+
+    Returns
+    -------
+    NADP_ZipFile
+    """
+    return open_zip(url + filename, cls=NADP_ZipFile)
@@ -7,17 +7,17 @@ Todo:
     * Check that all timezones are handled properly for each service.
 """
 
-import pandas as pd
-import requests
+# pandas, requests, and utils are imported inside the functions that use
+# them, so that importing this module is fast
 from io import StringIO
 
-from data_retrieval.utils import to_str, format_datetime, update_merge
-
 WATERDATA_URL = 'https://nwis.waterdata.usgs.gov/nwis/'
 WATERSERVICE_URL = 'https://waterservices.usgs.gov/nwis/'
 
 WATERSERVICES_SERVICES = ['dv', 'iv', 'site', 'stat', 'gwlevels']
 WATERDATA_SERVICES = ['qwdata', 'measurements', 'peaks', 'pmcodes']
+PMCODES_COLUMNS = ['parameter_group_nm', 'parameter_nm', 'casrn', 'srsname',
+                   'parameter_units']
 # add more services
 
 
@@ -46,12 +46,16 @@ def format_response(df, service=None):
 
 
 def preformat_peaks_response(df):
+    import pandas as pd
+
     df['datetime'] = pd.to_datetime(df.pop('peak_dt'), errors='coerce')
     df.dropna(subset=['datetime'])
     return df
 
 
 def try_format_datetime(df, date_field, time_field, tz_field):
+    from data_retrieval.utils import format_datetime
+
     try:
         return format_datetime(df, date_field, time_field, tz_field)
 
@@ -137,9 +141,12 @@ def get_stats(**kwargs):
     Returns:
         Dataframe
 
+    To compute the same statistics from daily values already in hand,
+    without a request, see data_retrieval.stats.get_stats.
+
     TODO: fix date parsing
     """
-    if sites not in kwargs:
+    if 'sites' not in kwargs:
         raise TypeError('Query must specify a site or list of sites')
 
     query = query_waterservices('stat', **kwargs)
@@ -158,8 +165,15 @@ def query(url, **kwargs):
         kwargs: query parameters passed to requests.get
 
     Returns:
-        string : query response
+        string : query response, or None if nothing matched the query (404)
+
+    Raises:
+        requests.HTTPError: if the service rejected the query (400) or
+            failed.
     """
+    import requests
+
+    from data_retrieval.utils import to_str
 
     payload = {}
 
@@ -177,8 +191,12 @@ def query(url, **kwargs):
 
     response_format = kwargs.get('format')
 
-    if req.status_code == 400:
-        return False
+    if req.status_code == 404:
+        # no sites matched the query, e.g. none modified since modifiedSince
+        return None
+
+    # a rejected query is not the same as no data
+    req.raise_for_status()
 
     if response_format == 'json':
         return req.json()
@@ -242,10 +260,10 @@ def query_waterservices(service, **kwargs):
     return query(url, **kwargs)
 
 
-def get_dv(**kwargs):
+def get_dv(units=False, **kwargs):
 
     query = query_waterservices('dv', format='json', **kwargs)
-    df = read_json(query)
+    df = read_json(query, units=units)
 
     return format_response(df)
 
@@ -336,10 +354,10 @@ def get_info(**kwargs):
     return read_rdb(query)
 
 
-def get_iv(**kwargs):
+def get_iv(units=False, **kwargs):
 
     query = query_waterservices('iv', format='json', **kwargs)
-    df = read_json(query)
+    df = read_json(query, units=units)
 
     return format_response(df)
 
@@ -347,28 +365,26 @@ def get_iv(**kwargs):
 def get_pmcodes(**kwargs):
     """Return a DataFrame containing all NWIS parameter codes.
 
+    See codes.store.CodeStore for a local copy of this table.
+
     Returns:
         DataFrame containgin the USGS parameter codes
     """
+    import requests
+
     payload = {'radio_pm_search': 'param_group',
-               'pm_group': 'All+--+include+all+parameter+groups',
-               'pm_sarch': None,
-               'casrn_search': None,
-               'srsname_search': None,
-               'show': 'parameter_group_nm',
-               'show': 'casrn',
-               'show': 'srsname',
-               'show': 'parameter_units',
+               'pm_group': 'All -- include all parameter groups',
                'format': 'rdb',
+               # show is repeated once for each column returned
+               'show': PMCODES_COLUMNS,
                }
 
-    kwargs = {**payload, **kwargs}
+    payload.update(kwargs)
 
-    # XXX check that the url is correct
-    url = WATERSERVICE_URL + 'pmcodes'
-    df = read_rdb(query(url, **kwargs))
+    req = requests.get(WATERDATA_URL + 'pmcodes', params=payload)
+    req.raise_for_status()
 
-    return format_response(df)
+    return read_rdb(req.text)
 
 
 def get_record(sites=None, start=None, end=None, state=None,
@@ -422,16 +438,27 @@ def get_record(sites=None, start=None, end=None, state=None,
     return record_df
 
 
-def read_json(json, multi_index=False):
+def read_json(json, multi_index=False, units=False):
     """Reads a NWIS Water Services formated JSON into a dataframe
 
     Args:
         json (dict)
+        units (bool): If True, store the units of each column in the
+            DataFrame's attrs['units'], from the json or the local code
+            store (see codes.store).
 
     Returns:
         DataFrame containing times series data from the NWIS json.
     """
+    import pandas as pd
+
+    from data_retrieval.utils import update_merge
+
+    if not json:
+        return None
+
     merged_df = pd.DataFrame()
+    column_units = {}
     for timeseries in json['value']['timeSeries']:
 
         site_no = timeseries['sourceInfo']['siteCode'][0]['value']
@@ -453,6 +480,10 @@ def read_json(json, multi_index=False):
             if option:
                 col_name = '{}_{}'.format(col_name, option)
 
+            unit = timeseries['variable'].get('unit', {}).get('unitCode')
+            if unit:
+                column_units[col_name] = unit
+
             record_json = parameter['value']
 
             if not record_json:
@@ -463,7 +494,7 @@ def read_json(json, multi_index=False):
 
             # read json, converting all values to float64 and all qaulifiers
             # Lists can't be hashed, thus we cannot df.merge on a list column
-            record_df = pd.read_json(record_json,
+            record_df = pd.read_json(StringIO(record_json),
                                      orient='records',
                                      dtype={'value': 'float64',
                                             'qualifiers': 'unicode'})
@@ -484,16 +515,43 @@ def read_json(json, multi_index=False):
                 merged_df = update_merge(merged_df, record_df, na_only=True,
                                          on=['site_no', 'datetime'])
 
-    return format_response(merged_df)
+    df = format_response(merged_df)
 
+    if units:
+        annotate_units(df, column_units)
 
-def read_rdb(rdb):
+    return df
+
+
+def annotate_units(df, column_units=None):
+    """Stores the units of each data column in df.attrs['units'].
+
+    Units not given in column_units are looked up by the parameter code in
+    the column name, in the local code store, without a request.
+    """
+    from data_retrieval.codes.store import default_store
+
+    if df is None:
+        return
+
+    found = default_store().column_units(df.columns)
+    found.update({column: unit for column, unit in (column_units or {}).items()
+                  if column in df.columns})
+    df.attrs['units'] = found
+
+
+def read_rdb(rdb, units=False):
     """Convert NWIS rdb table into a dataframe.
 
     Args:
         rdb (string):
+        units (bool): If True, store the units of each data column in the
+            DataFrame's attrs['units'], from the local code store (see
+            codes.store).
     """
-    if rdb.startswith('No sites/data'):
+    import pandas as pd
+
+    if not rdb or rdb.startswith('No sites/data'):
         return None
 
     count = 0
@@ -507,9 +565,15 @@ def read_rdb(rdb):
             break
 
     fields = rdb.splitlines()[count].split('\t')
-    dtypes = {'site_no': str}
+    # codes with leading zeros
+    dtypes = {'site_no': str, 'parm_cd': str, 'parameter_cd': str}
 
     df = pd.read_csv(StringIO(rdb), delimiter='\t', skiprows=count+2,
                      names=fields, na_values='NaN', dtype=dtypes)
 
-    return format_response(df)
+    df = format_response(df)
+
+    if units:
+        annotate_units(df)
+
+    return df
@@ -0,0 +1,169 @@
+"""
+Read members of a zip archive on a web server without downloading the whole
+archive.
+
+RemoteFile is a read-only, seekable file backed by HTTP Range requests. Given
+one, zipfile.ZipFile only fetches the end of central directory record, the
+central directory, and the members that are actually read. Servers that
+ignore Range requests are streamed into a temporary file instead.
+
+Example
+-------
+>>> z = remotezip.open_zip('https://nadp.slh.wisc.edu/maplib/grids/2016/NO3_conc_2016.zip')
+>>> z.namelist()
+>>> tif = z.read(z.namelist()[0])
+"""
+import io
+import zipfile
+from tempfile import SpooledTemporaryFile
+
+import requests
+
+BLOCK_SIZE = 2**16  # bytes; the smallest range requested
+SPOOL_SIZE = 2**24  # bytes held in memory before spooling to disk
+DOWNLOAD_CHUNK_SIZE = 2**20  # bytes
+
+
+def open_zip(url, cls=zipfile.ZipFile, block_size=BLOCK_SIZE, session=None):
+    """Opens a zip archive at url.
+
+    The last block_size bytes of the archive are requested first; they hold
+    the end of central directory record and, for most archives, the central
+    directory itself.
+
+    Parameters
+    ----------
+    url : string
+
+    cls : class
+        zipfile.ZipFile or a subclass of it.
+
+    block_size : int
+        Smallest number of bytes requested at a time.
+
+    session : requests.Session, optional
+
+    Returns
+    -------
+    Instance of cls reading from a RemoteFile, or from a SpooledTemporaryFile
+    if the server does not support Range requests.
+    """
+    session = session or requests.Session()
+
+    r = session.get(url, headers={'Range': 'bytes=-{}'.format(block_size)},
+                    stream=True)
+    r.raise_for_status()
+
+    if r.status_code != 206:
+        return cls(_spool(r))
+
+    with r:
+        tail = r.content
+
+    size = int(r.headers['Content-Range'].rsplit('/', 1)[-1])
+    fileobj = RemoteFile(url, size, session=session, block_size=block_size)
+    fileobj.bytes_read = len(tail)
+    fileobj._buffer_start, fileobj._buffer = size - len(tail), tail
+
+    return cls(fileobj)
+
+
+def _spool(response):
+    spool = SpooledTemporaryFile(max_size=SPOOL_SIZE)
+
+    with response:
+        for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+            spool.write(chunk)
+
+    spool.seek(0)
+    return spool
+
+
+class RemoteFile(io.RawIOBase):
+    """Read-only file over HTTP Range requests.
+
+    The most recently fetched range is kept, and reads shorter than
+    block_size fetch a whole block, so the many small reads made while
+    parsing a zip cost few requests.
+    """
+    def __init__(self, url, size, session=None, block_size=BLOCK_SIZE):
+        """
+        Parameters
+        ----------
+        url : string
+
+        size : int
+            Length of the resource in bytes.
+
+        session : requests.Session, optional
+
+        block_size : int
+            Smallest number of bytes requested at a time.
+        """
+        self.url = url
+        self.size = size
+        self.session = session or requests.Session()
+        self.block_size = block_size
+        self.bytes_read = 0
+        self._pos = 0
+        self._buffer_start = 0
+        self._buffer = b''
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += self.size
+
+        if offset < 0:
+            raise ValueError('Negative seek position {}'.format(offset))
+
+        self._pos = offset
+        return self._pos
+
+    def read(self, size=-1):
+        end = self.size if size is None or size < 0 else min(self._pos + size, self.size)
+        if end <= self._pos:
+            return b''
+
+        out = self._from_buffer(self._pos, end)
+
+        if len(out) < end - self._pos:
+            start = self._pos + len(out)
+            self._fetch(start, min(max(end, start + self.block_size), self.size))
+            out += self._from_buffer(start, end)
+
+        self._pos += len(out)
+        return out
+
+    def readinto(self, b):
+        data = self.read(len(b))
+        b[:len(data)] = data
+        return len(data)
+
+    def _from_buffer(self, start, end):
+        offset = start - self._buffer_start
+        if offset < 0 or offset >= len(self._buffer):
+            return b''
+
+        return self._buffer[offset:end - self._buffer_start]
+
+    def _fetch(self, start, end):
+        r = self.session.get(self.url,
+                             headers={'Range': 'bytes={}-{}'.format(start, end - 1)})
+        r.raise_for_status()
+
+        if r.status_code != 206:
+            raise IOError('{} does not support Range requests'.format(self.url))
+
+        self.bytes_read += len(r.content)
+        self._buffer_start, self._buffer = start, r.content
@@ -0,0 +1,576 @@
+"""
+Share parsed results between processes on one host through shared memory.
+
+Processes of a multi-process server each fetch and parse the same popular
+queries and keep their own copies. A SharedStore lets the first process to
+fetch a query publish the DataFrame in a shared memory segment named after
+the normalized query; the other processes map the segment instead of
+fetching again.
+
+A frame is stored column by column, after a JSON header describing it:
+numeric, boolean, and datetime columns as their raw values, which readers
+use in place without copying; other columns as integer codes and their
+distinct values, with strings stored as offsets into UTF-8 data. Readers
+rebuild these other columns, so each reader holds its own copy of them.
+Nothing read from a segment is unpickled or evaluated.
+
+Each segment starts with a control block holding the number of readers and
+an expiry time. Expired segments are removed once no reader holds them, or
+once they have been expired for another `ttl` (in case a reader exited
+without releasing).
+
+Segments are files in the shared memory file system at SHM_DIR (Linux),
+readable and writable only by their owner; segments of other users are
+ignored. The control block is guarded with fcntl file locks.
+
+Example
+-------
+>>> store = SharedStore(ttl=300)
+>>> with store.fetch(nwis.get_iv, sites='03339000', period='PT2H') as result:
+...     df = result.frame
+"""
+import fcntl
+import hashlib
+import json
+import mmap
+import os
+import struct
+import tempfile
+import time
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import pandas_dtype
+
+NAMESPACE = 'dr'
+TTL = 300
+
+SHM_DIR = '/dev/shm'
+
+# control block: magic, readers, created, expires, header length
+CONTROL = struct.Struct('<8sqddq')
+MAGIC = b'drframe2'
+ALIGNMENT = 64
+
+# column storage
+RAW = 'raw'
+CODES = 'codes'
+VALUES = 'values'
+
+
+class SharedFrame():
+    """A DataFrame mapped from a shared memory segment.
+
+    Release it, or use it as a context manager, when done, so the segment can
+    be removed once it expires.
+    """
+    def __init__(self, store, name, buf, frame):
+        self.store = store
+        self.name = name
+        self.buf = buf
+        self.frame = frame
+
+    def release(self):
+        if self.buf is None:
+            return
+
+        self.frame = None
+        self.store._add_reader(self.buf, -1)
+        # the mapping is unmapped once no array of the frame uses it
+        self.buf = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.release()
+
+    def __del__(self):
+        # a frame that was never released still gives up its reader
+        try:
+            self.release()
+        except Exception:
+            pass
+
+
+class SharedStore():
+    """Shared memory store of DataFrames keyed by normalized query.
+    """
+    def __init__(self, namespace=NAMESPACE, ttl=TTL, lock_path=None):
+        """
+        Parameters
+        ----------
+        namespace : string
+            Prefix of the segment names; stores with the same namespace
+            share results.
+
+        ttl : float
+            Seconds a published frame is served before it expires.
+
+        lock_path : string, optional
+            File locked while a control block is read or changed; in the
+            temporary directory by default, named for the user.
+        """
+        if not os.path.isdir(SHM_DIR):
+            raise OSError('Shared memory needs {}'.format(SHM_DIR))
+
+        self.namespace = namespace
+        self.ttl = ttl
+        self.lock_path = lock_path or os.path.join(
+            tempfile.gettempdir(), '{}-{}-shared.lock'.format(namespace, os.getuid()))
+
+    def key(self, name, **params):
+        """Segment name of a query, the same for equivalent parameters.
+
+        Parameters are sorted, None values dropped, and list-like or comma
+        delimited values sorted, so sites=['b', 'a'] and sites='a,b' name
+        the same query.
+        """
+        normalized = {key: _normalize(value) for key, value in params.items()
+                      if value is not None}
+        text = json.dumps([name, normalized], sort_keys=True, default=str)
+
+        return '{}_{}'.format(self.namespace,
+                              hashlib.sha1(text.encode()).hexdigest()[:24])
+
+    def publish(self, key, df, ttl=None):
+        """Writes df to a new segment named key.
+
+        Returns
+        -------
+        False if a current segment already holds key, True otherwise.
+
+        Raises
+        ------
+        TypeError if the values, labels, or attrs of df cannot be stored as
+        JSON, e.g. objects other than strings and numbers.
+        """
+        header, blocks = _encode(df)
+        header = json.dumps(header).encode()
+
+        start = _align(CONTROL.size + len(header))
+        size = start + (_align(blocks[-1][0] + blocks[-1][1].nbytes)
+                        if blocks else 0)
+
+        self.evict()
+
+        try:
+            buf = _create(key, size)
+        except FileExistsError:
+            info = self.info(key)
+            # None while another process is still writing the frame
+            if info is None or info['expires'] >= time.time():
+                return False
+
+            self._unlink(key)
+            buf = _create(key, size)
+
+        try:
+            buf[CONTROL.size:CONTROL.size + len(header)] = header
+            for offset, block in blocks:
+                target = np.frombuffer(buf, dtype=block.dtype,
+                                       count=len(block), offset=start + offset)
+                target[:] = block
+                del target
+
+            created = time.time()
+            ttl = self.ttl if ttl is None else ttl
+            with self._lock():
+                # the magic is written last, so readers never see a partial frame
+                CONTROL.pack_into(buf, 0, MAGIC, 0, created, created + ttl,
+                                  len(header))
+        finally:
+            buf.close()
+
+        return True
+
+    def get(self, key):
+        """Maps the frame published under key.
+
+        Returns
+        -------
+        SharedFrame, or None if there is no current frame for key.
+        """
+        try:
+            buf = _map(key)
+        except FileNotFoundError:
+            return None
+
+        with self._lock():
+            magic, readers, created, expires, header_length = \
+                CONTROL.unpack_from(buf, 0)
+
+            if magic != MAGIC or expires < time.time():
+                buf.close()
+                return None
+
+            CONTROL.pack_into(buf, 0, magic, readers + 1, created, expires,
+                              header_length)
+
+        header = json.loads(buf[CONTROL.size:CONTROL.size + header_length])
+        frame = _decode(buf, _align(CONTROL.size + header_length), header)
+
+        return SharedFrame(self, key, buf, frame)
+
+    def fetch(self, function, ttl=None, **params):
+        """Returns the shared result of function(**params), calling the
+        function and publishing its result only if no other process has.
+
+        Frames that cannot be stored (see publish) are not shared.
+
+        Returns
+        -------
+        SharedFrame
+        """
+        name = '{}.{}'.format(function.__module__, function.__qualname__)
+        key = self.key(name, **params)
+
+        result = self.get(key)
+        if result is not None:
+            return result
+
+        df = function(**params)
+        if df is None:
+            df = pd.DataFrame()
+
+        try:
+            self.publish(key, df, ttl=ttl)
+        except TypeError:
+            return SharedFrame(self, key, None, df)
+
+        result = self.get(key)
+        if result is None:
+            # another process is still writing it, or it expired at once;
+            # serve the local copy
+            return SharedFrame(self, key, None, df)
+
+        return result
+
+    def entries(self):
+        """Names of this user's segments of this namespace.
+        """
+        prefix = self.namespace + '_'
+        return sorted(name for name in os.listdir(SHM_DIR)
+                      if name.startswith(prefix) and _owned(_path(name)))
+
+    def info(self, key):
+        """Readers, created, and expires of the segment named key, or None.
+        """
+        try:
+            buf = _map(key)
+        except FileNotFoundError:
+            return None
+
+        try:
+            with self._lock():
+                magic, readers, created, expires, _ = CONTROL.unpack_from(buf, 0)
+        finally:
+            buf.close()
+
+        if magic != MAGIC:
+            return None
+
+        return {'readers': readers, 'created': created, 'expires': expires}
+
+    def evict(self, force=False):
+        """Removes expired segments no reader holds, and segments expired for
+        longer than another ttl.
+
+        Parameters
+        ----------
+        force : bool
+            Remove all segments of the namespace.
+
+        Returns
+        -------
+        Number of segments removed.
+        """
+        now = time.time()
+        removed = 0
+
+        for key in self.entries():
+            info = self.info(key)
+
+            if info is None:
+                # unfinished; left by a writer that exited, if it is old
+                try:
+                    stale = os.path.getmtime(os.path.join(SHM_DIR, key)) < now - self.ttl
+                except FileNotFoundError:
+                    continue
+
+            else:
+                stale = info['expires'] < now and \
+                    (info['readers'] <= 0 or info['expires'] + self.ttl < now)
+
+            if force or stale:
+                self._unlink(key)
+                removed += 1
+
+        return removed
+
+    def _add_reader(self, buf, count):
+        with self._lock():
+            magic, readers, created, expires, header_length = \
+                CONTROL.unpack_from(buf, 0)
+            CONTROL.pack_into(buf, 0, magic, max(readers + count, 0),
+                              created, expires, header_length)
+
+    def _unlink(self, key):
+        try:
+            os.unlink(_path(key))
+        except FileNotFoundError:
+            pass
+
+    @contextmanager
+    def _lock(self):
+        fd = _open_own(self.lock_path, os.O_RDWR | os.O_CREAT)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+        finally:
+            os.close(fd)
+
+
+def _encode(df):
+    """Describes df, and lists the arrays stored for it.
+
+    Returns
+    -------
+    header : dict of JSON types
+    blocks : list of (offset, array), offsets from the start of the data
+    """
+    blocks = []
+
+    def store(array):
+        array = np.ascontiguousarray(array)
+        offset = _align(blocks[-1][0] + blocks[-1][1].nbytes) if blocks else 0
+        blocks.append((offset, array))
+        return {'offset': offset, 'dtype': array.dtype.str, 'length': len(array)}
+
+    columns = [_encode_values(df.iloc[:, i], store) for i in range(df.shape[1])]
+    index = df.index
+
+    if _default_index(df):
+        index = None
+
+    elif isinstance(index, pd.MultiIndex):
+        # levels and codes, so readers need not factorize the index again
+        index = {'names': list(index.names),
+                 'levels': [_encode_values(level, store) for level in index.levels],
+                 'codes': [store(codes) for codes in index.codes]}
+
+    else:
+        index = {'names': [index.name], 'values': _encode_values(index, store)}
+
+    return {'names': list(df.columns), 'columns': columns, 'index': index,
+            'attrs': df.attrs}, blocks
+
+
+def _encode_values(values, store):
+    """Describes a column or index, storing its arrays with store.
+    """
+    dtype = values.dtype
+    column = {'dtype': str(dtype)}
+
+    if isinstance(dtype, np.dtype) and dtype.kind in 'biufcmM':
+        column['storage'] = RAW
+        column['block'] = store(np.asarray(values))
+
+    elif isinstance(dtype, pd.DatetimeTZDtype):
+        column['storage'] = RAW
+        column['block'] = store(pd.DatetimeIndex(values).tz_convert('UTC')
+                                .tz_localize(None).values)
+
+    elif isinstance(dtype, pd.CategoricalDtype):
+        column['storage'] = CODES
+        column['categories'] = _encode_values(dtype.categories, store)
+        column['ordered'] = bool(dtype.ordered)
+        column['block'] = store(pd.Categorical(values).codes)
+
+    else:
+        try:
+            codes, uniques = pd.factorize(values)
+
+        except TypeError:
+            # unhashable values, e.g. lists
+            column['storage'] = VALUES
+            column['values'] = list(values)
+            return column
+
+        column['storage'] = CODES
+        column['uniques'] = _encode_uniques(pd.Index(uniques, dtype=object), store)
+        column['block'] = store(codes)
+
+    return column
+
+
+def _encode_uniques(uniques, store):
+    """Stores strings as UTF-8 data and the offset of each; other values
+    are listed in the header.
+    """
+    if not all(isinstance(value, str) for value in uniques):
+        return {'values': uniques.tolist()}
+
+    encoded = [value.encode() for value in uniques]
+    offsets = np.zeros(len(encoded) + 1, dtype='int64')
+    np.cumsum([len(value) for value in encoded], out=offsets[1:])
+
+    return {'offsets': store(offsets),
+            'data': store(np.frombuffer(b''.join(encoded), dtype='u1'))}
+
+
+def _decode(buf, start, header):
+    """Rebuilds a frame from a segment, using the stored arrays in place.
+    """
+    index = header['index']
+
+    if index is None:
+        pass
+
+    elif 'levels' in index:
+        index = pd.MultiIndex(
+            levels=[_decode_values(buf, start, level) for level in index['levels']],
+            codes=[_block(buf, start, codes) for codes in index['codes']],
+            names=_labels(index['names']), verify_integrity=False)
+
+    else:
+        index = pd.Index(_decode_values(buf, start, index['values']),
+                         name=_labels(index['names'])[0], copy=False)
+
+    data = {i: _decode_values(buf, start, column)
+            for i, column in enumerate(header['columns'])}
+    frame = pd.DataFrame(data, index=index, columns=range(len(data)), copy=False)
+    frame.columns = pd.Index(_labels(header['names']))
+    frame.attrs = header['attrs']
+
+    return frame
+
+
+def _decode_values(buf, start, column):
+    if column['storage'] == VALUES:
+        return pd.array(column['values'], dtype=pandas_dtype(column['dtype']))
+
+    values = _block(buf, start, column['block'])
+
+    if 'categories' in column:
+        categories = pd.Index(_decode_values(buf, start, column['categories']))
+        return pd.Categorical.from_codes(values, dtype=pd.CategoricalDtype(
+            categories, ordered=column['ordered']))
+
+    dtype = pandas_dtype(column['dtype'])
+
+    if isinstance(dtype, pd.DatetimeTZDtype):
+        return pd.DatetimeIndex(values).tz_localize('UTC').tz_convert(dtype.tz).array
+
+    if column['storage'] == CODES:
+        uniques = _decode_uniques(buf, start, column['uniques'])
+        return pd.Categorical.from_codes(values, categories=uniques).astype(dtype)
+
+    return values
+
+
+def _decode_uniques(buf, start, uniques):
+    if 'values' in uniques:
+        return pd.Index(uniques['values'], dtype=object)
+
+    offsets = _block(buf, start, uniques['offsets'])
+    data = _block(buf, start, uniques['data']).tobytes()
+
+    return pd.Index([data[a:b].decode() for a, b in zip(offsets[:-1], offsets[1:])],
+                    dtype=object)
+
+
+def _block(buf, start, block):
+    """Read-only array over a stored block.
+    """
+    values = np.frombuffer(buf, dtype=block['dtype'], count=block['length'],
+                           offset=start + block['offset'])
+    values.flags.writeable = False
+    return values
+
+
+def _labels(labels):
+    # JSON turns tuples, e.g. of MultiIndex columns, into lists
+    return [tuple(label) if isinstance(label, list) else label for label in labels]
+
+
+def _normalize(value):
+    if isinstance(value, str):
+        if ',' in value:
+            return sorted(item.strip() for item in value.split(','))
+        return value.strip()
+
+    if isinstance(value, (list, tuple, set, pd.Index, pd.Series, np.ndarray)):
+        return sorted(str(item).strip() for item in value)
+
+    return value
+
+
+def _default_index(df):
+    index = df.index
+    return isinstance(index, pd.RangeIndex) and index.start == 0 and \
+        index.step == 1 and index.name is None
+
+
+def _align(offset):
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+
+def _path(name):
+    return os.path.join(SHM_DIR, name)
+
+
+def _owned(path):
+    try:
+        return os.lstat(path).st_uid == os.getuid()
+    except FileNotFoundError:
+        return False
+
+
+def _open_own(path, flags):
+    """Opens a file that only this user can read and write, refusing files
+    of other users.
+    """
+    fd = os.open(path, flags | getattr(os, 'O_NOFOLLOW', 0), 0o600)
+
+    if os.fstat(fd).st_uid != os.getuid():
+        os.close(fd)
+        raise PermissionError('{} belongs to another user'.format(path))
+
+    return fd
+
+
+def _create(name, size):
+    """Creates and maps the segment name.
+    """
+    fd = _open_own(_path(name), os.O_RDWR | os.O_CREAT | os.O_EXCL)
+    try:
+        os.ftruncate(fd, max(size, CONTROL.size))
+        return mmap.mmap(fd, 0)
+    finally:
+        os.close(fd)
+
+
+def _map(name):
+    """Maps the segment name, which must belong to this user.
+
+    Raises
+    ------
+    FileNotFoundError if there is no such segment, it belongs to another
+    user, or it is still being created.
+    """
+    try:
+        fd = _open_own(_path(name), os.O_RDWR)
+    except PermissionError:
+        raise FileNotFoundError(name)
+
+    try:
+        if os.fstat(fd).st_size < CONTROL.size:
+            raise FileNotFoundError(name)
+        return mmap.mmap(fd, 0)
+    finally:
+        os.close(fd)
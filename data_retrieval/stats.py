@@ -0,0 +1,264 @@
+"""
+Compute NWIS statistics locally from daily values.
+
+Mirrors the WaterServices statistics service (https://waterservices.usgs.gov/rest/Statistics-Service.html),
+but computes the statistics from the output of nwis.get_dv, so no request is
+made. Output has the columns of the service's RDB output, but values may
+differ from it: the service uses only approved values and rounds its
+results, while every value in the frame is used here, unrounded.
+
+Every site, parameter, and statistic group is reduced in a single vectorized
+pass: values are sorted once by group and value, and counts, means,
+extremes, and percentiles are read off the sorted array.
+
+Example
+-------
+>>> dv = nwis.get_dv(sites=['03339000', '05447500'], startDT='1990-01-01')
+>>> stats.get_stats(dv, statReportType='daily')
+"""
+import numpy as np
+import pandas as pd
+
+PERCENTILES = [5, 10, 20, 25, 50, 75, 80, 90, 95]
+
+KEY_COLUMNS = ['agency_cd', 'site_no', 'parameter_cd', 'ts_id', 'loc_web_ds']
+
+DAILY_COLUMNS = KEY_COLUMNS + ['month_nu', 'day_nu', 'begin_yr', 'end_yr',
+                               'count_nu', 'max_va_yr', 'max_va', 'min_va_yr',
+                               'min_va', 'mean_va'] + \
+                ['p{:02d}_va'.format(p) for p in PERCENTILES]
+
+MONTHLY_COLUMNS = KEY_COLUMNS + ['year_nu', 'month_nu', 'mean_va']
+
+ANNUAL_COLUMNS = KEY_COLUMNS + ['year_nu', 'mean_va']
+
+# statTypeCd values and the daily columns they select
+STAT_TYPES = {'mean': ['mean_va'],
+              'max': ['max_va_yr', 'max_va'],
+              'min': ['min_va_yr', 'min_va'],
+              'median': ['p50_va']}
+STAT_TYPES.update({'p{:02d}'.format(p): ['p{:02d}_va'.format(p)]
+                   for p in PERCENTILES})
+
+
+def get_stats(df, statReportType='daily', statTypeCd='all',
+              statYearType='calendar', parameterCd=None, complete=True):
+    """Computes statistics from daily values.
+
+    Parameters
+    ----------
+    df : DataFrame
+        Daily values as returned by nwis.get_dv, indexed by datetime or by
+        (site_no, datetime).
+
+    statReportType : string ('daily', 'monthly', or 'annual')
+        daily: statistics for each calendar day across all years.
+        monthly: mean of each month of each year.
+        annual: mean of each year.
+
+    statTypeCd : string or list
+        Daily statistics to return: 'all' (default), 'mean', 'max', 'min',
+        'median', or a percentile such as 'p05'.
+
+    statYearType : string ('calendar' or 'water')
+        Year used for annual statistics.
+
+    parameterCd : string or list, optional
+        Parameter codes to include. By default all value columns are used.
+
+    complete : boolean, default True
+        If True, monthly and annual means are only reported for months and
+        years with a value for every day, as the service does.
+
+    Returns
+    -------
+    DataFrame with the columns of the service's RDB output, with one series
+    per value column of df: ts_id is the column, e.g. 00060_Mean, where the
+    service gives its time series number. Values are not rounded; filter provisional values out of df beforehand to follow the
+    service more closely.
+    """
+    values = _stack(df, parameterCd)
+
+    if statReportType == 'daily':
+        stats = _daily_stats(values)
+        return _select_stat_types(stats, statTypeCd)
+
+    elif statReportType == 'monthly':
+        return _period_means(values, ['year_nu', 'month_nu'],
+                             MONTHLY_COLUMNS, complete)
+
+    elif statReportType == 'annual':
+        if statYearType == 'water':
+            values['year_nu'] += (values['month_nu'] >= 10)
+
+        elif statYearType != 'calendar':
+            raise TypeError('Unrecognized statYearType: {}'.format(statYearType))
+
+        return _period_means(values, ['year_nu'], ANNUAL_COLUMNS, complete)
+
+    raise TypeError('Unrecognized statReportType: {}'.format(statReportType))
+
+
+def _stack(df, parameterCd=None):
+    """Reshapes get_dv output into one row per site, parameter, and day.
+
+    Returns
+    -------
+    DataFrame with columns site_no, parameter_cd, ts_id, year_nu, month_nu,
+    day_nu, and value. ts_id is the get_dv column of the value, e.g.
+    00060_Mean, so that each statistic of a parameter is its own series.
+    """
+    df = df.reset_index()
+
+    value_columns = [column for column in df.columns
+                     if column[:5].isdigit() and not column.endswith('_cd')]
+
+    if parameterCd is not None:
+        parameterCd = [parameterCd] if isinstance(parameterCd, str) else parameterCd
+        value_columns = [column for column in value_columns
+                         if column[:5] in parameterCd]
+
+    dates = pd.to_datetime(df['datetime'])
+    frames = []
+
+    for column in value_columns:
+        valid = df[column].notnull().values
+        frames.append(pd.DataFrame({'site_no': df['site_no'].values[valid],
+                                    'parameter_cd': column[:5],
+                                    'ts_id': column,
+                                    'year_nu': dates.dt.year.values[valid],
+                                    'month_nu': dates.dt.month.values[valid],
+                                    'day_nu': dates.dt.day.values[valid],
+                                    'value': df[column].values[valid]}))
+
+    if not frames:
+        raise ValueError('No daily value columns to compute statistics from')
+
+    return pd.concat(frames, ignore_index=True)
+
+
+def _group(values, by):
+    """Assigns sorted integer group codes.
+
+    Returns
+    -------
+    codes : array of group codes for each row of values
+    keys : DataFrame of the by columns for each group, in code order
+    """
+    # pack the codes of each column into one integer, then compact it
+    combined = np.zeros(len(values), dtype='int64')
+    uniques = []
+
+    for column in by:
+        column_codes, column_uniques = pd.factorize(values[column], sort=True)
+        combined = combined * len(column_uniques) + column_codes
+        uniques.append(column_uniques)
+
+    codes, groups = pd.factorize(combined, sort=True)
+
+    keys = {}
+    for column, column_uniques in reversed(list(zip(by, uniques))):
+        keys[column] = np.asarray(column_uniques).take(groups % len(column_uniques))
+        groups = groups // len(column_uniques)
+
+    return codes, pd.DataFrame(keys, columns=by)
+
+
+def _daily_stats(values):
+    by = ['site_no', 'parameter_cd', 'ts_id', 'month_nu', 'day_nu']
+    codes, stats = _group(values, by)
+
+    # sort once by group then value; every statistic is read off this order
+    rank = np.empty(len(codes), dtype='int64')
+    rank[np.argsort(values['value'].values)] = np.arange(len(codes))
+    order = np.argsort(codes * len(codes) + rank)
+    codes = codes[order]
+    value = values['value'].values[order].astype('float64')
+    year = values['year_nu'].values[order]
+
+    count = np.bincount(codes, minlength=len(stats))
+    start = np.concatenate([[0], np.cumsum(count)[:-1]])
+    end = start + count - 1
+
+    stats['begin_yr'] = np.minimum.reduceat(year, start)
+    stats['end_yr'] = np.maximum.reduceat(year, start)
+    stats['count_nu'] = count
+    stats['max_va_yr'] = year[end]
+    stats['max_va'] = value[end]
+    stats['min_va_yr'] = year[start]
+    stats['min_va'] = value[start]
+    stats['mean_va'] = np.bincount(codes, weights=value,
+                                   minlength=len(stats)) / count
+
+    for p in PERCENTILES:
+        stats['p{:02d}_va'.format(p)] = _percentile(value, start, count, p)
+
+    return _format(stats, DAILY_COLUMNS)
+
+
+def _percentile(value, start, count, p):
+    """Percentile of each sorted group using the Weibull plotting position,
+    p(n + 1), interpolating between ranks.
+    """
+    rank = np.clip(p / 100 * (count + 1), 1, count) - 1
+    lower = np.floor(rank).astype('int64')
+    upper = np.minimum(lower + 1, count - 1)
+    fraction = rank - lower
+
+    low = value[start + lower]
+    return low + fraction * (value[start + upper] - low)
+
+
+def _period_means(values, periods, columns, complete):
+    by = ['site_no', 'parameter_cd', 'ts_id'] + periods
+    codes, stats = _group(values, by)
+
+    count = np.bincount(codes, minlength=len(stats))
+    stats['mean_va'] = np.bincount(codes, weights=values['value'].values,
+                                   minlength=len(stats)) / count
+
+    if complete:
+        stats = stats[count == _days_in_period(stats)]
+
+    return _format(stats, columns)
+
+
+def _days_in_period(stats):
+    """Number of days in each month or year of stats.
+    """
+    if 'month_nu' in stats:
+        start = pd.to_datetime(pd.DataFrame({'year': stats['year_nu'],
+                                             'month': stats['month_nu'],
+                                             'day': 1}))
+        return start.dt.days_in_month.values
+
+    # water year N includes February of calendar year N
+    year = stats['year_nu'].values
+    leap = (year % 4 == 0) & ((year % 100 != 0) | (year % 400 == 0))
+    return 365 + leap
+
+
+def _format(stats, columns):
+    stats = stats.reset_index(drop=True)
+    stats['agency_cd'] = 'USGS'
+    stats['loc_web_ds'] = np.nan
+    return stats[columns]
+
+
+def _select_stat_types(stats, statTypeCd):
+    if statTypeCd == 'all':
+        return stats
+
+    statTypeCd = [statTypeCd] if isinstance(statTypeCd, str) else statTypeCd
+    selected = []
+
+    for stat_type in statTypeCd:
+        if stat_type not in STAT_TYPES:
+            raise TypeError('Unrecognized statTypeCd: {}'.format(stat_type))
+        selected += STAT_TYPES[stat_type]
+
+    keep = [column for column in DAILY_COLUMNS
+            if column in KEY_COLUMNS or column in selected
+            or column in ['month_nu', 'day_nu', 'begin_yr', 'end_yr', 'count_nu']]
+
+    return stats[keep]
@@ -3,35 +3,204 @@ This module is a wrapper for the streamstats API, documentation for which is at
 https://streamstats.usgs.gov/streamstatsservices/#/
 """
 
+import hashlib
 import json
+import os
+import threading
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
 import requests
 
-def download_workspace(filepath, workspaceID, format=''):
-    """
+DOWNLOAD_URL = 'https://streamstats.usgs.gov/streamstatsservices/download'
+DOWNLOAD_CHUNK_SIZE = 2**20  # bytes
+RETRY_DELAY = 1  # seconds, doubled after each failed attempt
+TIMEOUT = (30, 300)  # seconds to connect, and to wait for each read
+
+
+def download_workspace(filepath, workspaceID, format='', members=None,
+                       extract_dir=None, checksum=None, algorithm='sha256',
+                       retries=2):
+    """Downloads a service workspace to filepath.
+
+    The response is streamed to disk in DOWNLOAD_CHUNK_SIZE pieces through
+    a partial file beside filepath, named for the workspace and format. If
+    the connection drops, the download resumes from the end of the partial
+    file with an HTTP Range request, both on retry and when called again.
+    The request carries the ETag (or Last-Modified date) of the first
+    response in If-Range, so a file that changed on the server is
+    downloaded again from the start.
 
     Args:
+        filepath (string): Path of the zip file to write.
         workspaceID (string): Service workspace received form watershed result
         format (string): Download return format. Default will return ESRI
                          geodatabase zipfile. 'SHAPE' will return a zip file containing
                          shape format.
+        members (list): Names of zip members to extract. Nothing is extracted
+                        if None.
+        extract_dir (string): Directory members are extracted to. Defaults to
+                              the directory of filepath.
+        checksum (string): Expected hex digest of the file.
+        algorithm (string): hashlib algorithm of checksum.
+        retries (int): Number of times an interrupted download is resumed.
 
     Returns:
-        A zip file containing the workspace contents, in either a geodatabase or shape
-        files.
+        filepath, or a list of the paths of the extracted members if members
+        is given.
     """
     payload = {'workspaceID':workspaceID, 'format':format}
-    url = 'https://streamstats.usgs.gov/streamstatsservices/download'
+    part = _part_path(filepath, workspaceID, format)
 
-    r = requests.get(url, params=payload)
+    for attempt in range(retries + 1):
+        try:
+            _download_part(DOWNLOAD_URL, part, params=payload)
+            break
 
-    r.raise_for_status()
-    return r
-    #data = r.raw.read()
+        except requests.HTTPError:
+            raise
+
+        except IOError:
+            # dropped connections and short responses; resume on the next try
+            if attempt == retries:
+                raise
+
+            time.sleep(RETRY_DELAY * 2**attempt)
+
+    if checksum is not None:
+        digest = _file_digest(part, algorithm)
+
+        if digest != checksum.lower():
+            _remove_part(part)
+            raise ValueError('Checksum mismatch for workspace {}: expected {}, '
+                             'got {}'.format(workspaceID, checksum, digest))
+
+    os.replace(part, filepath)
+    _remove_part(part)
+
+    if members is None:
+        return filepath
+
+    if extract_dir is None:
+        extract_dir = os.path.dirname(os.path.abspath(filepath))
+
+    with zipfile.ZipFile(filepath) as archive:
+        return [archive.extract(member, extract_dir) for member in members]
+
+
+def _part_path(filepath, workspaceID, format):
+    """Partial file of a download, so that parts of other workspaces or
+    formats are never resumed.
+    """
+    key = json.dumps([workspaceID, format]).encode()
+    return '{}.{}.part'.format(filepath, hashlib.sha1(key).hexdigest()[:12])
+
+
+def _remove_part(path):
+    for name in (path, path + '.validator'):
+        if os.path.exists(name):
+            os.remove(name)
+
+
+def _download_part(url, path, **kwargs):
+    """Streams url to path, resuming from the end of an existing path.
+
+    The validator of the response (its ETag, or Last-Modified) is kept in
+    path + '.validator' and sent in If-Range when resuming, so the server
+    sends the whole file again if it changed.
+
+    Raises IOError if the file is shorter than the length the server
+    reported.
+    """
+    offset = os.path.getsize(path) if os.path.exists(path) else 0
+    headers = {}
+
+    if offset:
+        headers['Range'] = 'bytes={}-'.format(offset)
+        validator = _read_validator(path)
+        if validator:
+            headers['If-Range'] = validator
+
+    with requests.get(url, headers=headers, stream=True, timeout=TIMEOUT,
+                      **kwargs) as r:
+        if r.status_code == 416:
+            total = r.headers.get('Content-Range', '').rsplit('/', 1)[-1]
+            if total == str(offset):
+                # the partial file is already complete
+                return
+
+            # the partial file is longer than the file, so start over
+            _remove_part(path)
+            return _download_part(url, path, **kwargs)
+
+        r.raise_for_status()
+
+        if r.status_code != 206:
+            # the server ignored the range, or the file changed, so start over
+            offset = 0
+            _write_validator(path, r.headers)
+
+        expected = _content_length(r.headers, offset)
+
+        with open(path, 'ab' if offset else 'wb') as f:
+            for chunk in r.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                f.write(chunk)
+
+    size = os.path.getsize(path)
+    if expected is not None and size != expected:
+        raise IOError('Incomplete download of {}: {} of {} bytes'
+                      .format(url, size, expected))
+
+
+def _read_validator(path):
+    if not os.path.exists(path + '.validator'):
+        return None
+
+    with open(path + '.validator') as f:
+        return f.read()
+
+
+def _write_validator(path, headers):
+    """Keeps the strong ETag, or else the Last-Modified date, of a response.
+    """
+    validator = headers.get('ETag')
+    if not validator or validator.startswith('W/'):
+        # weak ETags cannot be used in If-Range
+        validator = headers.get('Last-Modified')
+
+    if validator:
+        with open(path + '.validator', 'w') as f:
+            f.write(validator)
+
+    elif os.path.exists(path + '.validator'):
+        os.remove(path + '.validator')
+
+
+def _content_length(headers, offset):
+    """Total size of a resource from Content-Range or Content-Length.
+    """
+    if 'Content-Range' in headers:
+        total = headers['Content-Range'].rsplit('/', 1)[-1]
+        if total != '*':
+            return int(total)
+
+    if 'Content-Length' in headers:
+        return offset + int(headers['Content-Length'])
 
-    #with open(filepath, 'wb') as f:
-    #    f.write(data)
+    return None
+
+
+def _file_digest(path, algorithm):
+    digest = hashlib.new(algorithm)
+
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(DOWNLOAD_CHUNK_SIZE), b''):
+            digest.update(chunk)
+
+    return digest.hexdigest()
 
-    #return
 
 def get_sample_watershed():
     return get_watershed('NY',-74.524, 43.939) 
@@ -71,7 +240,7 @@ def get_watershed(rcode, xlocation, ylocation, crs=4326,
                'includefeatures':includefeatures, 'simplify':simplify}
     url = 'https://streamstats.usgs.gov/streamstatsservices/watershed.geojson'
 
-    r   = requests.get(url, params=payload)
+    r   = requests.get(url, params=payload, timeout=TIMEOUT)
 
     r.raise_for_status()
 
@@ -90,15 +259,142 @@ def get_watershed(rcode, xlocation, ylocation, crs=4326,
     data = json.loads(r.text)
     return Watershed.from_streamstats_json(data)
 
+def get_watersheds(points, max_workers=4, rate=1.0, cache_dir=None,
+                   precision=4, retries=2, **kwargs):
+    """Delineates watersheds for many points concurrently.
+
+    Coordinates are rounded to `precision` decimal places before the request
+    (4 places is about 10 m), and responses are cached as json in
+    `cache_dir`, keyed on the study area, rounded coordinates and request
+    options, so repeated runs only request new points.
+
+    Args:
+        points: DataFrame with rcode, x and y columns, or a sequence of
+                (rcode, x, y) tuples.
+        max_workers: Number of concurrent requests.
+        rate: Maximum number of requests started per second, across all
+              workers.
+        cache_dir: Directory for cached responses. Not cached if None.
+        precision: Decimal places the coordinates are rounded to.
+        retries: Number of times a failed request is retried.
+        **kwargs: Options passed to get_watershed, e.g. crs or simplify.
+
+    Returns:
+        List of Watershed objects in the order of points.
+    """
+    if isinstance(points, pd.DataFrame):
+        points = points[['rcode', 'x', 'y']].itertuples(index=False)
+
+    points = [(rcode, round(float(x), precision), round(float(y), precision))
+              for rcode, x, y in points]
+    limiter = _RateLimiter(rate)
+
+    if cache_dir is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def delineate(point):
+        path = None
+        if cache_dir is not None:
+            path = os.path.join(cache_dir, _cache_key(point, kwargs) + '.json')
+            if os.path.exists(path):
+                with open(path) as f:
+                    return Watershed.from_streamstats_json(json.load(f))
+
+        data = _fetch_watershed(point, limiter, retries, **kwargs)
+
+        if path is not None:
+            # write then rename, so an interrupted run leaves no partial file
+            with open(path + '.tmp', 'w') as f:
+                json.dump(data, f)
+            os.replace(path + '.tmp', path)
+
+        return Watershed.from_streamstats_json(data)
+
+    # points that round to the same coordinates are delineated once
+    unique = list(dict.fromkeys(points))
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        watersheds = dict(zip(unique, executor.map(delineate, unique)))
+
+    return [watersheds[point] for point in points]
+
+
+def watershed_parameters(watersheds):
+    """Collects the basin characteristics of watersheds into one table.
+
+    Args:
+        watersheds: List of Watershed objects, e.g. from get_watersheds.
+
+    Returns:
+        DataFrame with one row per watershed and characteristic, and columns
+        workspaceID, code, name, value and unit.
+    """
+    rows = [(watershed.workspaceID, parameter.get('code'),
+             parameter.get('name'), parameter.get('value'),
+             parameter.get('unit'))
+            for watershed in watersheds
+            for parameter in watershed.parameters]
+
+    return pd.DataFrame(rows, columns=['workspaceID', 'code', 'name',
+                                       'value', 'unit'])
+
+
+def _fetch_watershed(point, limiter, retries, **kwargs):
+    rcode, x, y = point
+
+    for attempt in range(retries + 1):
+        limiter.wait()
+        try:
+            return get_watershed(rcode, x, y, format='geojson', **kwargs).json()
+
+        except (requests.RequestException, ValueError):
+            if attempt == retries:
+                raise
+
+            time.sleep(RETRY_DELAY * 2**attempt)
+
+
+def _cache_key(point, options):
+    key = json.dumps([list(point), sorted(options.items())], default=str)
+    return hashlib.sha1(key.encode()).hexdigest()
+
+
+class _RateLimiter:
+    """Spaces out calls to wait() from any number of threads."""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate else 0
+        self.next_time = time.monotonic()
+        self.lock = threading.Lock()
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            delay = self.next_time - now
+            self.next_time = max(now, self.next_time) + self.interval
+
+        if delay > 0:
+            time.sleep(delay)
+
+
 class Watershed:
 
     @classmethod
     def from_streamstats_json(cls, streamstats_json):
-        cls.watershed_point = streamstats_json['featurecollection'][0]['feature']
-        cls.watershed_polygon = streamstats_json['featurecollection'][1]['feature']
-        cls.parameters = streamstats_json['parameters']
-        cls._workspaceID = streamstats_json['workspaceID']
-        return cls
+        self = cls.__new__(cls)
+        self._load(streamstats_json)
+        return self
 
     def __init__(self, rcode, xlocation, ylocation):
-        self = get_watershed(rcode, xlocation, ylocation)
+        r = get_watershed(rcode, xlocation, ylocation, format='geojson')
+        self._load(r.json())
+
+    def _load(self, streamstats_json):
+        self.watershed_point = streamstats_json['featurecollection'][0]['feature']
+        self.watershed_polygon = streamstats_json['featurecollection'][1]['feature']
+        self.parameters = streamstats_json['parameters']
+        self._workspaceID = streamstats_json['workspaceID']
+
+    @property
+    def workspaceID(self):
+        return self._workspaceID
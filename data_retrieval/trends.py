@@ -0,0 +1,275 @@
+"""
+Batch trend tests for annual peak streamflow, or any other series indexed by
+site and time.
+
+Functions in this module take the output of
+nwis.format_response(df, service='peaks') and test every site at once.
+Series are packed into a padded (site x observation) array, and statistics
+are computed with array operations across sites instead of a per-site loop.
+
+Time is measured in days since the first observation at each site, as in
+the peak discharge trends demo (demos/NWIS_demo_1.ipynb).
+
+Example
+-------
+>>> peaks = nwis.get_record(state_cd='il', start='1970-01-01', service='peaks')
+>>> trends.mann_kendall(peaks)
+>>> trends.linear_trend(peaks)
+"""
+import math
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+SITENO_COL = 'site_no'
+DATETIME_COL = 'datetime'
+
+
+def mann_kendall(df, column='peak_va', chunk_size=1000, processes=None):
+    """Mann-Kendall trend test and Sen's slope for each site.
+
+    Parameters
+    ----------
+    df : DataFrame
+        Indexed by (site_no, datetime), or by datetime with a site_no column.
+
+    column : string
+        Column to test for a trend.
+
+    chunk_size : int
+        Number of sites processed together. Memory use grows with
+        chunk_size times the square of the longest record.
+
+    processes : int, optional
+        If given, process chunks in a pool of this many processes.
+
+    Returns
+    -------
+    DataFrame indexed by site_no with columns n, s, var_s, z, p_value, and
+    sens_slope (units of column per day).
+    """
+    sites, values, days = _pad(df, column)
+
+    chunks = [(values[i:i + chunk_size], days[i:i + chunk_size])
+              for i in range(0, len(sites), chunk_size)]
+
+    if processes:
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            results = list(executor.map(_mann_kendall_chunk, chunks))
+
+    else:
+        results = [_mann_kendall_chunk(chunk) for chunk in chunks]
+
+    s, slope = [np.concatenate(result) for result in zip(*results)]
+
+    n = np.sum(~np.isnan(values), axis=1)
+    var_s = (n * (n - 1) * (2 * n + 5) - _tie_correction(values)) / 18
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        z = np.where(s > 0, (s - 1) / np.sqrt(var_s),
+                     np.where(s < 0, (s + 1) / np.sqrt(var_s), 0))
+
+    out = pd.DataFrame({'n': n, 's': s, 'var_s': var_s, 'z': z,
+                        'p_value': _norm_sf(np.abs(z)) * 2,
+                        'sens_slope': slope},
+                       index=sites,
+                       columns=['n', 's', 'var_s', 'z', 'p_value', 'sens_slope'])
+    out.index.name = SITENO_COL
+    return out
+
+
+def linear_trend(df, column='peak_va', normalize=True):
+    """Ordinary least squares regression of column on time for each site.
+
+    Reproduces the regression in the peak discharge trends demo, which
+    applies scipy.stats.linregress to each site in turn.
+
+    Parameters
+    ----------
+    df : DataFrame
+        Indexed by (site_no, datetime), or by datetime with a site_no column.
+
+    column : string
+        Dependent variable.
+
+    normalize : boolean, default True
+        Standardize column at each site before the regression.
+
+    Returns
+    -------
+    DataFrame indexed by site_no with columns slope, intercept, p_value, and
+    std_error (standard error of the slope).
+    """
+    sites, values, days = _pad(df, column)
+
+    valid = ~np.isnan(values)
+    n = valid.sum(axis=1)
+    x = np.where(valid, days, 0)
+    y = np.where(valid, values, 0)
+
+    x_mean = x.sum(axis=1) / n
+    y_mean = y.sum(axis=1) / n
+    dx = np.where(valid, days - x_mean[:, None], 0)
+    dy = np.where(valid, values - y_mean[:, None], 0)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        if normalize:
+            dy = dy / np.sqrt((dy ** 2).sum(axis=1) / (n - 1))[:, None]
+            y_mean = np.zeros(len(sites))
+
+        sxx = (dx ** 2).sum(axis=1)
+        syy = (dy ** 2).sum(axis=1)
+        sxy = (dx * dy).sum(axis=1)
+
+        slope = sxy / sxx
+        r = np.clip(sxy / np.sqrt(sxx * syy), -1, 1)
+        dof = n - 2
+        t = r * np.sqrt(dof / ((1 - r) * (1 + r)))
+        p_value = _betainc(0.5 * dof, 0.5, dof / (dof + t ** 2))
+        std_error = np.sqrt((1 - r ** 2) * syy / sxx / dof)
+
+    out = pd.DataFrame({'slope': slope,
+                        'intercept': y_mean - slope * x_mean,
+                        'p_value': p_value,
+                        'std_error': std_error},
+                       index=sites,
+                       columns=['slope', 'intercept', 'p_value', 'std_error'])
+    out.index.name = SITENO_COL
+    return out
+
+
+def _pad(df, column):
+    """Packs each site's series into a row of a NaN-padded array.
+
+    Returns
+    -------
+    sites : Index of site numbers
+    values : 2-d array of column values, ordered by time within each row
+    days : 2-d array of days since each site's first observation
+    """
+    df = df.reset_index()
+    df = df[df[column].notnull() & df[DATETIME_COL].notnull()]
+
+    codes, sites = pd.factorize(df[SITENO_COL], sort=True)
+    times = pd.to_datetime(df[DATETIME_COL]).values.astype('datetime64[ns]') \
+              .astype('int64')
+
+    order = np.lexsort((times, codes))
+    codes = codes[order]
+    times = times[order]
+
+    count = np.bincount(codes, minlength=len(sites))
+    start = np.concatenate([[0], np.cumsum(count)[:-1]])
+    position = np.arange(len(codes)) - start[codes]
+
+    values = np.full((len(sites), count.max() if len(count) else 0), np.nan)
+    values[codes, position] = df[column].values[order]
+
+    days = np.full(values.shape, np.nan)
+    days[codes, position] = (times - times[start][codes]) / (86400 * 1e9)
+
+    return pd.Index(sites, name=SITENO_COL), values, days
+
+
+def _mann_kendall_chunk(chunk):
+    """Mann-Kendall S and Sen's slope for a chunk of padded series.
+    """
+    values, days = chunk
+    s = np.zeros(len(values))
+    slopes = []
+
+    # compare every observation with each later one, one lag at a time
+    for lag in range(1, values.shape[1]):
+        diff = values[:, lag:] - values[:, :-lag]
+        s += np.nansum(np.sign(diff), axis=1)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            slopes.append(diff / (days[:, lag:] - days[:, :-lag]))
+
+    if slopes:
+        slopes = np.concatenate(slopes, axis=1)
+        # rows with fewer than two observations are all NaN
+        has_pairs = ~np.isnan(slopes).all(axis=1)
+        slope = np.full(len(values), np.nan)
+        slope[has_pairs] = np.nanmedian(slopes[has_pairs], axis=1)
+
+    else:
+        slope = np.full(len(values), np.nan)
+
+    return s, slope
+
+
+def _tie_correction(values):
+    """Sum of t(t - 1)(2t + 5) over groups of t tied values in each row.
+    """
+    rows, cols = np.nonzero(~np.isnan(values))
+    ties = pd.DataFrame({'row': rows, 'value': values[rows, cols]})
+    t = ties.groupby(['row', 'value']).size()
+    t = (t * (t - 1) * (2 * t + 5)).groupby(level='row').sum()
+
+    return t.reindex(np.arange(len(values)), fill_value=0).values
+
+
+def _norm_sf(x):
+    """Survival function of the standard normal distribution.
+    """
+    return 0.5 * np.frompyfunc(math.erfc, 1, 1)(x / math.sqrt(2)).astype('float64')
+
+
+def _betainc(a, b, x, iterations=200):
+    """Regularized incomplete beta function, elementwise.
+
+    Evaluated with the continued fraction of Numerical Recipes (betacf),
+    so that t-test p-values do not require scipy.
+    """
+    a, b, x = np.broadcast_arrays(*[np.asarray(v, dtype='float64') for v in (a, b, x)])
+    undefined = ~((a > 0) & (b > 0)) | np.isnan(x)
+    a = np.where(undefined, 1, a)
+    b = np.where(undefined, 1, b)
+    edge = (x <= 0) | (x >= 1)
+    x_edge = np.clip(x, 0, 1)
+    x = np.where(edge | undefined, 0.5, x)
+    lgamma = np.frompyfunc(math.lgamma, 1, 1)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        front = np.exp((lgamma(a + b) - lgamma(a) - lgamma(b)).astype('float64')
+                       + a * np.log(x) + b * np.log1p(-x))
+
+        # the continued fraction converges for x < (a + 1) / (a + b + 2)
+        swap = x >= (a + 1) / (a + b + 2)
+        a, b, x = np.where(swap, b, a), np.where(swap, a, b), np.where(swap, 1 - x, x)
+        result = front * _betacf(a, b, x, iterations) / a
+
+    result = np.where(swap, 1 - result, result)
+    result = np.where(edge, x_edge, result)
+    return np.where(undefined, np.nan, result)
+
+
+def _betacf(a, b, x, iterations):
+    tiny = 1e-300
+    qab = a + b
+    qap = a + 1
+    qam = a - 1
+    c = np.ones_like(x)
+    d = 1 - qab * x / qap
+    d = 1 / np.where(np.abs(d) < tiny, tiny, d)
+    h = d
+
+    for m in range(1, iterations + 1):
+        m2 = 2 * m
+        aa = m * (b - m) * x / ((qam + m2) * (a + m2))
+        d = 1 + aa * d
+        d = 1 / np.where(np.abs(d) < tiny, tiny, d)
+        c = 1 + aa / c
+        c = np.where(np.abs(c) < tiny, tiny, c)
+        h = h * d * c
+
+        aa = -(a + m) * (qab + m) * x / ((a + m2) * (qap + m2))
+        d = 1 + aa * d
+        d = 1 / np.where(np.abs(d) < tiny, tiny, d)
+        c = 1 + aa / c
+        c = np.where(np.abs(c) < tiny, tiny, c)
+        h = h * d * c
+
+    return h
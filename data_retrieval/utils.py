@@ -1,6 +1,7 @@
 """
 Useful utilities for data munging.
 """
+import numpy as np
 import pandas as pd
 from pandas.core.indexes.multi import MultiIndex
 from pandas.core.indexes.datetimes import DatetimeIndex
@@ -61,10 +62,20 @@ def format_datetime(df, date_field, time_field, tz_field):
     return df
 
 
-def mmerge_asof(left, right, tolerance=None, **kwargs):
+def mmerge_asof(left, right, tolerance=None, direction='backward',
+                allow_exact_matches=True, suffixes=('_x', '_y'), **kwargs):
     """Merges two dataframes with multi-index.
 
-    Only works on two-level multi-index where the second level is a time.
+    The last level of each index is the time level; all other levels (any
+    number of them) are grouping levels, e.g. ``site_no``. For each row in
+    left, the nearest row in right from the same group is selected.
+
+    Neither frame is reset or copied wholesale: group keys are taken from
+    the index codes, and right is only sorted if it is not already sorted by
+    group and time. Each group of left is then found with searchsorted
+    among the rows of right from the same group, so no times are sorted
+    when the inputs are already in order. Rows of left keep their original
+    order.
 
     Parameters
     ----------
@@ -75,71 +86,398 @@ def mmerge_asof(left, right, tolerance=None, **kwargs):
     tolerance : integer or Timedelta, optional, default None
         Select asof tolerance within this range; must be compatible with the merge index.
 
+    direction : string ('backward', 'forward', or 'nearest')
+        Whether to search for prior, subsequent, or closest matches.
+
+    allow_exact_matches : boolean, default True
+        If False, do not match rows with exactly the same time.
+
+    suffixes : tuple of strings
+        Suffixes applied to overlapping column names.
+
     Returns
     -------
     merged : DataFrame
+        left joined with matching rows of right; rows of left with a missing
+        time are dropped.
 
     Examples
     --------
-    TODO
+    >>> samples = nwis.get_record(sites, start, end, service='qwdata')
+    >>> iv = nwis.get_record(sites, start, end, service='iv')
+    >>> mmerge_asof(samples, iv, tolerance=pd.Timedelta('30min'),
+                    direction='nearest')
     """
-    # if not multiindex pass  to merge_asof
-    if not isinstance(left.index, MultiIndex) and not isinstance(right.index, MultiIndex):
-        return pd.merge_asof(left, right,
-                             tolerance=tolerance,
-                             right_index=True,
-                             left_index=True)
-
-    elif left.index.names != right.index.names:
+    if direction not in ('backward', 'forward', 'nearest'):
+        raise ValueError('Unrecognized direction: {}'.format(direction))
+
+    if left.index.names != right.index.names:
         raise TypeError('Both indexes must have matching names')
 
-    #check that lowest level is the datetime index
+    # tz-aware times compare in UTC, naive times as wall clock time
+    if (_time_zone(left.index) is None) != (_time_zone(right.index) is None):
+        raise ValueError('Cannot merge tz-aware times with naive times')
+
+    left_time, left_valid = _time_values(left.index)
+    left_codes = _group_codes(left.index, right.index)
+
+    if not left_valid.all():
+        left = left[left_valid]
+        left_time = left_time[left_valid]
+        left_codes = left_codes[left_valid]
+
+    right_time, right_valid = _time_values(right.index)
+    right_codes = _group_codes(right.index, left.index)
+    right_valid &= right_codes >= 0
+
+    if not right_valid.all():
+        right = right[right_valid]
+        right_time = right_time[right_valid]
+        right_codes = right_codes[right_valid]
+
+    # right must be sorted by (group, time); sort only if it is not already
+    if not _is_sorted(right_codes, right_time):
+        order = np.lexsort((right_time, right_codes))
+        right = right.iloc[order]
+        right_codes = right_codes[order]
+        right_time = right_time[order]
+
+    idx, valid = _asof_positions(left_codes, left_time, right_codes, right_time,
+                                 direction, allow_exact_matches)
+
+    if tolerance is not None and len(right_time):
+        if isinstance(tolerance, str) or hasattr(tolerance, 'days'):
+            tolerance = pd.Timedelta(tolerance).value
+        valid &= np.abs(left_time - right_time[idx]) <= tolerance
+
+    matched = right.reset_index(drop=True).reindex(np.where(valid, idx, -1))
+    matched.index = left.index
+
+    overlap = left.columns.intersection(matched.columns)
+    left = left.rename(columns={c: c + suffixes[0] for c in overlap})
+    matched = matched.rename(columns={c: c + suffixes[1] for c in overlap})
+
+    return pd.concat([left, matched], axis=1)
+
+
+def _asof_positions(left_codes, left_time, right_codes, right_time,
+                    direction, allow_exact_matches):
+    """Finds the row of right matching each row of left.
+
+    right must be sorted by group, then time. Each group of left is searched
+    only within the rows of right from the same group, so no times are
+    sorted.
+
+    Returns
+    -------
+    idx : array of positions in right
+    valid : boolean array, False where there is no match
+    """
+    n_left = len(left_codes)
+
+    if not len(right_time):
+        return np.zeros(n_left, dtype=np.intp), np.zeros(n_left, dtype=bool)
+
+    back = np.full(n_left, -1, dtype=np.intp)
+    fwd = np.full(n_left, -1, dtype=np.intp)
+
+    # rows of left grouped together, keeping their order within each group
+    if len(left_codes) > 1 and (np.diff(left_codes) < 0).any():
+        order = np.argsort(left_codes, kind='stable')
+    else:
+        order = np.arange(n_left)
+
+    sorted_codes = left_codes[order]
+    bounds = np.flatnonzero(sorted_codes[1:] != sorted_codes[:-1]) + 1
+    starts = np.concatenate([[0], bounds])
+    ends = np.concatenate([bounds, [n_left]])
+    group_codes = sorted_codes[starts] if n_left else sorted_codes
+    lows = np.searchsorted(right_codes, group_codes, side='left')
+    highs = np.searchsorted(right_codes, group_codes, side='right')
+
+    for start, end, code, low, high in zip(starts, ends, group_codes, lows, highs):
+        if code < 0 or low == high:
+            continue
+
+        rows = order[start:end]
+        times = right_time[low:high]
 
-    #check that their are only two levels
+        if direction != 'forward':
+            pos = np.searchsorted(times, left_time[rows],
+                                  side='right' if allow_exact_matches else 'left') - 1
+            back[rows] = np.where(pos >= 0, low + pos, -1)
 
-    out_df = pd.DataFrame()
-    dt_name = left.index.names[1]
-    #TODO modify to handle more levels
-    index_name = left.index.names[0]
+        if direction != 'backward':
+            pos = np.searchsorted(times, left_time[rows],
+                                  side='left' if allow_exact_matches else 'right')
+            fwd[rows] = np.where(pos < high - low, low + pos, -1)
 
-    left_temp = left.reset_index().dropna(subset=[dt_name]).sort_values([dt_name])
-    right_temp = right.reset_index().dropna(subset=[dt_name]).sort_values([dt_name])
+    if direction == 'backward':
+        return np.maximum(back, 0), back >= 0
 
-    merged_df = pd.merge_asof(left_temp, right_temp,
-                              tolerance=tolerance,
-                              on=dt_name,
-                              by=index_name)
+    if direction == 'forward':
+        return np.maximum(fwd, 0), fwd >= 0
 
-    return merged_df.set_index([index_name, dt_name]).sort_index()
+    back_valid = back >= 0
+    fwd_valid = fwd >= 0
+    back_dist = np.where(back_valid, left_time - right_time[np.maximum(back, 0)],
+                         np.inf)
+    fwd_dist = np.where(fwd_valid, right_time[np.maximum(fwd, 0)] - left_time,
+                        np.inf)
+    use_back = back_dist <= fwd_dist
+
+    return (np.where(use_back, np.maximum(back, 0), np.maximum(fwd, 0)),
+            np.where(use_back, back_valid, fwd_valid))
+
+
+def _is_sorted(codes, time):
+    """Whether rows are sorted by codes, then time.
+    """
+    if len(codes) < 2:
+        return True
+
+    step = np.diff(codes)
+    return not ((step < 0).any() or ((step == 0) & (np.diff(time) < 0)).any())
+
+
+def _time_zone(index):
+    """Time zone of the last index level, or None if it is naive or not
+    datetimes.
+    """
+    if isinstance(index, MultiIndex):
+        index = index.levels[-1]
+
+    return getattr(index, 'tz', None)
+
+
+def _time_values(index):
+    """Returns the last index level as a numeric array and a mask of
+    non-missing values.
+    """
+    if isinstance(index, MultiIndex):
+        index = index.get_level_values(-1)
+
+    valid = ~np.asarray(index.isna())
+
+    if isinstance(index, DatetimeIndex):
+        values = np.asarray(index, dtype='datetime64[ns]').view('i8')
+
+    else:
+        values = np.asarray(index, dtype='float64')
+
+    return values, valid
+
+
+def _group_codes(index, other):
+    """Encodes the grouping levels of index (all but the last) as integers
+    that are consistent with, and sort in the same order as, the grouping
+    levels of other.
+
+    Returns -1 where any grouping level is missing.
+    """
+    if not isinstance(index, MultiIndex):
+        return np.zeros(len(index), dtype='int64')
+
+    codes = np.zeros(len(index), dtype='int64')
+    missing = np.zeros(len(index), dtype=bool)
+
+    for i in range(index.nlevels - 1):
+        # union of both levels is sorted, so codes keep lexicographic order
+        level = index.levels[i].union(other.levels[i])
+        level_codes = np.asarray(_level_codes(index, i))
+        mapped = level.get_indexer(index.levels[i])
+        missing |= level_codes < 0
+        codes = codes * len(level) + mapped[level_codes]
+
+    codes[missing] = -1
+
+    return codes
+
+
+def _level_codes(index, i):
+    """Returns the integer codes of a MultiIndex level.
+    """
+    # MultiIndex.labels was renamed to codes in pandas 0.24
+    if hasattr(index, 'codes'):
+        return index.codes[i]
+
+    return index.labels[i]
 
 #This function may be deprecated once pandas.update support joins besides left.
-def update_merge(left, right, na_only=False, on=None, **kwargs):
+def update_merge(left, right, na_only=False, on=None, upsert=False):
     """Performs a combination update and merge.
 
-    Args:
-    left (DataFrame): original data
-    right (DataFrame): updated data
-    na_only (bool): if True, only update na values
+    Rows are aligned on the union of the keys in left and right, so the
+    result contains every key from either frame, sorted. Overlapping columns
+    are reconciled in bulk rather than through suffixed copies.
+
+    Parameters
+    ----------
+    left : DataFrame
+        Original data.
+
+    right : DataFrame
+        Updated data.
+
+    na_only : boolean, default False
+        If True, only fill values that are missing in left. Otherwise
+        non-missing values in right replace those in left.
+
+    on : string or list, optional
+        Column(s) to align on. If None, align on the index. Keys must be
+        unique within each frame.
 
-    TODO: na_only
+    upsert : boolean, default False
+        If True, every row of right replaces the matching row of left
+        outright, including missing values. Keys only in left are kept.
+
+    Returns
+    -------
+    DataFrame
     """
-    #df = left.merge(right, how='outer',
-    #                left_index=True, right_index=True)
-    df = left.merge(right, how='outer', on=on, **kwargs)
+    index_names = None
+
+    if on is None:
+        # align on the index by treating its levels as key columns
+        index_names = list(left.index.names)
+        left = left.reset_index()
+        right = right.reset_index()
+        on = list(left.columns[:len(index_names)])
+
+    on = [on] if isinstance(on, str) else list(on)
 
+    left_key, right_key, key_columns = _key_codes(left, right, on)
+    keys, left_pos, right_pos = _key_union(left_key, right_key, key_columns)
 
-    # check for column overlap and resolve update
-    for column in df.columns:
-        #if duplicated column, use the value from right
-        if column[-2:] == '_x':
-            name = column[:-2] # find column name
+    if len(left_pos) and np.bincount(left_pos).max() > 1 \
+    or len(right_pos) and np.bincount(right_pos).max() > 1:
+        raise ValueError('update_merge requires unique keys in both frames')
 
-            if na_only:
-                df[name] = df[name+'_x'].fillna(df[name+'_y'])
+    left_take = np.full(len(keys), -1, dtype=np.intp)
+    left_take[left_pos] = np.arange(len(left_pos))
+    right_take = np.full(len(keys), -1, dtype=np.intp)
+    right_take[right_pos] = np.arange(len(right_pos))
+
+    columns = _decode_keys(keys, key_columns)
+    # release intermediates before the value columns are allocated
+    del keys, left_key, right_key, left_pos, right_pos
+
+    if upsert:
+        in_right = right_take >= 0
+
+    for column in left.columns:
+        if column in on:
+            continue
+
+        values = _take(left[column].values, left_take)
+
+        if column in right.columns:
+            updates = _take(right[column].values, right_take)
+
+            if upsert:
+                mask = in_right
+
+            elif na_only:
+                mask = pd.isnull(values) & pd.notnull(updates)
 
             else:
-                df[name] = df[name+'_x'].update(df[name+'_y'])
+                mask = pd.notnull(updates)
 
-            df.drop([name + '_x', name + '_y'], axis=1, inplace=True)
+            values = _fill(values, updates, mask)
+
+        columns[column] = values
+
+    for column in right.columns:
+        if column not in columns:
+            columns[column] = _take(right[column].values, right_take)
+
+    df = pd.DataFrame(columns, columns=list(columns), copy=False)
+
+    if index_names is not None:
+        df = df.set_index(on)
+        df.index.names = index_names
 
     return df
+
+
+def _take(values, indexer):
+    """Takes values by position, filling with NA where indexer is -1.
+    """
+    return pd.api.extensions.take(values, indexer, allow_fill=True)
+
+
+def _fill(values, updates, mask):
+    """Replaces values with updates where mask is True.
+    """
+    if isinstance(values, np.ndarray) and isinstance(updates, np.ndarray):
+        if not np.can_cast(updates.dtype, values.dtype):
+            values = values.astype(np.result_type(values.dtype, updates.dtype))
+        values[mask] = updates[mask]
+        return values
+
+    return pd.Series(values).mask(mask, pd.Series(updates)).values
+
+
+def _key_codes(left, right, on):
+    """Encodes the key columns of left and right as sortable integers.
+
+    Returns
+    -------
+    left_key, right_key : integer arrays
+    key_columns : list of (name, uniques) pairs used by _decode_keys
+    """
+    left_key = np.zeros(len(left), dtype='int64')
+    right_key = np.zeros(len(right), dtype='int64')
+    key_columns = []
+
+    for column in on:
+        left_codes, left_uniques = pd.factorize(left[column])
+        right_codes, right_uniques = pd.factorize(right[column])
+
+        if (left_codes < 0).any() or (right_codes < 0).any():
+            raise ValueError('Key column {} contains missing values'.format(column))
+
+        # map each frame's codes into the sorted union of both
+        uniques = pd.Index(left_uniques).union(pd.Index(right_uniques))
+        left_codes = uniques.get_indexer(left_uniques)[left_codes]
+        right_codes = uniques.get_indexer(right_uniques)[right_codes]
+
+        left_key = left_key * len(uniques) + left_codes
+        right_key = right_key * len(uniques) + right_codes
+        key_columns.append((column, uniques))
+
+    return left_key, right_key, key_columns
+
+
+def _key_union(left_key, right_key, key_columns):
+    """Sorted union of two key arrays and the position of each key in it.
+    """
+    key_space = np.prod([len(uniques) for _, uniques in key_columns],
+                        dtype='float64')
+
+    if key_space <= 4 * (len(left_key) + len(right_key)):
+        # dense keys: mark present keys instead of sorting
+        present = np.zeros(int(key_space), dtype=bool)
+        present[left_key] = True
+        present[right_key] = True
+        rank = np.cumsum(present)
+        rank -= 1
+        return np.flatnonzero(present), rank[left_key], rank[right_key]
+
+    keys = np.sort(np.concatenate([left_key, right_key]))
+    keys = keys[np.concatenate([[True], keys[1:] != keys[:-1]])]
+
+    return keys, np.searchsorted(keys, left_key), np.searchsorted(keys, right_key)
+
+
+def _decode_keys(keys, key_columns):
+    """Inverse of _key_codes; returns a dict of key column values.
+    """
+    columns = {}
+
+    for column, uniques in reversed(key_columns):
+        # .array keeps extension dtypes, such as tz-aware datetimes
+        columns[column] = uniques.take(keys % len(uniques)).array
+        keys = keys // len(uniques)
+
+    return {column: columns[column] for column, _ in key_columns}
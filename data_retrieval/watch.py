@@ -0,0 +1,263 @@
+"""
+Watch many NWIS instantaneous value (iv) sites for new data.
+
+An IVWatcher polls get_iv for its sites in batches and keeps, for each
+site, the time of its newest value (the high-water mark). The first poll of
+a site requests the whole lookback period; later polls request only values
+since the high-water mark (less a short revision window), and only from
+sites whose data changed since they were last polled (modifiedSince), so
+unchanged data is not transferred again. Each poll returns only the rows
+that are new or whose values were revised.
+
+The last `lookback` of values of each site is kept in memory, capped at
+`maxlen` rows per site.
+
+Example
+-------
+>>> watcher = IVWatcher(sites, parameterCd='00060', lookback='PT6H')
+>>> watcher.run(print, interval=300)
+
+or, in a coroutine
+
+>>> async for rows in watcher.stream(interval=300):
+...     print(rows)
+"""
+import asyncio
+import math
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+from data_retrieval import nwis
+
+SITENO_COL = 'site_no'
+DATETIME_COL = 'datetime'
+
+BATCH_SIZE = 100
+
+
+class IVWatcher():
+    """Polls iv sites and returns their new or revised values.
+    """
+    def __init__(self, sites, parameterCd=None, lookback='PT6H',
+                 revisions='PT1H', maxlen=None, batch_size=BATCH_SIZE,
+                 max_workers=4):
+        """
+        Parameters
+        ----------
+        sites : list
+            Site numbers to watch.
+
+        parameterCd : string or list, optional
+            Parameter codes to watch; all parameters otherwise.
+
+        lookback : string or Timedelta
+            Period of values kept for each site and requested on the first
+            poll, e.g. 'PT6H'.
+
+        revisions : string or Timedelta
+            How far before each site's newest value later polls request
+            again, so that revised values are found.
+
+        maxlen : int, optional
+            Maximum number of rows kept for each site; one row per minute of
+            lookback by default.
+
+        batch_size : int
+            Number of sites per request.
+
+        max_workers : int
+            Number of concurrent requests.
+        """
+        self.sites = [str(site) for site in dict.fromkeys(sites)]
+        self.parameterCd = parameterCd
+        self.lookback = pd.Timedelta(lookback)
+        self.revisions = pd.Timedelta(revisions)
+        self.maxlen = maxlen or int(self.lookback / pd.Timedelta(minutes=1)) + 1
+        self.batch_size = batch_size
+        self.max_workers = max_workers
+
+        # time of the newest value and of the last successful poll of each site
+        self.high_water = pd.Series(pd.NaT, index=self.sites,
+                                    dtype='datetime64[ns, UTC]')
+        self.polled = self.high_water.copy()
+        self.buffer = pd.DataFrame(index=pd.MultiIndex.from_arrays(
+            [pd.Index([], dtype=object),
+             pd.DatetimeIndex([], tz='UTC', dtype='datetime64[ns, UTC]')],
+            names=[SITENO_COL, DATETIME_COL]))
+        # exception raised by the last poll of each site that failed
+        self.failed = {}
+
+    def values(self, site):
+        """The buffered values of a site, indexed by datetime (UTC).
+        """
+        if site not in self.buffer.index.get_level_values(SITENO_COL):
+            return self.buffer.iloc[:0].droplevel(SITENO_COL)
+
+        return self.buffer.xs(site, level=SITENO_COL)
+
+    def poll(self):
+        """Requests each batch of sites once.
+
+        Batches that fail, including requests the service rejects, are
+        skipped, recorded in `failed`, and requested again, from the same
+        point, on the next poll. Only a 404 response means a batch has no
+        new data.
+
+        Returns
+        -------
+        DataFrame of the new or revised rows, indexed by site_no and datetime
+        (UTC), and empty if there were none.
+        """
+        now = pd.Timestamp.now(tz='UTC')
+        batches = self._batches()
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = [executor.submit(self._fetch, batch, now)
+                       for batch in batches]
+
+            changed = []
+            for batch, future in zip(batches, futures):
+                try:
+                    df = future.result()
+
+                except Exception as e:
+                    self.failed.update(dict.fromkeys(batch, e))
+                    continue
+
+                for site in batch:
+                    self.failed.pop(site, None)
+
+                self.polled[batch] = now
+                if df is not None and not df.empty:
+                    changed.append(self._update(df))
+
+        if not changed:
+            return self.buffer.iloc[:0]
+
+        return pd.concat(changed).sort_index()
+
+    def run(self, callback, interval=300, polls=None):
+        """Polls every `interval` seconds and passes the new or revised rows
+        of each poll, if any, to callback.
+
+        Parameters
+        ----------
+        callback : function
+            Called with the DataFrame returned by poll.
+
+        interval : float
+            Seconds between the start of each poll.
+
+        polls : int, optional
+            Number of polls before returning; runs until interrupted
+            otherwise.
+        """
+        count = 0
+        while polls is None or count < polls:
+            start = time.monotonic()
+            df = self.poll()
+            count += 1
+
+            if not df.empty:
+                callback(df)
+
+            if polls is None or count < polls:
+                time.sleep(max(interval - (time.monotonic() - start), 0))
+
+    async def stream(self, interval=300, polls=None):
+        """Asynchronous iterator over the new or revised rows of each poll.
+
+        Polls run in the default executor, so the event loop is not blocked.
+        Polls without new rows are not yielded.
+        """
+        loop = asyncio.get_running_loop()
+        count = 0
+
+        while polls is None or count < polls:
+            start = loop.time()
+            df = await loop.run_in_executor(None, self.poll)
+            count += 1
+
+            if not df.empty:
+                yield df
+
+            if polls is None or count < polls:
+                await asyncio.sleep(max(interval - (loop.time() - start), 0))
+
+    def _batches(self):
+        # sites with similar high-water marks share a batch, so each request
+        # covers a short period; sites never polled come first
+        order = self._start().sort_values(na_position='first').index
+        return [list(order[i:i + self.batch_size])
+                for i in range(0, len(order), self.batch_size)]
+
+    def _fetch(self, batch, now):
+        kwargs = {'sites': batch}
+        if self.parameterCd is not None:
+            kwargs['parameterCd'] = self.parameterCd
+
+        start = self._start()[batch]
+        polled = self.polled[batch]
+
+        if polled.isna().any():
+            kwargs['period'] = _duration(self.lookback)
+
+        else:
+            start = max(start.min(), now - self.lookback)
+            kwargs['startDT'] = start.strftime('%Y-%m-%dT%H:%MZ')
+            kwargs['modifiedSince'] = _duration(now - polled.min())
+
+        df = nwis.get_iv(**kwargs)
+
+        if df is None or df.empty:
+            return None
+
+        df = df.reset_index()
+        df[DATETIME_COL] = pd.to_datetime(df[DATETIME_COL], utc=True)
+        df[SITENO_COL] = df[SITENO_COL].astype(object)
+
+        return df.set_index([SITENO_COL, DATETIME_COL]).sort_index()
+
+    def _start(self):
+        # earliest value to request again from each site: the revision window
+        # before its newest value, or before its last poll if it had none
+        return self.high_water.fillna(self.polled) - self.revisions
+
+    def _update(self, df):
+        """Adds rows to the buffer and returns those that are new or differ
+        from the buffered values.
+        """
+        old = self.buffer.reindex(index=df.index, columns=df.columns)
+        same = (old == df) | (old.isna() & df.isna())
+        changed = df[~same.all(axis=1).values]
+
+        if changed.empty:
+            return changed
+
+        keep = ~self.buffer.index.isin(changed.index)
+        buffer = pd.concat([self.buffer[keep], changed]).sort_index()
+
+        sites = changed.index.get_level_values(SITENO_COL)
+        newest = pd.Series(changed.index.get_level_values(DATETIME_COL)) \
+            .groupby(sites.values).max()
+        current = self.high_water[newest.index]
+        self.high_water[newest.index] = current.where(current > newest, newest)
+
+        # drop values older than the lookback, then cap the rows per site
+        times = buffer.index.get_level_values(DATETIME_COL)
+        cutoff = self.high_water.reindex(
+            buffer.index.get_level_values(SITENO_COL)) - self.lookback
+        buffer = buffer[times >= pd.DatetimeIndex(cutoff)]
+        self.buffer = buffer.groupby(level=SITENO_COL, sort=False) \
+            .tail(self.maxlen)
+
+        return changed
+
+
+def _duration(timedelta):
+    """ISO 8601 duration in whole minutes, rounded up.
+    """
+    minutes = max(math.ceil(timedelta / pd.Timedelta(minutes=1)), 1)
+    return 'PT{}M'.format(minutes)
@@ -6,12 +6,45 @@ See www.waterqualitydata.us/webservices_documentation for API reference
 TODO:
     - implement other services like Organization, Acticity, etc.
 """
+import itertools
+import time
+import numpy as np
 import pandas as pd
-from io import StringIO
-from data_retrieval.nwis import query
+import requests
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from tempfile import SpooledTemporaryFile
 
+from data_retrieval.codes import tz
+from data_retrieval.utils import to_str
+from data_retrieval.wqp_schema import PROFILES, DATETIMES, CATEGORY, FLOAT, DATE
 
-def get_results(**kwargs):
+# responses larger than this are spooled to disk rather than held in memory
+SPOOL_SIZE = 16 * 2**20
+DOWNLOAD_CHUNK_SIZE = 2**20
+
+# seconds to wait before retrying a failed request, doubled on each attempt
+RETRY_DELAY = 1
+
+# seconds to wait for a connection, and for each read of the response; a
+# stalled request raises and is retried
+TIMEOUT = (30, 300)
+
+# parameters a query can be split on, see split_params
+SPLIT_PARAMS = ['statecode', 'countycode', 'huc', 'date']
+
+# status column, and its values preferred by pivot_results(duplicates='accepted')
+STATUS_COL = 'ResultStatusIdentifier'
+PREFERRED_STATUS = ['Accepted', 'Final', 'Validated']
+
+# columns that identify a row of each profile when concatenating parts
+UNIQUE_KEYS = {'narrowResult': ['ActivityIdentifier', 'CharacteristicName',
+                                'ResultIdentifier'],
+               'Station': ['MonitoringLocationIdentifier']}
+
+
+def get_results(chunksize=None, usecols=None, split=None, window='365D',
+                max_workers=4, retries=2, **kwargs):
     """
     Parameters
     ----------
@@ -50,39 +83,610 @@ def get_results(**kwargs):
         One or more case-sensitive characteristic names, separated by semicolons.
         (See https://www.waterqualitydata.us/public_srsnames/ for available characteristic names)
 
-    mimeType : string (csv)
+    chunksize : int, optional
+        If given, return an iterator of DataFrames with this many rows each
+        instead of a single DataFrame.
+
+    usecols : list, optional
+        Columns to read; all other columns are skipped while parsing. May
+        include the derived datetime columns, e.g. ActivityStartDateTime.
+
+    split : string or list, optional
+        Split the query into parts that are requested concurrently:
+        'statecode', 'countycode', or 'huc' make one part per listed value;
+        'date' splits startDateLo to startDateHi into windows. A list
+        splits on each, e.g. ['statecode', 'date']. Results are combined
+        and de-duplicated on UNIQUE_KEYS, which are read even if usecols
+        leaves them out. Cannot be combined with chunksize.
+
+    window : string or Timedelta
+        Length of each date window when splitting on 'date'.
+
+    max_workers : int
+        Number of parts requested at once.
+
+    retries : int
+        Number of times a failed request (or part) is retried.
 
-    zip : string (yes or no)
+    Returns
+    -------
+    DataFrame, or iterator of DataFrames if chunksize is given.
+
+    Notes
+    -----
+    Results are requested zipped and streamed to a temporary file, which
+    stays in memory unless it grows beyond SPOOL_SIZE. The CSV is then
+    decompressed and parsed incrementally, so the uncompressed text is
+    never held in memory.
+
+    Columns are typed by the narrowResult schema in wqp_schema: codes such
+    as CharacteristicName and units are categorical, identifiers are
+    strings, ResultMeasureValue is float with non-numeric values set to
+    NaN, and ActivityStartDateTime is added as a UTC datetime.
     """
-    kwargs['zip'] = 'no'
+    kwargs['zip'] = 'yes'
     kwargs['mimeType'] = 'csv'
     kwargs['dataProfile']= 'narrowResult'
 
-    response = query(wqp_url('Result'), **kwargs)
-
-    df = pd.read_csv(StringIO(response), delimiter=',')
-    return df
+    return _get(wqp_url('Result'), 'narrowResult', chunksize, usecols, split,
+                window, max_workers, retries, **kwargs)
 
 
-def what_sites(**kwargs):
+def what_sites(chunksize=None, usecols=None, split=None, window='365D',
+               max_workers=4, retries=2, **kwargs):
     """ Search WQP for sites within a region with specific data.
 
     Parameters
     ----------
     same as get_results
     """
-    kwargs['zip'] = 'no'
+    kwargs['zip'] = 'yes'
     kwargs['mimeType'] = 'csv'
     kwargs['dataProfile']= 'narrowResult'
 
-    url = wqp_url('Station')
-    query_string = query(url, **kwargs)
+    return _get(wqp_url('Station'), 'Station', chunksize, usecols, split,
+                window, max_workers, retries, **kwargs)
+
+
+def _get(url, profile, chunksize, usecols, split, window, max_workers,
+         retries, **kwargs):
+    """Runs a query, split into concurrent parts if requested.
+    """
+    if not split:
+        return fetch(url, profile, chunksize=chunksize, usecols=usecols,
+                     retries=retries, **kwargs)
+
+    if chunksize is not None:
+        raise TypeError('chunksize cannot be combined with split')
+
+    parts = split_params(split, window=window, **kwargs)
+
+    # the whole key is read to de-duplicate on, and dropped afterwards
+    keys = UNIQUE_KEYS[profile]
+    added = [] if usecols is None else [key for key in keys if key not in usecols]
+    part_usecols = None if usecols is None else list(usecols) + added
+
+    def fetch_part(params):
+        return fetch(url, profile, usecols=part_usecols, retries=retries, **params)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        frames = list(executor.map(fetch_part, parts))
+
+    df = concat_frames(frames)
+
+    # part of the key would not tell distinct rows apart
+    if all(key in df for key in keys):
+        df = df.drop_duplicates(subset=keys).reset_index(drop=True)
+
+    return df.drop(columns=added)
+
+
+def fetch(url, profile, chunksize=None, usecols=None, retries=2, **kwargs):
+    """Downloads and reads one WQP query, retrying if the request fails.
+
+    Returns
+    -------
+    DataFrame, or iterator of DataFrames if chunksize is given.
+    """
+    for attempt in range(retries + 1):
+        try:
+            response = download(url, **kwargs)
+            return read_zipped_csv(response, chunksize=chunksize,
+                                   profile=profile, usecols=usecols)
+
+        except (requests.RequestException, zipfile.BadZipFile):
+            if attempt == retries:
+                raise
+
+            time.sleep(RETRY_DELAY * 2**attempt)
+
+
+def split_params(split, window='365D', **kwargs):
+    """Splits query parameters into parts that together cover the query.
+
+    Parameters
+    ----------
+    split : string or list
+        Parameter(s) to split on; see SPLIT_PARAMS.
+
+    window : string or Timedelta
+        Length of each date window for split='date'.
+
+    kwargs : query parameters
+
+    Returns
+    -------
+    list of dicts of query parameters, one per part.
+    """
+    split = [split] if isinstance(split, str) else list(split)
+    options = []
+
+    for param in split:
+        if param not in SPLIT_PARAMS:
+            raise TypeError('Cannot split on {}'.format(param))
+
+        if param == 'date':
+            options.append(_date_windows(kwargs.get('startDateLo'),
+                                         kwargs.get('startDateHi'), window))
+
+        elif param not in kwargs:
+            raise TypeError('Cannot split on {}, which is not in the query'
+                            .format(param))
+
+        else:
+            options.append([{param: value} for value in _split_list(kwargs[param])])
+
+    parts = []
+    for combination in itertools.product(*options):
+        params = dict(kwargs)
+        for option in combination:
+            params.update(option)
+        parts.append(params)
+
+    return parts
+
+
+def _split_list(value):
+    """Splits a list-like or semicolon delimited WQP parameter value.
+    """
+    if isinstance(value, str):
+        value = value.split(';')
+
+    return [str(item).strip() for item in value if str(item).strip()]
+
+
+def _date_windows(start, end, window):
+    """Splits startDateLo to startDateHi (MM-DD-YYYY) into consecutive
+    windows that do not overlap.
+    """
+    if start is None:
+        raise TypeError('Splitting on date requires startDateLo')
+
+    start = pd.to_datetime(start, format='%m-%d-%Y')
+    end = pd.to_datetime(end, format='%m-%d-%Y') if end else \
+          pd.Timestamp.today().normalize()
+    window = pd.Timedelta(window)
+
+    windows = []
+    while start <= end:
+        # startDateHi is inclusive
+        stop = min(start + window - pd.Timedelta('1D'), end)
+        windows.append({'startDateLo': start.strftime('%m-%d-%Y'),
+                        'startDateHi': stop.strftime('%m-%d-%Y')})
+        start = stop + pd.Timedelta('1D')
+
+    return windows
+
+
+def concat_frames(frames):
+    """Concatenates frames, keeping categorical columns categorical by
+    taking the union of their categories.
+    """
+    frames = [frame for frame in frames if len(frame.columns)]
+
+    if not frames:
+        return pd.DataFrame()
+
+    for column in frames[0].columns:
+        if frames[0][column].dtype.name != 'category':
+            continue
+
+        categories = pd.Index([])
+        for frame in frames:
+            if column in frame and frame[column].dtype.name == 'category':
+                categories = categories.union(frame[column].cat.categories)
+
+        for frame in frames:
+            if column in frame:
+                frame[column] = frame[column].astype(
+                    pd.CategoricalDtype(categories))
+
+    return pd.concat(frames, ignore_index=True)
+
+
+def download(url, **kwargs):
+    """Streams a WQP response into a temporary file.
+
+    Parameters
+    ----------
+    url : string
+
+    kwargs : query parameters; list-like values are joined with commas.
+
+    Returns
+    -------
+    SpooledTemporaryFile positioned at the start of the response body.
+    """
+    payload = {key: to_str(value) for key, value in kwargs.items()}
+
+    req = requests.get(url, params=payload, stream=True, timeout=TIMEOUT)
+    req.raise_for_status()
+
+    spool = SpooledTemporaryFile(max_size=SPOOL_SIZE)
+
+    with req:
+        for chunk in req.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+            spool.write(chunk)
+
+    spool.seek(0)
+    return spool
+
+
+def read_zipped_csv(fileobj, chunksize=None, profile=None, usecols=None,
+                    **kwargs):
+    """Reads the CSV inside a zipped WQP response.
+
+    The member is decompressed as it is parsed, and fileobj is closed once
+    it has been read.
+
+    Parameters
+    ----------
+    fileobj : file-like object
+        Zip archive containing a single CSV file.
+
+    chunksize : int, optional
+        If given, return an iterator of DataFrames with this many rows.
+
+    profile : string, optional
+        WQP data profile ('narrowResult' or 'Station') whose schema is used
+        to type the columns. See wqp_schema.
+
+    usecols : list, optional
+        Columns to read.
+
+    kwargs : passed to pandas.read_csv
+
+    Returns
+    -------
+    DataFrame, or iterator of DataFrames if chunksize is given.
+    """
+    schema = PROFILES[profile] if profile else {}
+    requested = usecols
+    usecols, derived = _expand_usecols(usecols)
+
+    kwargs['dtype'] = _read_dtypes(schema, usecols)
+    kwargs['usecols'] = usecols
+
+    archive = zipfile.ZipFile(fileobj)
+    member = archive.open(archive.namelist()[0])
 
-    df = pd.read_csv(StringIO(query_string), delimiter=',')
+    if chunksize is None:
+        with fileobj, archive, member:
+            df = pd.read_csv(member, delimiter=',', **kwargs)
+            return _select(apply_schema(df, schema, derived), requested)
+
+    return _iter_chunks(fileobj, archive, member, chunksize, schema, derived,
+                        requested, **kwargs)
+
+
+def apply_schema(df, schema, datetimes=None):
+    """Converts columns read as strings to the types in schema.
+
+    Parameters
+    ----------
+    df : DataFrame
+        Read with the dtypes from _read_dtypes.
+
+    schema : dict
+        A profile from wqp_schema.PROFILES.
+
+    datetimes : list, optional
+        Derived datetime columns to add (see wqp_schema.DATETIMES). By
+        default all whose source columns are present.
+
+    Returns
+    -------
+    DataFrame
+    """
+    if datetimes is None:
+        datetimes = [name for name, columns in DATETIMES.items()
+                     if all(column in df for column in columns)]
+
+    for name in datetimes:
+        date, time, tz_code = DATETIMES[name]
+        df[name] = _utc_datetime(df[date], df[time], df[tz_code])
+
+    for column, kind in schema.items():
+        if column not in df:
+            continue
+
+        if kind == FLOAT:
+            df[column] = pd.to_numeric(df[column], errors='coerce')
+
+        elif kind == DATE:
+            df[column] = pd.to_datetime(df[column], format='%Y-%m-%d',
+                                        errors='coerce')
 
     return df
 
 
+def _read_dtypes(schema, usecols=None):
+    """dtypes for pandas.read_csv; floats and dates are read as strings and
+    converted by apply_schema.
+    """
+    dtypes = {}
+
+    for column, kind in schema.items():
+        if usecols is not None and column not in usecols:
+            continue
+
+        dtypes[column] = 'category' if kind == CATEGORY else str
+
+    return dtypes
+
+
+def _expand_usecols(usecols):
+    """Replaces derived datetime columns in usecols with their sources.
+
+    Returns
+    -------
+    usecols : list or None
+    derived : list of derived datetime columns requested, or None for all
+    """
+    if usecols is None:
+        return None, None
+
+    derived = [column for column in usecols if column in DATETIMES]
+    expanded = [column for column in usecols if column not in DATETIMES]
+
+    for name in derived:
+        expanded += [column for column in DATETIMES[name]
+                     if column not in expanded]
+
+    return expanded, derived
+
+
+def _utc_datetime(date, time, tz_code):
+    """Combines WQP date, time, and time zone code columns into UTC
+    datetimes. Rows without a time or a known time zone are NaT.
+    """
+    offsets = {code: pd.Timedelta(hours=int(offset[:3]),
+                                  minutes=int(offset[0] + offset[3:]))
+               for code, offset in tz.items()}
+
+    local = pd.to_datetime(date, format='%Y-%m-%d', errors='coerce') + \
+            _map_unique(time, lambda x: pd.to_timedelta(x, errors='coerce'))
+    offset = _map_unique(tz_code, lambda x: pd.to_timedelta(pd.Series(x).map(offsets)))
+
+    return (local - offset).dt.tz_localize('UTC')
+
+
+def _map_unique(values, parser):
+    """Applies parser to the unique values only; times and time zone codes
+    repeat heavily.
+
+    Returns
+    -------
+    timedelta64 array, NaT where values are missing
+    """
+    codes, uniques = pd.factorize(pd.Series(values).astype(object))
+    parsed = np.asarray(parser(np.asarray(uniques)), dtype='timedelta64[ns]')
+
+    # code -1 (missing) selects the trailing NaT
+    return np.append(parsed, np.timedelta64('NaT'))[codes]
+
+
+def _select(df, usecols):
+    """Returns the columns of df in usecols order, dropping the sources of
+    derived datetime columns unless they were requested.
+    """
+    if usecols is None:
+        return df
+
+    return df[list(usecols)]
+
+
+def _iter_chunks(fileobj, archive, member, chunksize, schema, derived,
+                 requested, **kwargs):
+    """Yields chunks of a zipped CSV, closing the archive when done.
+    """
+    with fileobj, archive, member:
+        for chunk in pd.read_csv(member, delimiter=',', chunksize=chunksize,
+                                 **kwargs):
+            yield _select(apply_schema(chunk, schema, derived), requested)
+
+
+def pivot_results(df, index='ActivityIdentifier', columns='CharacteristicName',
+                  values='ResultMeasureValue', duplicates='first',
+                  units='ResultMeasure/MeasureUnitCode', sparse=False):
+    """Pivots narrowResult rows into a sample x characteristic table.
+
+    Rows and columns are encoded as integer codes and values are scattered
+    straight into a NumPy array, resolving duplicate results for a cell on
+    the codes rather than with a groupby.
+
+    Parameters
+    ----------
+    df : DataFrame
+        Results as returned by get_results.
+
+    index : string or list
+        Column(s) identifying a sample.
+
+    columns : string or list
+        Column(s) identifying a characteristic, e.g.
+        ['CharacteristicName', 'ResultSampleFractionText'].
+
+    values : string
+        Column of result values. Missing values are ignored.
+
+    duplicates : string
+        How to resolve more than one result for a cell:
+        'first' or 'last' in row order, 'mean', or 'accepted', which takes
+        the first result whose ResultStatusIdentifier is in
+        PREFERRED_STATUS, otherwise the first result.
+
+    units : string, optional
+        Column of units. The most common unit of each output column is
+        stored in the result's attrs['units'].
+
+    sparse : boolean, default False
+        Return a DataFrame of sparse columns. Requires scipy.
+
+    Returns
+    -------
+    DataFrame indexed by index with one column per characteristic.
+    """
+    if duplicates not in ('first', 'last', 'mean', 'accepted'):
+        raise ValueError('Unrecognized duplicates: {}'.format(duplicates))
+
+    if duplicates == 'accepted' and STATUS_COL not in df:
+        raise ValueError("duplicates='accepted' needs a {} column"
+                         .format(STATUS_COL))
+
+    df = df[df[values].notnull()]
+
+    row_codes, row_labels = _codes(df, index)
+    col_codes, col_labels = _codes(df, columns)
+    data = df[values].values.astype('float64')
+
+    if duplicates == 'accepted':
+        preferred = df[STATUS_COL].isin(PREFERRED_STATUS).values
+
+    # column-major cell keys, so the array becomes DataFrame blocks uncopied
+    n_rows = len(row_labels)
+    cell = col_codes.astype('int64') * n_rows + row_codes
+
+    if sparse:
+        try:
+            from scipy.sparse import coo_matrix
+        except ImportError:
+            raise ImportError('pivot_results(sparse=True) requires scipy')
+
+        if duplicates == 'accepted':
+            order = np.lexsort((~preferred, cell))
+        else:
+            order = np.argsort(cell, kind='mergesort')
+
+        cell = cell[order]
+        data = data[order]
+        starts = np.flatnonzero(np.concatenate([[True], cell[1:] != cell[:-1]]))
+
+        if duplicates == 'mean':
+            data = np.add.reduceat(data, starts) / np.diff(np.append(starts, len(cell)))
+        elif duplicates == 'last':
+            data = data[np.append(starts[1:], len(cell)) - 1]
+        else:
+            data = data[starts]
+
+        cell = cell[starts]
+        matrix = coo_matrix((data, (cell % n_rows, cell // n_rows)),
+                            shape=(n_rows, len(col_labels)))
+        out = pd.DataFrame.sparse.from_spmatrix(matrix, index=row_labels,
+                                                columns=col_labels)
+
+    else:
+        size = n_rows * len(col_labels)
+
+        if duplicates == 'mean':
+            with np.errstate(invalid='ignore'):
+                matrix = (np.bincount(cell, weights=data, minlength=size)
+                          / np.bincount(cell, minlength=size))
+
+        else:
+            # the order in which repeated indices are assigned is unspecified,
+            # so one row is chosen for each cell
+            matrix = np.full(size, np.nan)
+            if duplicates == 'last':
+                cells, rows = np.unique(cell[::-1], return_index=True)
+                rows = len(cell) - 1 - rows
+            else:
+                cells, rows = np.unique(cell, return_index=True)
+            matrix[cells] = data[rows]
+
+            if duplicates == 'accepted':
+                cells, rows = np.unique(cell[preferred], return_index=True)
+                matrix[cells] = data[preferred][rows]
+
+        matrix = matrix.reshape(len(col_labels), n_rows).T
+        out = pd.DataFrame(matrix, index=row_labels, columns=col_labels,
+                           copy=False)
+
+    if units is not None and units in df:
+        out.attrs['units'] = _common_units(col_codes, df[units], col_labels)
+
+    return out
+
+
+def _codes(df, keys):
+    """Integer codes for the distinct values of one or more columns.
+
+    Returns
+    -------
+    codes : array
+    labels : Index (or MultiIndex for several keys) of the distinct values
+    """
+    if isinstance(keys, str):
+        codes, uniques = pd.factorize(df[keys], sort=True)
+        labels = pd.Index(uniques, name=keys)
+
+        # missing values get their own code after the last value, as below;
+        # a code of -1 would address another cell
+        missing = codes < 0
+        if missing.any():
+            codes = np.where(missing, len(uniques), codes)
+            labels = labels.append(pd.Index([np.nan], name=keys))
+
+        return codes, labels
+
+    combined = np.zeros(len(df), dtype='int64')
+    levels = []
+
+    for key in keys:
+        codes, uniques = pd.factorize(df[key], sort=True)
+        # missing values get their own code after the last value
+        codes = np.where(codes < 0, len(uniques), codes)
+        combined = combined * (len(uniques) + 1) + codes
+        levels.append(pd.Index(uniques).append(pd.Index([np.nan])))
+
+    codes, groups = pd.factorize(combined, sort=True)
+
+    labels = []
+    for level in reversed(levels):
+        labels.insert(0, level.take(groups % len(level)))
+        groups = groups // len(level)
+
+    return codes, pd.MultiIndex.from_arrays(labels, names=list(keys))
+
+
+def _common_units(col_codes, units, col_labels):
+    """Most common unit of each column, as a dict of column label to unit.
+    """
+    unit_codes, unit_labels = pd.factorize(units)
+    valid = unit_codes >= 0
+
+    counts = np.bincount(col_codes[valid] * len(unit_labels) + unit_codes[valid],
+                         minlength=len(col_labels) * len(unit_labels))
+    counts = counts.reshape(len(col_labels), len(unit_labels))
+
+    common = {}
+    for i, label in enumerate(col_labels):
+        if len(unit_labels) and counts[i].max() > 0:
+            common[label] = unit_labels[counts[i].argmax()]
+
+    return common
+
+
 def wqp_url(service):
     base_url = 'https://waterqualitydata.us/'
     return '{}{}/Search?'.format(base_url, service)
@@ -0,0 +1,150 @@
+"""
+Column types for Water Quality Portal data profiles.
+
+Each profile maps a CSV column to one of:
+    string   : identifiers and free text, kept as str
+    category : low-cardinality codes such as characteristic names and units
+    float    : measurements; non-numeric values (e.g. '<0.5') become NaN
+    date     : ISO 8601 dates
+
+Columns missing from a profile are left to pandas to infer.
+
+See https://www.waterqualitydata.us/portal_userguide/ for column definitions.
+"""
+STRING = 'string'
+CATEGORY = 'category'
+FLOAT = 'float'
+DATE = 'date'
+
+NARROW_RESULT = {
+    'OrganizationIdentifier': CATEGORY,
+    'OrganizationFormalName': CATEGORY,
+    'ActivityIdentifier': STRING,
+    'ActivityStartDate': DATE,
+    'ActivityStartTime/Time': STRING,
+    'ActivityStartTime/TimeZoneCode': CATEGORY,
+    'MonitoringLocationIdentifier': STRING,
+    'ResultIdentifier': STRING,
+    'DataLoggerLine': STRING,
+    'ResultDetectionConditionText': CATEGORY,
+    'MethodSpecificationName': CATEGORY,
+    'CharacteristicName': CATEGORY,
+    'ResultSampleFractionText': CATEGORY,
+    'ResultMeasureValue': FLOAT,
+    'ResultMeasure/MeasureUnitCode': CATEGORY,
+    'MeasureQualifierCode': CATEGORY,
+    'ResultStatusIdentifier': CATEGORY,
+    'StatisticalBaseCode': CATEGORY,
+    'ResultValueTypeName': CATEGORY,
+    'ResultWeightBasisText': CATEGORY,
+    'ResultTimeBasisText': CATEGORY,
+    'ResultTemperatureBasisText': CATEGORY,
+    'ResultParticleSizeBasisText': CATEGORY,
+    'PrecisionValue': STRING,
+    'DataQuality/BiasValue': STRING,
+    'ConfidenceIntervalValue': STRING,
+    'UpperConfidenceLimitValue': STRING,
+    'LowerConfidenceLimitValue': STRING,
+    'ResultCommentText': STRING,
+    'USGSPCode': CATEGORY,
+    'ResultDepthHeightMeasure/MeasureValue': FLOAT,
+    'ResultDepthHeightMeasure/MeasureUnitCode': CATEGORY,
+    'ResultDepthAltitudeReferencePointText': CATEGORY,
+    'ResultSamplingPointName': STRING,
+    'BiologicalIntentName': CATEGORY,
+    'BiologicalIndividualIdentifier': STRING,
+    'SubjectTaxonomicName': CATEGORY,
+    'UnidentifiedSpeciesIdentifier': STRING,
+    'SampleTissueAnatomyName': CATEGORY,
+    'GroupSummaryCountWeight/MeasureValue': FLOAT,
+    'GroupSummaryCountWeight/MeasureUnitCode': CATEGORY,
+    'CellFormName': CATEGORY,
+    'CellShapeName': CATEGORY,
+    'HabitName': CATEGORY,
+    'VoltismName': CATEGORY,
+    'TaxonomicPollutionTolerance': STRING,
+    'TaxonomicPollutionToleranceScaleText': STRING,
+    'TrophicLevelName': CATEGORY,
+    'FunctionalFeedingGroupName': CATEGORY,
+    'TaxonomicDetailsCitation/ResourceTitleName': STRING,
+    'TaxonomicDetailsCitation/ResourceCreatorName': STRING,
+    'TaxonomicDetailsCitation/ResourceSubjectText': STRING,
+    'TaxonomicDetailsCitation/ResourcePublisherName': STRING,
+    'TaxonomicDetailsCitation/ResourceDate': STRING,
+    'TaxonomicDetailsCitation/ResourceIdentifier': STRING,
+    'FrequencyClassInformationUrl': STRING,
+    'ResultAnalyticalMethod/MethodIdentifier': CATEGORY,
+    'ResultAnalyticalMethod/MethodIdentifierContext': CATEGORY,
+    'ResultAnalyticalMethod/MethodName': CATEGORY,
+    'ResultAnalyticalMethod/MethodUrl': STRING,
+    'ResultAnalyticalMethod/MethodQualifierTypeName': CATEGORY,
+    'MethodDescriptionText': STRING,
+    'LaboratoryName': CATEGORY,
+    'AnalysisStartDate': DATE,
+    'AnalysisStartTime/Time': STRING,
+    'AnalysisStartTime/TimeZoneCode': CATEGORY,
+    'AnalysisEndDate': DATE,
+    'AnalysisEndTime/Time': STRING,
+    'AnalysisEndTime/TimeZoneCode': CATEGORY,
+    'ResultLaboratoryCommentCode': CATEGORY,
+    'ResultLaboratoryCommentText': STRING,
+    'ResultDetectionQuantitationLimitUrl': STRING,
+    'LaboratoryAccreditationIndicator': CATEGORY,
+    'LaboratoryAccreditationAuthorityName': CATEGORY,
+    'TaxonomistAccreditationIndicator': CATEGORY,
+    'TaxonomistAccreditationAuthorityName': CATEGORY,
+    'LabSamplePreparationUrl': STRING,
+    'ProviderName': CATEGORY,
+}
+
+STATION = {
+    'OrganizationIdentifier': CATEGORY,
+    'OrganizationFormalName': CATEGORY,
+    'MonitoringLocationIdentifier': STRING,
+    'MonitoringLocationName': STRING,
+    'MonitoringLocationTypeName': CATEGORY,
+    'MonitoringLocationDescriptionText': STRING,
+    'HUCEightDigitCode': STRING,
+    'DrainageAreaMeasure/MeasureValue': FLOAT,
+    'DrainageAreaMeasure/MeasureUnitCode': CATEGORY,
+    'ContributingDrainageAreaMeasure/MeasureValue': FLOAT,
+    'ContributingDrainageAreaMeasure/MeasureUnitCode': CATEGORY,
+    'LatitudeMeasure': FLOAT,
+    'LongitudeMeasure': FLOAT,
+    'SourceMapScaleNumeric': FLOAT,
+    'HorizontalAccuracyMeasure/MeasureValue': FLOAT,
+    'HorizontalAccuracyMeasure/MeasureUnitCode': CATEGORY,
+    'HorizontalCollectionMethodName': CATEGORY,
+    'HorizontalCoordinateReferenceSystemDatumName': CATEGORY,
+    'VerticalMeasure/MeasureValue': FLOAT,
+    'VerticalMeasure/MeasureUnitCode': CATEGORY,
+    'VerticalAccuracyMeasure/MeasureValue': FLOAT,
+    'VerticalAccuracyMeasure/MeasureUnitCode': CATEGORY,
+    'VerticalCollectionMethodName': CATEGORY,
+    'VerticalCoordinateReferenceSystemDatumName': CATEGORY,
+    'CountryCode': CATEGORY,
+    'StateCode': CATEGORY,
+    'CountyCode': CATEGORY,
+    'AquiferName': CATEGORY,
+    'FormationTypeText': CATEGORY,
+    'AquiferTypeName': CATEGORY,
+    'ConstructionDateText': STRING,
+    'WellDepthMeasure/MeasureValue': FLOAT,
+    'WellDepthMeasure/MeasureUnitCode': CATEGORY,
+    'WellHoleDepthMeasure/MeasureValue': FLOAT,
+    'WellHoleDepthMeasure/MeasureUnitCode': CATEGORY,
+    'ProviderName': CATEGORY,
+}
+
+PROFILES = {'narrowResult': NARROW_RESULT,
+            'Station': STATION}
+
+# datetime columns built from (date, time, time zone) columns, in UTC
+DATETIMES = {
+    'ActivityStartDateTime': ('ActivityStartDate', 'ActivityStartTime/Time',
+                              'ActivityStartTime/TimeZoneCode'),
+    'AnalysisStartDateTime': ('AnalysisStartDate', 'AnalysisStartTime/Time',
+                              'AnalysisStartTime/TimeZoneCode'),
+    'AnalysisEndDateTime': ('AnalysisEndDate', 'AnalysisEndTime/Time',
+                            'AnalysisEndTime/TimeZoneCode'),
+}
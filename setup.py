@@ -7,5 +7,8 @@ setup(name='data_retrieval',
       author='Timothy Hodson',
       author_email='thodson@usgs.gov',
       license='MIT',
-      packages=['data_retrieval'],
+      packages=['data_retrieval', 'data_retrieval.codes'],
+      entry_points={
+          'console_scripts': ['data-retrieval=data_retrieval.cli:main'],
+      },
       zip_safe=False)
@@ -0,0 +1,103 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from data_retrieval.aggregate import aggregate
+
+SITENO_COL = 'site_no'
+DATETIME_COL = 'datetime'
+
+
+@pytest.fixture
+def iv():
+    """Two days of 15-minute values at two sites, formatted like get_iv.
+    """
+    rng = np.random.RandomState(0)
+    times = pd.date_range('2018-01-24', periods=2 * 96, freq='15min')
+    frames = []
+
+    for site in ['03339000', '05447500']:
+        frames.append(pd.DataFrame({SITENO_COL: site,
+                                    DATETIME_COL: times,
+                                    '00060': rng.gamma(2, 50, len(times)),
+                                    '00060_cd': 'A'}))
+
+    df = pd.concat(frames).set_index([SITENO_COL, DATETIME_COL]).sort_index()
+    return df
+
+
+def test_hourly_matches_resample(iv):
+    df = aggregate(iv, freq='1h', stats=['mean', 'min', 'max', 'count'])
+
+    expected = (iv.reset_index(level=SITENO_COL)
+                  .groupby(SITENO_COL)['00060']
+                  .resample('1h').agg(['mean', 'min', 'max', 'count']))
+
+    assert df.index.equals(expected.index)
+    for stat in ['mean', 'min', 'max', 'count']:
+        np.testing.assert_allclose(df['00060_' + stat], expected[stat])
+
+
+def test_daily_completeness(iv):
+    iv.iloc[:20, 0] = np.nan
+
+    df = aggregate(iv, freq='1D', completeness=0.9)
+
+    assert np.isnan(df['00060_mean'].iloc[0])
+    assert df['00060_mean'].notnull().sum() == 3
+
+
+def test_qualifiers_carried_forward(iv):
+    iv.iloc[5, 1] = 'P, e'
+
+    df = aggregate(iv, freq='1h')
+
+    assert df['00060_mean_cd'].iloc[1] == 'P, e'
+    assert df['00060_mean_cd'].iloc[0] == 'A'
+
+
+def test_dv_columns(iv):
+    df = aggregate(iv, freq='1D', dv_columns=True)
+
+    assert df.columns.tolist() == ['00060_Mean', '00060_Mean_cd',
+                                   '00060_Minimum', '00060_Minimum_cd',
+                                   '00060_Maximum', '00060_Maximum_cd']
+
+
+def test_time_zone_of_read_json(iv_series):
+    """Hourly aggregates of a response with two sites and two parameters
+    keep the time zone of the service.
+    """
+    from data_retrieval.nwis import read_json
+
+    times = ['00:00', '00:15', '00:30', '00:45', '01:00']
+    json = {'value': {'timeSeries': [
+        iv_series(site, code, zip(times, range(5)))
+        for site in ['03339000', '05447500'] for code in ['00060', '00065']]}}
+
+    df = aggregate(read_json(json), freq='1h')
+
+    datetimes = df.index.get_level_values(DATETIME_COL)
+    assert str(datetimes.tz) == 'UTC-06:00'
+    assert datetimes[:2].tolist() == list(pd.to_datetime(
+        ['2018-01-24T00:00-06:00', '2018-01-24T01:00-06:00']))
+    assert df['00060_mean'].tolist() == [1.5, 4.0, 1.5, 4.0]
+    assert df['00065_mean'].tolist() == [1.5, 4.0, 1.5, 4.0]
+
+
+def test_empty_and_missing_times(iv):
+    empty = aggregate(iv.iloc[:0], freq='1h')
+
+    assert empty.empty
+    assert '00060_mean' in empty and '00060_max_cd' in empty
+
+    # a value without a time is left out
+    times = iv.index.get_level_values(DATETIME_COL).values.copy()
+    times[[0, 5]] = np.datetime64('NaT')
+    missing = iv.set_axis(pd.MultiIndex.from_arrays(
+        [iv.index.get_level_values(SITENO_COL), times],
+        names=[SITENO_COL, DATETIME_COL]))
+
+    df = aggregate(missing, freq='1D', stats=['count'])
+
+    assert df['00060_count'].tolist() == [94, 96, 96, 96]
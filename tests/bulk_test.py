@@ -0,0 +1,130 @@
+import json
+import os
+
+import pandas as pd
+import pytest
+import requests
+
+from data_retrieval import bulk, cli
+
+MANIFEST = {'jobs': [
+    {'service': 'dv', 'sites': ['03339000', '03339500', '05531500'],
+     'start': '2016-01-01', 'end': '2017-12-31', 'window': '366D',
+     'batch_size': 2, 'parameterCd': '00060'},
+    {'service': 'wqp', 'sites': ['USGS-03339000'], 'start': '2017-01-01',
+     'end': '2017-12-31', 'characteristicName': 'Nitrate'}]}
+
+
+@pytest.fixture
+def services(monkeypatch):
+    """Stands in for nwis.get_record and wqp.get_results, failing for site
+    05531500 until fail is cleared.
+    """
+    calls = []
+    fail = {'05531500'}
+
+    def get_record(sites, start, end, service, **kwargs):
+        calls.append((service, sites, start, end, kwargs))
+        if fail & set(sites):
+            raise IOError('timed out')
+
+        index = pd.MultiIndex.from_product(
+            [sites, pd.date_range(start, end, freq='D')],
+            names=['site_no', 'datetime'])
+        return pd.DataFrame({'00060_Mean': 1.0}, index=index)
+
+    def get_results(**kwargs):
+        calls.append(('wqp', kwargs))
+        return pd.DataFrame({'MonitoringLocationIdentifier': [kwargs['siteid']],
+                             'ResultMeasureValue': [1.2]})
+
+    monkeypatch.setattr(bulk.nwis, 'get_record', get_record)
+    monkeypatch.setattr(bulk.wqp, 'get_results', get_results)
+    return calls, fail
+
+
+def test_expand():
+    units = bulk.expand(MANIFEST)
+
+    # two windows of two batches, then one wqp unit
+    assert len(units) == 5
+    assert [unit['sites'] for unit in units[:2]] == [['03339000', '03339500'],
+                                                     ['05531500']]
+    assert (units[0]['start'], units[0]['end']) == ('2016-01-01', '2016-12-31')
+    assert units[2]['start'] == '2017-01-01'
+    assert units[0]['params'] == {'parameterCd': '00060'}
+
+    with pytest.raises(TypeError):
+        bulk.expand({'jobs': [{'service': 'daily', 'sites': ['03339000']}]})
+
+
+def test_run_resumes(services, tmpdir):
+    calls, fail = services
+    output = str(tmpdir)
+
+    summary = bulk.run(MANIFEST, output, format='csv', log=None)
+
+    assert (summary['done'], summary['failed']) == (3, 2)
+    assert summary['rows'] == 2 * 366 + 2 * 365 + 1
+    assert ('wqp', {'characteristicName': 'Nitrate', 'siteid': 'USGS-03339000',
+                    'startDateLo': '01-01-2017',
+                    'startDateHi': '12-31-2017'}) in calls
+
+    part = os.path.join(output, 'service=dv', 'year=2016')
+    df = pd.read_csv(os.path.join(part, os.listdir(part)[0]), dtype={'site_no': str})
+    assert list(df.columns) == ['site_no', 'datetime', '00060_Mean']
+
+    # only the failed units are requested again
+    fail.clear()
+    calls.clear()
+    summary = bulk.run(MANIFEST, output, format='csv', log=None)
+
+    assert (summary['skipped'], summary['done'], summary['failed']) == (3, 2, 0)
+    assert [call[1] for call in calls] == [['05531500'], ['05531500']]
+    assert 'already complete' in bulk.format_summary(summary)
+
+
+def test_rejected_units_fail(tmpdir, monkeypatch):
+    """A rejected request (400) fails its unit; a 404 completes it without
+    data.
+    """
+    manifest = {'jobs': [{'service': 'dv', 'sites': ['03339000', '05531500'],
+                          'start': '2016-01-01', 'end': '2016-01-31',
+                          'batch_size': 1}]}
+    statuses = {'03339000': 404, '05531500': 400}
+
+    def get(url, params=None, **kwargs):
+        r = requests.models.Response()
+        r.status_code = statuses[params['sites']]
+        r.url = url
+        r._content = b''
+        return r
+
+    monkeypatch.setattr(requests, 'get', get)
+    output = str(tmpdir)
+    summary = bulk.run(manifest, output, format='csv', log=None)
+
+    assert (summary['done'], summary['empty'], summary['failed']) == (0, 1, 1)
+    assert '0 downloaded, 1 without data' in bulk.format_summary(summary)
+    assert not os.path.exists(os.path.join(output, 'service=dv'))
+
+    # only the rejected unit is requested again
+    statuses['05531500'] = 404
+    summary = bulk.run(manifest, output, format='csv', log=None)
+
+    assert (summary['skipped'], summary['empty'], summary['failed']) == (1, 1, 0)
+
+
+def test_command_line(services, tmpdir, capsys):
+    services[1].clear()
+    manifest = str(tmpdir.join('manifest.json'))
+    with open(manifest, 'w') as f:
+        json.dump(MANIFEST, f)
+
+    code = cli.main(['bulk', manifest, '--output', str(tmpdir.join('out')),
+                     '--format', 'csv'])
+
+    captured = capsys.readouterr()
+    assert code == 0
+    assert '5 units: 5 downloaded' in captured.out
+    assert '[5/5]' in captured.err
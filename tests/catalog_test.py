@@ -0,0 +1,106 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from data_retrieval import catalog
+from data_retrieval.catalog import SiteCatalog
+
+
+@pytest.fixture
+def sites():
+    """Sites scattered over Illinois and Indiana, as read by read_rdb, where
+    huc_cd is parsed as a number.
+    """
+    rng = np.random.RandomState(0)
+    n = 2000
+    return pd.DataFrame({'agency_cd': 'USGS',
+                         'site_no': ['0{}'.format(5000000 + i) for i in range(n)],
+                         'dec_lat_va': rng.uniform(37, 42.5, n),
+                         'dec_long_va': rng.uniform(-91.5, -84.8, n),
+                         'huc_cd': rng.choice([7120001, 7120004, 5120111], n)})
+
+
+@pytest.fixture
+def series(sites):
+    return pd.DataFrame({'site_no': np.repeat(sites['site_no'].values[:300], 2),
+                         'parm_cd': ['00060', '00065'] * 300,
+                         'data_type_cd': ['dv', 'uv'] * 300})
+
+
+def brute_force(sites, lat, lon):
+    return catalog._haversine(lat, lon, sites['dec_lat_va'].values,
+                              sites['dec_long_va'].values)
+
+
+def test_nearest(sites, series):
+    cat = SiteCatalog(sites, series)
+    distance = brute_force(sites, 40.1, -88.2)
+
+    result = cat.nearest(40.1, -88.2, k=10)
+    assert result['site_no'].tolist() == \
+        sites['site_no'].values[np.argsort(distance)[:10]].tolist()
+
+    result = cat.nearest(40.1, -88.2, k=3, parameterCd='00060')
+    expected = np.argsort(np.where(np.arange(len(sites)) < 300, distance, np.inf))
+    assert result['site_no'].tolist() == sites['site_no'].values[expected[:3]].tolist()
+
+
+def test_within(sites):
+    cat = SiteCatalog(sites)
+    distance = brute_force(sites, 41.88, -87.63)
+
+    result = cat.within(41.88, -87.63, radius_km=50)
+
+    assert sorted(result['site_no']) == sorted(sites['site_no'][distance <= 50])
+    assert result['distance_km'].is_monotonic_increasing
+
+
+def test_bbox_and_huc(sites, series):
+    cat = SiteCatalog(sites, series)
+
+    result = cat.bbox(-89, 39, -88, 40)
+    inside = sites['dec_long_va'].between(-89, -88) & sites['dec_lat_va'].between(39, 40)
+    assert result['site_no'].tolist() == sites['site_no'][inside].tolist()
+
+    # leading zeros are restored
+    assert len(cat.huc('0712')) == (sites['huc_cd'] != 5120111).sum()
+    assert cat.get('05000000')['huc_cd'].startswith('0')
+
+    result = cat.huc('0512', parameterCd='00065', data_type='uv')
+    expected = sites['site_no'][:300][sites['huc_cd'][:300] == 5120111]
+    assert result['site_no'].tolist() == expected.tolist()
+
+
+def test_save_load(sites, series, tmpdir):
+    cat = SiteCatalog(sites, series, modified='2018-01-24T00:00:00+00:00',
+                      query={'stateCd': 'il'})
+    cat.save(str(tmpdir))
+
+    loaded = SiteCatalog.load(str(tmpdir))
+
+    assert loaded.query == {'stateCd': 'il'}
+    pd.testing.assert_frame_equal(loaded.sites, cat.sites, check_dtype=False)
+    assert loaded.parameter('00060')['site_no'].tolist() == \
+        cat.parameter('00060')['site_no'].tolist()
+
+
+def test_refresh(sites, monkeypatch):
+    cat = SiteCatalog(sites, modified='2018-01-24T00:00:00+00:00',
+                      query={'stateCd': 'il'})
+    requests = []
+
+    def get_info(**kwargs):
+        requests.append(kwargs)
+        return pd.DataFrame({'site_no': ['05000000', '05999999'],
+                             'dec_lat_va': [38.5, 41.0],
+                             'dec_long_va': [-90.2, -87.5],
+                             'huc_cd': ['07140101', '07120004']})
+
+    monkeypatch.setattr(catalog.nwis, 'get_info', get_info)
+
+    assert cat.refresh() == 2
+    assert requests[0]['stateCd'] == 'il'
+    assert requests[0]['modifiedSince'].startswith('PT')
+    assert len(cat) == len(sites) + 1
+    assert cat.get('05000000')['huc_cd'] == '07140101'
+    assert cat.nearest(41.0, -87.5)['site_no'].tolist() == ['05999999']
@@ -0,0 +1,22 @@
+import pytest
+
+
+@pytest.fixture
+def iv_series():
+    """Builds one time series of an iv service json response from
+    (time, value) pairs on 2018-01-24, in UTC-06:00.
+    """
+    def series(site, code, values, unit=None, statistic=None):
+        variable = {'variableCode': [{'value': code}],
+                    'options': {'option': [{'value': statistic} if statistic else {}]}}
+        if unit is not None:
+            variable['unit'] = {'unitCode': unit}
+
+        return {'sourceInfo': {'siteCode': [{'value': site}]},
+                'variable': variable,
+                'values': [{'method': [{'methodDescription': ''}],
+                            'value': [{'value': str(value), 'qualifiers': ['P'],
+                                       'dateTime': '2018-01-24T{}:00.000-06:00'.format(time)}
+                                      for time, value in values]}]}
+
+    return series
@@ -0,0 +1,72 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from data_retrieval import crosswalk
+
+
+def test_crosswalk():
+    sites = pd.DataFrame({'agency_cd': ['USGS', 'USGS', 'USCE'],
+                          'site_no': ['03339000', '03339000', '05531500']})
+
+    table = crosswalk.crosswalk(sites)
+    assert table['MonitoringLocationIdentifier'].tolist() == \
+        ['USGS-03339000', 'USCE-05531500']
+
+    table = crosswalk.crosswalk(['03339000', 'USCE:05531500'])
+    assert table['MonitoringLocationIdentifier'].tolist() == \
+        ['USGS-03339000', 'USCE-05531500']
+
+
+def test_siteid_batches():
+    siteids = ['USGS-{:08d}'.format(i) for i in range(1000)]
+
+    batches = crosswalk.siteid_batches(siteids, max_length=1000)
+
+    lengths = [len(';'.join(batch).replace(';', '%3B')) for batch in batches]
+    assert max(lengths) <= 1000
+    # fewest batches: each holds floor((1000 + 3) / (13 + 3)) ids
+    assert len(batches) == int(np.ceil(1000 / 62))
+    assert sorted(sum(batches, [])) == siteids
+
+
+def test_get_results_and_join_iv(monkeypatch):
+    requests = []
+
+    def get_results(siteid, **kwargs):
+        requests.append(siteid)
+        ids = siteid.split(';')
+        return pd.DataFrame({
+            'MonitoringLocationIdentifier': pd.Categorical(ids),
+            'ActivityStartDateTime': pd.to_datetime(
+                ['2018-01-24 12:07'] * len(ids)).tz_localize('UTC'),
+            'ResultMeasureValue': np.arange(len(ids), dtype=float)})
+
+    monkeypatch.setattr(crosswalk.wqp, 'get_results', get_results)
+    sites = ['{:08d}'.format(i) for i in range(3339000, 3339100)]
+
+    results = crosswalk.get_results(sites, max_length=200,
+                                    characteristicName='Nitrate')
+
+    assert len(requests) == len(crosswalk.siteid_batches(
+        ['USGS-' + site for site in sites], max_length=200))
+    assert sorted(results['site_no']) == sites
+
+    # iv in local time, 15 minute values, for two of the sites
+    times = pd.date_range('2018-01-24 05:00', periods=8, freq='15min',
+                          tz='-06:00')
+    iv = pd.DataFrame({'site_no': np.repeat(sites[:2], len(times)),
+                       'datetime': list(times) * 2,
+                       '00060': np.arange(16, dtype=float)})
+    iv = iv.set_index(['site_no', 'datetime'])
+
+    joined = crosswalk.join_iv(results, iv, tolerance='10min')
+
+    assert len(joined) == len(results)
+    # 12:07 UTC is nearest the 06:00 local value, the 5th of each site
+    assert joined.loc[sites[0], '00060'].tolist() == [4.0]
+    assert joined.loc[sites[1], '00060'].tolist() == [12.0]
+    assert joined['00060'].notna().sum() == 2
+
+    with pytest.raises(TypeError):
+        crosswalk.join_iv(results.drop(columns='site_no'), iv)
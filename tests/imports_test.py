@@ -0,0 +1,43 @@
+import subprocess
+import sys
+
+import pytest
+
+
+def loaded_after_import(module):
+    """Names of modules in sys.modules after importing module in a fresh
+    interpreter.
+    """
+    out = subprocess.run([sys.executable, '-c',
+                          'import sys, {}; print(" ".join(sys.modules))'.format(module)],
+                         capture_output=True, text=True, check=True)
+    return set(out.stdout.split())
+
+
+@pytest.mark.parametrize('module', ['data_retrieval', 'data_retrieval.nwis'])
+def test_import_is_lazy(module):
+    loaded = loaded_after_import(module)
+
+    assert not {'pandas', 'requests', 'gdal'} & loaded
+
+
+def test_nadp_imports_without_gdal():
+    loaded = loaded_after_import('data_retrieval.nadp')
+
+    assert not {'gdal', 'osr', 'osgeo', 'osgeo.gdal', 'osgeo.osr'} & loaded
+
+
+def test_time_zone_table():
+    from data_retrieval.codes import tz, tz_str
+
+    parsed = {code: line.split()[0] for line in tz_str.splitlines()
+              for code in line.split()[1:]}
+    assert parsed == tz
+
+
+def test_submodule_attribute():
+    import data_retrieval
+
+    assert data_retrieval.codes.tz['CST'] == '-0600'
+    with pytest.raises(AttributeError):
+        data_retrieval.missing
@@ -0,0 +1,261 @@
+import sys
+import threading
+import types
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from data_retrieval import nadp
+
+
+class Band():
+    """Stands in for a gdal.Band of array, counting the pixels read.
+    """
+    def __init__(self, array, block_size=(3, 4), nodata=None):
+        self.array = array
+        self.YSize, self.XSize = array.shape
+        self.block_size = block_size  # columns, rows, as GDAL gives them
+        self.nodata = nodata
+        self.reads = []
+
+    def GetBlockSize(self):
+        return list(self.block_size)
+
+    def GetNoDataValue(self):
+        return self.nodata
+
+    def ReadAsArray(self, xoff=0, yoff=0, xsize=None, ysize=None):
+        xsize = self.XSize if xsize is None else xsize
+        ysize = self.YSize if ysize is None else ysize
+        self.reads.append((xoff, yoff, xsize, ysize))
+        return self.array[yoff:yoff + ysize, xoff:xoff + xsize].copy()
+
+
+class Dataset():
+    def __init__(self, band, geotransform=(0, 1, 0, 0, 0, -1), projection=''):
+        self.band = band
+        self.geotransform = geotransform
+        self.projection = projection
+
+    def GetRasterBand(self, band):
+        return self.band
+
+    def GetGeoTransform(self):
+        return self.geotransform
+
+    def GetProjection(self):
+        return self.projection
+
+
+class FakeGdal(types.ModuleType):
+    """Stands in for the gdal module. Buffers are the Datasets they open,
+    and the in-memory files are recorded.
+    """
+    def __init__(self):
+        super().__init__('gdal')
+        self.files = {}
+        self.created = []
+        self.unlinked = []
+        self.lock = threading.Lock()
+
+    def FileFromMemBuffer(self, name, buf):
+        with self.lock:
+            self.files[name] = buf
+            self.created.append(name)
+
+    def Open(self, name):
+        return self.files[name]
+
+    def Unlink(self, name):
+        with self.lock:
+            del self.files[name]
+            self.unlinked.append(name)
+
+
+@pytest.fixture
+def gdal(monkeypatch):
+    gdal = FakeGdal()
+    monkeypatch.setitem(sys.modules, 'gdal', gdal)
+    return gdal
+
+
+def grid(rows=10, cols=7):
+    return np.arange(rows * cols, dtype='float32').reshape(rows, cols)
+
+
+def test_read_window(gdal):
+    memfile = nadp.GDALMemFile(Dataset(Band(grid())))
+
+    with memfile:
+        window, (xoff, yoff) = memfile.read_window(4, 5, 2, 2)
+
+    # blocks are 3 columns by 4 rows, and the last ones are cut by the grid
+    assert (xoff, yoff) == (3, 4)
+    np.testing.assert_array_equal(window, grid()[4:8, 3:6])
+
+    with memfile:
+        window, offset = memfile.read_window(5, 9, 5, 5)
+
+    assert offset == (3, 8)
+    np.testing.assert_array_equal(window, grid()[8:10, 3:7])
+    assert memfile.dataset is None
+    # opened twice, and unlinked on each exit
+    assert len(gdal.created) == 2
+    assert gdal.unlinked == gdal.created and gdal.files == {}
+
+
+def test_memfile_unlinked(gdal):
+    for _ in range(3):
+        with nadp.GDALMemFile(Dataset(Band(grid()))) as memfile:
+            assert memfile.name.startswith('/vsimem/')
+            memfile.array()[0, 0]
+
+    with pytest.raises(ValueError):
+        with nadp.GDALMemFile(Dataset(Band(grid()))):
+            raise ValueError()
+
+    memfile = nadp.GDALMemFile(Dataset(Band(grid())))
+    memfile.open()
+    memfile.close()
+    memfile.close()
+
+    assert len(gdal.created) == 5
+    assert gdal.unlinked == gdal.created and gdal.files == {}
+
+
+@pytest.mark.parametrize('key', [(slice(None), slice(None)), (slice(2, 9), slice(1, 6)),
+                                 (slice(1, None, 3), slice(None, None, 2)),
+                                 (3, slice(None)), (slice(None), -1), (9, 6),
+                                 slice(5, 20), (slice(6, 2), slice(None))])
+def test_lazy_array(key):
+    band = Band(grid())
+    array = nadp.LazyArray(band, cache_size=2)
+
+    np.testing.assert_array_equal(array[key], grid()[key])
+
+    with pytest.raises(IndexError):
+        array[10, 0]
+    with pytest.raises(IndexError):
+        array[::-1, 0]
+
+
+def test_lazy_array_blocks():
+    band = Band(grid())
+    array = nadp.LazyArray(band, cache_size=2)
+
+    array[0:2, 0:2]
+    array[1:3, 1:3]
+    # both selections are in the first block, which is read once
+    assert band.reads == [(0, 0, 3, 4)]
+
+    array[9, 6]
+    array[5, 0]
+    array[9, 6]
+    array[0, 0]
+    # the least recently used block is evicted
+    assert band.reads[1:] == [(6, 8, 1, 2), (0, 4, 3, 4), (0, 0, 3, 4)]
+
+    np.testing.assert_array_equal(np.asarray(array), grid())
+    np.testing.assert_array_equal(array.points([0, 9, 5, 0], [0, 6, 3, 1]),
+                                  grid()[[0, 9, 5, 0], [0, 6, 3, 1]])
+
+
+
+def get_map(year):
+    """Grid of a year, with its last pixel set to the nodata value.
+    """
+    values = grid() + year
+    return nadp.GDALMemFile(Dataset(Band(values, nodata=values[-1, -1]),
+                           geotransform=(-90, 0.5, 0, 45, 0, -0.5)))
+
+
+def test_build_cube_resumes(gdal, tmpdir):
+    path = str(tmpdir.join('cube'))
+    requested = []
+
+    def failing(year):
+        requested.append(year)
+        if year == 2017:
+            raise IOError('timed out')
+        return get_map(year)
+
+    with pytest.raises(IOError):
+        nadp.build_cube(path, [2016, 2017, 2018], failing, max_workers=1)
+
+    cube = nadp.RasterCube(path)
+    assert cube.complete == [2016]
+    assert np.isnan(cube.values[1:]).all()
+
+    # only the missing years are requested again
+    requested.clear()
+    cube = nadp.build_cube(path, [2016, 2017, 2018],
+                           lambda year: requested.append(year) or get_map(year))
+    assert sorted(requested) == [2017, 2018]
+    assert sorted(cube.complete) == [2016, 2017, 2018]
+
+    with pytest.raises(ValueError):
+        nadp.build_cube(path, [2016, 2017], get_map)
+    with pytest.raises(IOError):
+        nadp.RasterCube(str(tmpdir.join('missing')))
+
+
+def test_raster_cube(gdal, tmpdir):
+    cube = nadp.build_cube(str(tmpdir), [2016, 2017], get_map)
+
+    assert cube.shape == (2, 10, 7)
+    # each grid was freed once read
+    assert len(gdal.unlinked) == 2 and gdal.files == {}
+    np.testing.assert_array_equal(cube.time, [2016, 2017])
+    np.testing.assert_allclose(cube.x[:2], [-89.75, -89.25])
+    np.testing.assert_allclose(cube.y[:2], [44.75, 44.25])
+
+    # nodata is NaN
+    assert np.isnan(cube.isel(y=-1, x=-1)).all()
+    np.testing.assert_array_equal(cube.isel(time=1, y=0), grid()[0] + 2017)
+    np.testing.assert_array_equal(cube.sel(time=2016, y=44.3, x=-89.1),
+                                  grid()[1, 1] + 2016)
+
+    expected = grid() + 2016.5
+    expected[-1, -1] = np.nan
+    with pytest.warns(RuntimeWarning):  # mean of the NaN pixel
+        np.testing.assert_array_equal(cube.reduce(np.nanmean, rows=3), expected)
+
+
+@pytest.fixture
+def sites():
+    """Sites in a pixel corner, between four pixel centers, outside the grid,
+    and at the corner of the nodata pixel.
+    """
+    return pd.DataFrame({'site_no': ['01', '02', '03', '04'],
+                         'dec_lat_va': [44.9, 43.5, 43.5, 40.5],
+                         'dec_long_va': [-89.9, -88.5, -80.0, -87.0]})
+
+
+@pytest.mark.parametrize('method, expected', [
+    ('nearest', [0, 24, np.nan, np.nan]),
+    ('bilinear', [0, 20, np.nan, (61 + 62 + 68) / 3])])
+def test_sample_sites(gdal, tmpdir, sites, method, expected):
+    cube = nadp.build_cube(str(tmpdir), [2016, 2017], get_map)
+
+    df = nadp.sample_sites(cube, sites, method=method)
+
+    assert df.index.tolist() == ['01', '02', '03', '04']
+    assert df.columns.tolist() == [2016, 2017]
+    np.testing.assert_allclose(df[2017] - 2017, expected)
+
+    with get_map(2016) as memfile:
+        series = nadp.sample_sites(memfile, sites, method=method)
+
+    # nodata of the band is NaN too
+    pd.testing.assert_series_equal(series, df[2016].rename(None),
+                                   check_index_type=False)
+
+    with pytest.raises(TypeError):
+        nadp.sample_sites(cube, sites, method='cubic')
+
+
+def test_points_nodata():
+    array = nadp.LazyArray(Band(grid(), nodata=3))
+
+    np.testing.assert_array_equal(array.points([0, 0], [2, 3]), [2, np.nan])
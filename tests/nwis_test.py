@@ -1,4 +1,5 @@
 import pytest
+import pandas as pd
 from data_retrieval.nwis import get_record
 
 START_DATE = '2018-01-24'
@@ -39,6 +40,23 @@ def test_iv_service_answer():
     assert df.index.names == [SITENO_COL, DATETIME_COL], "iv service returned incorrect index: {}".format(df.index.names)
 
 
+def test_read_json_keeps_time_zone(iv_series):
+    """read_json combines time series with update_merge; this runs offline.
+    """
+    from data_retrieval.nwis import read_json
+
+    json = {'value': {'timeSeries': [
+        iv_series('03339000', '00060', [('00:00', '10'), ('00:15', '11')]),
+        iv_series('03339000', '00065', [('00:15', '1.5'), ('00:30', '1.6')])]}}
+
+    df = read_json(json)
+
+    assert isinstance(df.index, pd.DatetimeIndex)
+    assert str(df.index.tz) == 'UTC-06:00'
+    assert df['00060'].tolist()[:2] == [10.0, 11.0]
+    assert len(df) == 3
+
+
 if __name__=='__main__':
      test_measurements_service_answer()
      test_iv_service_answer()
@@ -0,0 +1,85 @@
+import io
+import os
+import re
+import threading
+import zipfile
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import pytest
+
+from data_retrieval import remotezip
+
+TIF = os.urandom(20000)
+
+
+def archive():
+    """Zip with a small tif and a large member that should not be fetched.
+    """
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, 'w', zipfile.ZIP_DEFLATED) as z:
+        z.writestr('NO3_conc_2016.pdf', os.urandom(500000))
+        z.writestr('NO3_conc_2016.tif', TIF)
+        z.writestr('NO3_conc_2016.tfw', b'1000\n0\n0\n-1000\n')
+    return buf.getvalue()
+
+
+@pytest.fixture(params=[True, False], ids=['ranges', 'no ranges'])
+def server(request):
+    body = archive()
+    supports_ranges = request.param
+    sent = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            match = re.match(r'bytes=(\d*)-(\d*)', self.headers.get('Range', ''))
+
+            if supports_ranges and match:
+                start, end = match.groups()
+                if not start:
+                    start, end = max(len(body) - int(end), 0), len(body) - 1
+                start, end = int(start), min(int(end or len(body) - 1), len(body) - 1)
+
+                self.send_response(206)
+                self.send_header('Content-Range',
+                                 'bytes {}-{}/{}'.format(start, end, len(body)))
+                data = body[start:end + 1]
+
+            else:
+                self.send_response(200)
+                data = body
+
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+            sent.append(len(data))
+
+        def log_message(self, *args):
+            pass
+
+    httpd = HTTPServer(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=httpd.serve_forever)
+    thread.start()
+
+    yield 'http://127.0.0.1:{}/NO3_conc_2016.zip'.format(httpd.server_port), \
+        supports_ranges, len(body), sent
+
+    httpd.shutdown()
+    httpd.server_close()
+    thread.join()
+
+
+def test_open_zip(server):
+    url, supports_ranges, size, sent = server
+
+    z = remotezip.open_zip(url, block_size=4096)
+
+    assert z.namelist() == ['NO3_conc_2016.pdf', 'NO3_conc_2016.tif',
+                            'NO3_conc_2016.tfw']
+    assert z.read('NO3_conc_2016.tif') == TIF
+
+    if supports_ranges:
+        # the tail, then the tif member; the large pdf is never fetched
+        assert len(sent) <= 3
+        assert sum(sent) < len(TIF) + 3 * 4096
+    else:
+        assert sent == [size]
@@ -0,0 +1,154 @@
+import json
+import multiprocessing
+import os
+import time
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from data_retrieval import shared
+from data_retrieval.shared import SharedStore
+
+
+def iv_frame(sites=('03339000', '05531500'), periods=4):
+    index = pd.MultiIndex.from_product(
+        [list(sites), pd.date_range('2018-01-24', periods=periods, freq='15min',
+                                    tz='-06:00')],
+        names=['site_no', 'datetime'])
+    df = pd.DataFrame({'00060': np.arange(len(index), dtype=float),
+                       '00060_cd': ['P', 'A'] * (len(index) // 2),
+                       'count': np.arange(len(index)),
+                       'flag': [True, False] * (len(index) // 2),
+                       'approval': pd.Categorical(['P'] * len(index))},
+                      index=index)
+    df.attrs['units'] = {'00060': 'ft3/s'}
+    return df
+
+
+def get_iv(**kwargs):
+    get_iv.calls += 1
+    return iv_frame()
+
+
+get_iv.calls = 0
+
+
+@pytest.fixture
+def store(tmpdir):
+    store = SharedStore(namespace='drtest{}'.format(os.getpid()),
+                        lock_path=str(tmpdir.join('lock')))
+    yield store
+    store.evict(force=True)
+
+
+def test_round_trip(store):
+    df = iv_frame()
+    key = store.key('iv', sites=['05531500', '03339000'])
+
+    assert key == store.key('iv', sites='03339000,05531500', period=None)
+    assert store.publish(key, df)
+    assert not store.publish(key, df)
+
+    with store.get(key) as result:
+        pd.testing.assert_frame_equal(result.frame, df)
+        assert result.frame.attrs == df.attrs
+
+        # numeric columns are read in place, and cannot be changed
+        values = result.frame['00060'].values
+        assert not values.flags.writeable
+        assert np.shares_memory(values, np.frombuffer(result.buf, dtype='u1'))
+        del values
+
+    pd.testing.assert_frame_equal(_publish_and_get(store, pd.DataFrame({'a': [1.5]})),
+                                  pd.DataFrame({'a': [1.5]}))
+
+
+def _publish_and_get(store, df):
+    key = store.key('other', value=len(df))
+    store.publish(key, df)
+    with store.get(key) as result:
+        return result.frame.copy()
+
+
+def _read_in_child(store, key, queue):
+    result = store.get(key)
+    queue.put(None if result is None else float(result.frame['00060'].sum()))
+    result.release()
+
+
+def test_shared_between_processes(store):
+    get_iv.calls = 0
+    result = store.fetch(get_iv, sites=['03339000', '05531500'])
+    result.release()
+    assert store.fetch(get_iv, sites='05531500,03339000').frame is not None
+    assert get_iv.calls == 1
+
+    context = multiprocessing.get_context('fork')
+    queue = context.Queue()
+    key = store.key('{}.{}'.format(get_iv.__module__, get_iv.__qualname__),
+                    sites=['03339000', '05531500'])
+    process = context.Process(target=_read_in_child, args=(store, key, queue))
+    process.start()
+    total = queue.get(timeout=10)
+    process.join()
+
+    assert total == iv_frame()['00060'].sum()
+    # the segment outlives the process that read it
+    assert store.info(key) is not None
+
+
+def test_readers_and_expiry(store):
+    store.ttl = 0.2
+    key = store.key('iv', sites='03339000')
+    store.publish(key, iv_frame())
+
+    held = store.get(key)
+    released = store.get(key)
+    released.release()
+    assert store.info(key)['readers'] == 1
+
+    time.sleep(0.25)
+    assert store.get(key) is None
+    # expired, but still held
+    assert store.evict() == 0
+
+    held.release()
+    assert store.evict() == 1
+    assert store.info(key) is None
+    assert key not in store.entries()
+
+
+def test_column_types(store):
+    df = pd.DataFrame({('a', 'text'): ['ü', None, 'b', 'ü'],
+                       ('a', 'str'): pd.array(['x', 'y', None, 'x'], dtype='str'),
+                       ('b', 'ordered'): pd.Categorical(['lo', 'hi', 'lo', None],
+                                                        categories=['lo', 'hi'],
+                                                        ordered=True),
+                       ('b', 'count'): pd.array([1, None, 3, 4], dtype='Int64'),
+                       ('b', 'lists'): [['P'], ['A', 'e'], [], ['P']]})
+    df.index = pd.Index(['01', '02', '03', '04'], name='site_no')
+    key = store.key('types')
+
+    store.publish(key, df)
+
+    # the header is JSON, and strings are stored as UTF-8 data
+    with open(os.path.join(shared.SHM_DIR, key), 'rb') as f:
+        control = f.read(shared.CONTROL.size)
+        header = json.loads(f.read(shared.CONTROL.unpack(control)[-1]))
+    assert 'offsets' in header['columns'][0]['uniques']
+
+    with store.get(key) as result:
+        pd.testing.assert_frame_equal(result.frame, df)
+
+
+def test_unsupported_values(store):
+    df = pd.DataFrame({'a': [object()]})
+
+    with pytest.raises(TypeError):
+        store.publish(store.key('unsupported'), df)
+
+    # served, but not shared
+    result = store.fetch(lambda: df)
+    assert result.frame is df
+    assert store.entries() == []
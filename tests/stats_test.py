@@ -0,0 +1,116 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from data_retrieval import nwis, stats
+
+SITENO_COL = 'site_no'
+DATETIME_COL = 'datetime'
+DATA_DIR = os.path.join(os.path.dirname(__file__), 'data')
+
+
+@pytest.fixture
+def dv():
+    """Daily values for two sites, formatted like nwis.get_dv output.
+    """
+    rng = np.random.RandomState(0)
+    dates = pd.date_range('2000-01-01', '2009-12-31', freq='D')
+    frames = []
+
+    for site in ['03339000', '05447500']:
+        frames.append(pd.DataFrame({SITENO_COL: site,
+                                    DATETIME_COL: dates,
+                                    '00060_Mean': rng.gamma(2, 50, len(dates)),
+                                    '00060_Mean_cd': 'A'}))
+
+    df = pd.concat(frames).set_index([SITENO_COL, DATETIME_COL]).sort_index()
+    df.iloc[10, 0] = np.nan
+    return df
+
+
+def test_daily_columns(dv):
+    df = stats.get_stats(dv)
+
+    assert df.columns.tolist() == stats.DAILY_COLUMNS
+    # one row per site and calendar day, including Feb 29
+    assert len(df) == 2 * 366
+
+
+def test_daily_stats(dv):
+    df = stats.get_stats(dv).set_index([SITENO_COL, 'month_nu', 'day_nu'])
+
+    values = dv['00060_Mean'].dropna().reset_index()
+    dates = values[DATETIME_COL]
+    grouped = values.groupby([values[SITENO_COL], dates.dt.month, dates.dt.day])
+    expected = grouped['00060_Mean']
+
+    np.testing.assert_allclose(df['mean_va'], expected.mean())
+    np.testing.assert_allclose(df['min_va'], expected.min())
+    np.testing.assert_allclose(df['max_va'], expected.max())
+    np.testing.assert_array_equal(df['count_nu'], expected.count())
+
+    # percentiles use the Weibull plotting position
+    p10 = expected.apply(lambda x: np.percentile(x, 10, method='weibull'))
+    np.testing.assert_allclose(df['p10_va'], p10)
+
+
+def test_daily_stat_type(dv):
+    df = stats.get_stats(dv, statTypeCd='median')
+
+    assert 'p50_va' in df
+    assert 'mean_va' not in df
+
+
+def test_monthly_complete(dv):
+    df = stats.get_stats(dv, statReportType='monthly')
+
+    assert df.columns.tolist() == stats.MONTHLY_COLUMNS
+    # the month with a missing day is dropped
+    assert len(df) == 2 * 120 - 1
+
+
+def test_annual_water_year(dv):
+    df = stats.get_stats(dv, statReportType='annual', statYearType='water')
+
+    assert df.columns.tolist() == stats.ANNUAL_COLUMNS
+    # only water years 2001-2009 are complete
+    assert df['year_nu'].unique().tolist() == list(range(2001, 2010))
+
+
+def test_statistic_columns_are_separate(dv):
+    dv['00060_Maximum'] = dv['00060_Mean'] + 100
+    df = stats.get_stats(dv)
+
+    assert len(df) == 2 * 2 * 366
+    assert df['ts_id'].unique().tolist() == ['00060_Maximum', '00060_Mean']
+
+    mean = df[df['ts_id'] == '00060_Mean'].reset_index(drop=True)
+    maximum = df[df['ts_id'] == '00060_Maximum'].reset_index(drop=True)
+    np.testing.assert_array_equal(maximum['count_nu'], mean['count_nu'])
+    np.testing.assert_allclose(maximum['mean_va'], mean['mean_va'] + 100)
+
+    annual = stats.get_stats(dv, statReportType='annual')
+    assert len(annual) == 2 * 2 * 10 - 2
+
+
+def test_service_output():
+    """Compares with the daily statistics RDB in tests/data.
+    """
+    values = {(1, 1): [30, 10, 50, 20, 40], (1, 2): [8, 4, 11, 6, 5]}
+    rows = [(pd.Timestamp(year, month, day), value)
+            for (month, day), series in values.items()
+            for year, value in zip(range(2010, 2015), series)]
+    dv = pd.DataFrame(rows, columns=[DATETIME_COL, '00060_Mean'])
+    dv[SITENO_COL] = '03339000'
+
+    with open(os.path.join(DATA_DIR, 'stat_daily.rdb')) as f:
+        expected = nwis.read_rdb(f.read())
+
+    df = stats.get_stats(dv.set_index([SITENO_COL, DATETIME_COL]))
+
+    columns = [column for column in stats.DAILY_COLUMNS
+               if column not in ('ts_id', 'loc_web_ds')]
+    pd.testing.assert_frame_equal(df[columns], expected[columns],
+                                  check_dtype=False)
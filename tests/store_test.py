@@ -0,0 +1,112 @@
+import pytest
+
+from data_retrieval import nwis
+from data_retrieval.codes import store
+
+PMCODES_RDB = '\n'.join([
+    '# US Geological Survey',
+    '#',
+    'parameter_cd\tparameter_group_nm\tparameter_nm\tcasrn\tsrsname\tparameter_units',
+    '5s\t30s\t170s\t12s\t120s\t40s',
+    '00060\tPhysical\tDischarge, cubic feet per second\t\tStream flow, mean. daily\tft3/s',
+    '00631\tNutrient\tNitrate plus nitrite, water, filtered, milligrams per liter '
+    'as nitrogen\t\tInorganic nitrogen (nitrate and nitrite)\tmg/l as N',
+    ''])
+
+DV_RDB = '\n'.join([
+    '# US Geological Survey',
+    'agency_cd\tsite_no\tdatetime\t69929_00060_00003\t69929_00060_00003_cd\t69930_00010_00003',
+    '5s\t15s\t20d\t14n\t10s\t14n',
+    'USGS\t03339000\t2018-01-24\t1020\tP\t1.5',
+    ''])
+
+
+class Response:
+    def __init__(self, text):
+        self.text = text
+
+    def raise_for_status(self):
+        pass
+
+
+@pytest.fixture
+def pmcodes(monkeypatch):
+    requests_made = []
+
+    def get(url, params=None, **kwargs):
+        requests_made.append((url, params))
+        return Response(PMCODES_RDB)
+
+    monkeypatch.setattr('requests.get', get)
+    return requests_made
+
+
+def test_get_pmcodes(pmcodes):
+    df = nwis.get_pmcodes()
+
+    url, params = pmcodes[0]
+    assert url == nwis.WATERDATA_URL + 'pmcodes'
+    assert params['show'] == nwis.PMCODES_COLUMNS
+    assert df['parameter_cd'].tolist() == ['00060', '00631']
+
+
+def test_bundled_tables(tmpdir):
+    codes = store.CodeStore(str(tmpdir))
+
+    assert codes.version('parameters') == 'bundled'
+    assert codes.units('00060') == 'ft3/s'
+    assert codes.lookup('timezones', 'CST') == '-0600'
+    assert codes.lookup('states', 'il') == 'Illinois'
+    assert codes.lookup('qualifiers', 'P').startswith('Provisional')
+
+
+def test_refresh_versions(pmcodes, tmpdir):
+    codes = store.CodeStore(str(tmpdir))
+    first = codes.refresh(['parameters'])['parameters']
+
+    assert codes.version('parameters') == first
+    assert codes.units('00631') == 'mg/l as N'
+    # tables not refreshed are still bundled
+    assert codes.version('states') == 'bundled'
+
+    with pytest.raises(TypeError):
+        codes.refresh(['counties'])
+
+    pinned = store.CodeStore(str(tmpdir), versions={'parameters': 'bundled'})
+    assert pinned.units('00631') is None
+
+
+def test_command_line(pmcodes, tmpdir, capsys):
+    store.main(['--path', str(tmpdir), 'refresh', 'states'])
+    store.main(['--path', str(tmpdir), 'versions'])
+
+    out = capsys.readouterr().out
+    assert 'parameters: bundled' in out
+    assert store.CodeStore(str(tmpdir)).versions('states')
+
+
+def test_read_rdb_units(monkeypatch, tmpdir):
+    monkeypatch.setattr(store, '_default_store', store.CodeStore(str(tmpdir)))
+
+    df = nwis.read_rdb(DV_RDB, units=True)
+
+    assert df.attrs['units'] == {'69929_00060_00003': 'ft3/s',
+                                 '69930_00010_00003': 'deg C'}
+    assert 'units' not in nwis.read_rdb(DV_RDB).attrs
+
+
+def test_read_json_units(iv_series):
+    json = {'value': {'timeSeries': [
+        iv_series('03339000', '00060', [('00:00', 10)], unit='ft3/s',
+                  statistic='Mean')]}}
+
+    df = nwis.read_json(json, units=True)
+
+    assert df.attrs['units'] == {'00060_Mean': 'ft3/s'}
+
+
+def test_submodules_not_shadowed():
+    import data_retrieval.codes as codes
+
+    assert codes.parameters.parameter_codes is codes.parameter_codes
+    assert codes.qualifiers.qualifier_codes['P'].startswith('Provisional')
@@ -0,0 +1,251 @@
+import hashlib
+import io
+import os
+import threading
+import zipfile
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import pandas as pd
+import pytest
+
+from data_retrieval import streamstats
+
+
+def watershed_json(rcode, x, y):
+    return {'workspaceID': '{}{}{}'.format(rcode, x, y),
+            'featurecollection': [{'name': 'globalwatershedpoint',
+                                   'feature': {'type': 'FeatureCollection'}},
+                                  {'name': 'globalwatershed',
+                                   'feature': {'type': 'FeatureCollection'}}],
+            'parameters': [{'code': 'DRNAREA', 'name': 'Drainage Area',
+                            'value': abs(x), 'unit': 'square miles'},
+                           {'code': 'PRECIP', 'name': 'Mean Annual Precipitation',
+                            'value': y, 'unit': 'inches'}]}
+
+
+class Response:
+    def __init__(self, data):
+        self.data = data
+
+    def json(self):
+        return self.data
+
+
+@pytest.fixture
+def requests_made(monkeypatch):
+    calls = []
+    lock = threading.Lock()
+
+    def get_watershed(rcode, xlocation, ylocation, format='geojson', **kwargs):
+        with lock:
+            calls.append((rcode, xlocation, ylocation))
+        return Response(watershed_json(rcode, xlocation, ylocation))
+
+    monkeypatch.setattr(streamstats, 'get_watershed', get_watershed)
+    return calls
+
+
+def test_from_streamstats_json():
+    first = streamstats.Watershed.from_streamstats_json(watershed_json('NY', -74.5, 43.9))
+    second = streamstats.Watershed.from_streamstats_json(watershed_json('IL', -88.1, 41.2))
+
+    assert isinstance(first, streamstats.Watershed)
+    assert first.workspaceID == 'NY-74.543.9'
+    assert second.workspaceID == 'IL-88.141.2'
+
+
+def test_get_watersheds(requests_made, tmpdir):
+    points = pd.DataFrame({'rcode': ['NY', 'NY', 'IL'],
+                           'x': [-74.52401, -74.52399, -88.1],
+                           'y': [43.939, 43.939, 41.2]})
+
+    watersheds = streamstats.get_watersheds(points, rate=None,
+                                            cache_dir=str(tmpdir))
+
+    assert len(requests_made) == 2
+    assert [w.workspaceID for w in watersheds] == \
+        ['NY-74.52443.939', 'NY-74.52443.939', 'IL-88.141.2']
+
+    # the second run is served from the cache
+    n_requests = len(requests_made)
+    streamstats.get_watersheds(points, rate=None, cache_dir=str(tmpdir))
+    assert len(requests_made) == n_requests
+
+    # different options are cached separately
+    streamstats.get_watersheds(points[:1], rate=None, cache_dir=str(tmpdir),
+                               simplify=False)
+    assert len(requests_made) == n_requests + 1
+
+
+def test_watershed_parameters(requests_made):
+    watersheds = streamstats.get_watersheds([('NY', -74.5, 43.9),
+                                             ('IL', -88.1, 41.2)], rate=None)
+    df = streamstats.watershed_parameters(watersheds)
+
+    assert df.shape == (4, 5)
+    assert df['code'].tolist() == ['DRNAREA', 'PRECIP'] * 2
+    assert df['value'].tolist() == [74.5, 43.9, 88.1, 41.2]
+
+
+def test_rate_limiter(monkeypatch):
+    limiter = streamstats._RateLimiter(2)
+    sleeps = []
+    monkeypatch.setattr(streamstats.time, 'sleep', sleeps.append)
+
+    for _ in range(3):
+        limiter.wait()
+
+    assert len(sleeps) == 2
+    assert sleeps[-1] == pytest.approx(1, abs=0.1)
+
+
+def workspace_zip():
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, 'w') as archive:
+        archive.writestr('Layers/GlobalWatershed.shp', os.urandom(50000))
+        archive.writestr('Layers/GlobalWatershed.dbf', b'dbf')
+    return buf.getvalue()
+
+
+@pytest.fixture
+def workspace_server(monkeypatch):
+    """Serves a workspace zip with Range and If-Range support. The first
+    response is cut off halfway through.
+    """
+    server_state = {'body': workspace_zip(), 'etag': '"1"', 'cut': True}
+    requests_made = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = server_state['body']
+            requests_made.append(dict(self.headers))
+
+            start = 0
+            if 'Range' in self.headers and \
+                    self.headers.get('If-Range') in (None, server_state['etag']):
+                start = int(self.headers['Range'].split('=')[1].rstrip('-'))
+
+            if start >= len(body) and start:
+                self.send_response(416)
+                self.send_header('Content-Range', 'bytes */{}'.format(len(body)))
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+
+            self.send_response(206 if start else 200)
+            self.send_header('ETag', server_state['etag'])
+            if start:
+                self.send_header('Content-Range', 'bytes {}-{}/{}'.format(
+                    start, len(body) - 1, len(body)))
+            self.send_header('Content-Length', str(len(body) - start))
+            self.end_headers()
+
+            if server_state['cut']:
+                server_state['cut'] = False
+                self.wfile.write(body[:len(body) // 2])
+                self.close_connection = True
+            else:
+                self.wfile.write(body[start:])
+
+        def log_message(self, *args):
+            pass
+
+    server = HTTPServer(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+
+    monkeypatch.setattr(streamstats, 'DOWNLOAD_URL',
+                        'http://127.0.0.1:{}/download'.format(server.server_port))
+    monkeypatch.setattr(streamstats, 'RETRY_DELAY', 0)
+    monkeypatch.setattr(streamstats, 'DOWNLOAD_CHUNK_SIZE', 1024)
+
+    yield server_state, requests_made
+
+    server.shutdown()
+    server.server_close()
+    thread.join()
+
+
+def range_start(headers):
+    if 'Range' not in headers:
+        return 0
+    return int(headers['Range'].split('=')[1].rstrip('-'))
+
+
+def test_download_workspace_resumes(workspace_server, tmpdir):
+    server_state, requests_made = workspace_server
+    body = server_state['body']
+    filepath = str(tmpdir.join('workspace.zip'))
+
+    result = streamstats.download_workspace(
+        filepath, 'NY20180124', checksum=hashlib.sha256(body).hexdigest())
+
+    assert result == filepath
+    # resumed from the last whole chunk written before the connection dropped
+    assert len(requests_made) == 2
+    assert 0 < range_start(requests_made[1]) <= len(body) // 2
+    assert requests_made[1]['If-Range'] == '"1"'
+    with open(filepath, 'rb') as f:
+        assert f.read() == body
+    assert tmpdir.listdir() == [tmpdir.join('workspace.zip')]
+
+
+def test_download_workspace_changed(workspace_server, tmpdir):
+    """A part of a file that changed on the server, or of another workspace,
+    is not resumed.
+    """
+    server_state, requests_made = workspace_server
+    filepath = str(tmpdir.join('workspace.zip'))
+
+    with pytest.raises(IOError):
+        streamstats.download_workspace(filepath, 'NY20180124', retries=0)
+
+    server_state['body'] = workspace_zip()
+    server_state['etag'] = '"2"'
+    streamstats.download_workspace(filepath, 'NY20180124')
+
+    # the range was sent, but the server sent the new file whole
+    assert range_start(requests_made[1]) > 0
+    with open(filepath, 'rb') as f:
+        assert f.read() == server_state['body']
+
+    streamstats.download_workspace(filepath, 'NY20180125', format='SHAPE')
+    assert 'Range' not in requests_made[2]
+
+
+def test_download_workspace_part_too_long(workspace_server, tmpdir):
+    server_state, requests_made = workspace_server
+    server_state['cut'] = False
+    filepath = str(tmpdir.join('workspace.zip'))
+
+    part = streamstats._part_path(filepath, 'NY20180124', '')
+    with open(part, 'wb') as f:
+        f.write(server_state['body'] + b'stale')
+    with open(part + '.validator', 'w') as f:
+        f.write('"1"')
+
+    streamstats.download_workspace(filepath, 'NY20180124')
+
+    # 416, then the whole file
+    assert len(requests_made) == 2 and 'Range' not in requests_made[1]
+    with open(filepath, 'rb') as f:
+        assert f.read() == server_state['body']
+
+
+def test_download_workspace_members(workspace_server, tmpdir):
+    filepath = str(tmpdir.join('workspace.zip'))
+
+    paths = streamstats.download_workspace(
+        filepath, 'NY20180124', members=['Layers/GlobalWatershed.dbf'])
+
+    assert paths == [str(tmpdir.join('Layers', 'GlobalWatershed.dbf'))]
+    assert not tmpdir.join('Layers', 'GlobalWatershed.shp').exists()
+
+
+def test_download_workspace_checksum(workspace_server, tmpdir):
+    filepath = str(tmpdir.join('workspace.zip'))
+
+    with pytest.raises(ValueError):
+        streamstats.download_workspace(filepath, 'NY20180124', checksum='0' * 64)
+
+    assert not os.path.exists(filepath)
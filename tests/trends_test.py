@@ -0,0 +1,86 @@
+import itertools
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from data_retrieval import trends
+
+SITENO_COL = 'site_no'
+DATETIME_COL = 'datetime'
+
+
+@pytest.fixture
+def peaks():
+    """Annual peaks for several sites of different record lengths, formatted
+    like format_response(df, service='peaks') output.
+    """
+    rng = np.random.RandomState(0)
+    frames = []
+
+    for i, n in enumerate([1, 2, 15, 40, 40]):
+        days = np.sort(rng.choice(30000, n, replace=False))
+        values = np.round(rng.gamma(2, 100, n) + 5 * i * np.arange(n), -1)
+        frames.append(pd.DataFrame({
+            SITENO_COL: '0{}'.format(i),
+            DATETIME_COL: pd.Timestamp('1930-01-01') + pd.to_timedelta(days, unit='D'),
+            'peak_va': values}))
+
+    return pd.concat(frames).set_index([SITENO_COL, DATETIME_COL]).sort_index()
+
+
+def site_series(df, site):
+    series = df.xs(site)['peak_va']
+    days = (series.index - series.index.min()) / np.timedelta64(1, 'D')
+    return np.asarray(days), series.values
+
+
+def test_mann_kendall(peaks):
+    result = trends.mann_kendall(peaks, chunk_size=2)
+
+    for site in ['01', '02', '03', '04']:
+        days, values = site_series(peaks, site)
+        pairs = list(itertools.combinations(range(len(values)), 2))
+
+        s = sum(np.sign(values[j] - values[i]) for i, j in pairs)
+        slope = np.median([(values[j] - values[i]) / (days[j] - days[i])
+                           for i, j in pairs])
+
+        assert result.loc[site, 's'] == s
+        assert result.loc[site, 'n'] == len(values)
+        np.testing.assert_allclose(result.loc[site, 'sens_slope'], slope)
+
+    assert np.isnan(result.loc['00', 'sens_slope'])
+
+
+def test_mann_kendall_ties():
+    df = pd.DataFrame({SITENO_COL: '01',
+                       DATETIME_COL: pd.date_range('2000', periods=5, freq='YS'),
+                       'peak_va': [1, 1, 2, 2, 2]}).set_index(DATETIME_COL)
+
+    result = trends.mann_kendall(df)
+
+    # n(n-1)(2n+5)/18 less the corrections for a pair and a triple
+    assert result.loc['01', 'var_s'] == (5 * 4 * 15 - 2 * 1 * 9 - 3 * 2 * 11) / 18
+
+
+def test_linear_trend(peaks):
+    result = trends.linear_trend(peaks, normalize=False)
+
+    for site in ['02', '03', '04']:
+        days, values = site_series(peaks, site)
+        slope, intercept = np.polyfit(days, values, 1)
+
+        np.testing.assert_allclose(result.loc[site, 'slope'], slope)
+        np.testing.assert_allclose(result.loc[site, 'intercept'], intercept)
+
+    # a strong trend over a long record is significant
+    assert result.loc['04', 'p_value'] < 0.05
+
+
+def test_betainc():
+    # closed forms: I_x(1, 1) = x and I_x(a, 1) = x**a
+    x = np.array([0, 0.2, 0.5, 0.9, 1])
+
+    np.testing.assert_allclose(trends._betainc(1, 1, x), x)
+    np.testing.assert_allclose(trends._betainc(3, 1, x), x ** 3)
@@ -0,0 +1,174 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from data_retrieval.utils import mmerge_asof, update_merge
+
+SITENO_COL = 'site_no'
+DATETIME_COL = 'datetime'
+
+
+def make_frame(n, columns, seed, levels=(SITENO_COL, DATETIME_COL)):
+    """Random frame indexed by one or more grouping levels and a time level
+    with no duplicate times.
+    """
+    rng = np.random.RandomState(seed)
+    arrays = [rng.choice(['01', '02', '03'], n) for _ in levels[:-1]]
+    minutes = rng.choice(100000, n, replace=False)
+    arrays.append(pd.Timestamp('2018-01-01') + pd.to_timedelta(minutes, unit='m'))
+
+    df = pd.DataFrame({column: rng.normal(size=n) for column in columns})
+    df.index = pd.MultiIndex.from_arrays(arrays, names=list(levels))
+    return df
+
+
+def expected_merge(left, right, **kwargs):
+    names = list(left.index.names)
+    merged = pd.merge_asof(left.reset_index().sort_values(DATETIME_COL),
+                           right.reset_index().sort_values(DATETIME_COL),
+                           on=DATETIME_COL, by=names[:-1], **kwargs)
+    return merged.set_index(names).sort_index()
+
+
+@pytest.mark.parametrize('direction', ['backward', 'forward', 'nearest'])
+@pytest.mark.parametrize('tolerance', [None, pd.Timedelta('8h')])
+def test_mmerge_asof_matches_merge_asof(direction, tolerance):
+    left = make_frame(200, ['a'], seed=0)
+    right = make_frame(300, ['b'], seed=1)
+
+    merged = mmerge_asof(left, right, tolerance=tolerance, direction=direction)
+    expected = expected_merge(left, right, tolerance=tolerance,
+                              direction=direction)
+
+    pd.testing.assert_frame_equal(merged.sort_index(), expected)
+
+
+def test_mmerge_asof_three_levels():
+    levels = (SITENO_COL, 'parm_cd', DATETIME_COL)
+    left = make_frame(200, ['a'], seed=2, levels=levels)
+    right = make_frame(300, ['b'], seed=3, levels=levels)
+
+    merged = mmerge_asof(left, right, direction='nearest')
+    expected = expected_merge(left, right, direction='nearest')
+
+    pd.testing.assert_frame_equal(merged.sort_index(), expected)
+
+
+def test_mmerge_asof_keeps_left_order():
+    left = make_frame(50, ['a'], seed=4)
+    right = make_frame(50, ['b'], seed=5).sort_index()
+
+    merged = mmerge_asof(left, right)
+
+    assert merged.index.equals(left.index)
+
+
+def test_mmerge_asof_exact_matches_and_missing_groups():
+    left = make_frame(200, ['a'], seed=8)
+    right = make_frame(300, ['b'], seed=9)
+    # exact matches for some rows, and a group that is only in left
+    right = pd.concat([right, left.iloc[:20].rename(columns={'a': 'b'})])
+    right = right[right.index.get_level_values(SITENO_COL) != '03']
+
+    for direction in ['backward', 'forward', 'nearest']:
+        merged = mmerge_asof(left, right, direction=direction,
+                             allow_exact_matches=False)
+        expected = expected_merge(left, right, direction=direction,
+                                  allow_exact_matches=False)
+
+        pd.testing.assert_frame_equal(merged.sort_index(), expected)
+
+
+def test_mmerge_asof_mismatched_names():
+    left = make_frame(10, ['a'], seed=6)
+    right = make_frame(10, ['b'], seed=7)
+    right.index.names = ['site', DATETIME_COL]
+
+    with pytest.raises(TypeError):
+        mmerge_asof(left, right)
+
+
+def test_mmerge_asof_mismatched_time_zones():
+    left = make_frame(10, ['a'], seed=8)
+    right = make_frame(10, ['b'], seed=9)
+    left.index = left.index.set_levels(
+        left.index.levels[-1].tz_localize('-06:00'), level=-1)
+
+    with pytest.raises(ValueError):
+        mmerge_asof(left, right)
+
+    # both aware, in different zones, compare in UTC
+    right.index = right.index.set_levels(
+        right.index.levels[-1].tz_localize('UTC'), level=-1)
+    mmerge_asof(left, right)
+
+
+@pytest.fixture
+def archived():
+    return pd.DataFrame({SITENO_COL: ['01', '01', '02'],
+                         'value': [1.0, np.nan, 3.0],
+                         'value_cd': ['A', 'A', 'A']})
+
+
+@pytest.fixture
+def revised():
+    return pd.DataFrame({SITENO_COL: ['01', '02', '03'],
+                         'value': [20.0, 30.0, np.nan],
+                         'note': ['r', 'r', 'r']})
+
+
+def test_update_merge_update(archived, revised):
+    archived.index = [0, 1, 2]
+    revised.index = [1, 2, 3]
+
+    df = update_merge(archived, revised)
+
+    np.testing.assert_array_equal(df['value'], [1.0, 20.0, 30.0, np.nan])
+    assert df['value_cd'].tolist()[:3] == ['A', 'A', 'A']
+    assert df['note'].tolist()[1:] == ['r', 'r', 'r']
+
+
+def test_update_merge_na_only(archived, revised):
+    archived.index = [0, 1, 2]
+    revised.index = [1, 2, 3]
+
+    df = update_merge(archived, revised, na_only=True)
+
+    np.testing.assert_array_equal(df['value'], [1.0, 20.0, 3.0, np.nan])
+
+
+def test_update_merge_upsert_on_keys():
+    left = pd.DataFrame({SITENO_COL: ['01', '02'], 'value': [1.0, 2.0]})
+    right = pd.DataFrame({SITENO_COL: ['02', '03'], 'value': [np.nan, 3.0]})
+
+    df = update_merge(left, right, on=SITENO_COL, upsert=True)
+
+    assert df[SITENO_COL].tolist() == ['01', '02', '03']
+    assert df['value'].tolist()[0] == 1.0
+    assert np.isnan(df['value'].tolist()[1])
+    assert not any(column.endswith(('_x', '_y')) for column in df.columns)
+
+
+def test_update_merge_duplicate_keys():
+    left = pd.DataFrame({SITENO_COL: ['01', '01'], 'value': [1.0, 2.0]})
+
+    with pytest.raises(ValueError):
+        update_merge(left, left, on=SITENO_COL)
+
+
+def test_update_merge_tz_aware_key():
+    times = pd.date_range('2018-01-24', periods=3, freq='15min', tz='US/Eastern')
+    left = pd.DataFrame({DATETIME_COL: times[:2], 'value': [1.0, 2.0]})
+    right = pd.DataFrame({DATETIME_COL: times[1:], 'other': [3.0, 4.0]})
+
+    df = update_merge(left, right, on=DATETIME_COL)
+    assert df[DATETIME_COL].dtype == times.dtype
+    assert df[DATETIME_COL].tolist() == list(times)
+
+    df = update_merge(left.set_index(DATETIME_COL), right.set_index(DATETIME_COL))
+    assert df.index.dtype == times.dtype
+
+
+def test_update_merge_rejects_merge_options(archived, revised):
+    with pytest.raises(TypeError):
+        update_merge(archived, revised, left_on=SITENO_COL, right_on=SITENO_COL)
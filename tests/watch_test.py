@@ -0,0 +1,164 @@
+import asyncio
+
+import pandas as pd
+import pytest
+import requests
+
+from data_retrieval import nwis, watch
+from data_retrieval.watch import IVWatcher
+
+GET_IV = nwis.get_iv
+
+SITES = ['03339000', '03339500', '05531500']
+
+
+class IVService:
+    """Stands in for nwis.get_iv, serving a record that can be extended and
+    revised between polls.
+    """
+    def __init__(self, now):
+        times = pd.date_range(end=now, periods=8, freq='15min', tz='UTC')
+        self.record = pd.DataFrame({
+            'site_no': [site for site in SITES for _ in times],
+            'datetime': list(times) * len(SITES),
+            '00060': range(len(SITES) * len(times)),
+            '00060_cd': 'P'}).astype({'00060': float})
+        self.modified = set(SITES)
+        self.requests = []
+
+    def add(self, site, datetime, value):
+        row = pd.DataFrame({'site_no': [site], 'datetime': [datetime],
+                            '00060': [value], '00060_cd': ['P']})
+        self.record = pd.concat([self.record, row], ignore_index=True)
+        self.modified.add(site)
+
+    def revise(self, site, datetime, value):
+        match = (self.record['site_no'] == site) & (self.record['datetime'] == datetime)
+        self.record.loc[match, '00060'] = value
+        self.modified.add(site)
+
+    def get_iv(self, sites, **kwargs):
+        self.requests.append(dict(kwargs, sites=sites))
+
+        if 'modifiedSince' in kwargs:
+            sites = [site for site in sites if site in self.modified]
+            start = pd.Timestamp(kwargs['startDT'])
+        else:
+            start = pd.Timestamp.min.tz_localize('UTC')
+
+        df = self.record[self.record['site_no'].isin(sites)
+                         & (self.record['datetime'] >= start)]
+        if df.empty:
+            return None
+
+        # local times, as returned by NWIS
+        df = df.assign(datetime=df['datetime'].dt.tz_convert('-06:00'))
+        return df.set_index(['site_no', 'datetime']).sort_index()
+
+
+@pytest.fixture
+def service(monkeypatch):
+    service = IVService(pd.Timestamp.now(tz='UTC').floor('15min'))
+    monkeypatch.setattr(watch.nwis, 'get_iv', service.get_iv)
+    return service
+
+
+def test_poll(service):
+    watcher = IVWatcher(SITES, lookback='PT1H', batch_size=2)
+
+    first = watcher.poll()
+    # the lookback is requested once for each site; older values are dropped
+    assert [request['period'] for request in service.requests] == ['PT60M'] * 2
+    assert len(first) == len(service.record)
+    assert len(watcher.values('03339000')) == 5
+
+    # nothing changed
+    service.modified.clear()
+    assert watcher.poll().empty
+
+    newest = service.record['datetime'].max()
+    service.add('03339500', newest + pd.Timedelta('15min'), 42.0)
+    service.revise('05531500', newest, -1.0)
+    service.requests.clear()
+
+    rows = watcher.poll()
+
+    assert all('modifiedSince' in request for request in service.requests)
+    assert rows['00060'].tolist() == [42.0, -1.0]
+    assert rows.index.get_level_values('site_no').tolist() == ['03339500', '05531500']
+    assert watcher.high_water['03339500'] == newest + pd.Timedelta('15min')
+    assert watcher.values('05531500').loc[newest, '00060'] == -1.0
+
+
+def test_buffer_is_bounded(service):
+    watcher = IVWatcher(SITES, lookback='PT2H', maxlen=3)
+    watcher.poll()
+
+    assert len(watcher.buffer) == 3 * len(SITES)
+    assert watcher.values('missing').empty
+
+
+def test_failed_batch_is_retried(service, monkeypatch):
+    watcher = IVWatcher(SITES, lookback='PT1H', batch_size=1)
+
+    def fail(sites, **kwargs):
+        if sites == ['05531500']:
+            raise IOError('timed out')
+        return service.get_iv(sites, **kwargs)
+
+    monkeypatch.setattr(watch.nwis, 'get_iv', fail)
+    rows = watcher.poll()
+
+    assert set(rows.index.get_level_values('site_no')) == {'03339000', '03339500'}
+    assert list(watcher.failed) == ['05531500']
+
+    monkeypatch.setattr(watch.nwis, 'get_iv', service.get_iv)
+    rows = watcher.poll()
+
+    assert set(rows.index.get_level_values('site_no')) == {'05531500'}
+    assert not watcher.failed
+
+
+def response(status_code):
+    r = requests.models.Response()
+    r.status_code = status_code
+    r.url = 'https://waterservices.usgs.gov/nwis/iv/'
+    r._content = b''
+    return r
+
+
+def test_rejected_batch_is_retried(service, monkeypatch):
+    """A rejected request (400) fails its batch; only a 404 means no data.
+    """
+    watcher = IVWatcher(SITES, lookback='PT1H')
+    watcher.poll()
+    polled = watcher.polled.copy()
+    high_water = watcher.high_water.copy()
+
+    monkeypatch.setattr(watch.nwis, 'get_iv', GET_IV)
+    monkeypatch.setattr(requests, 'get', lambda url, **kwargs: response(400))
+    assert watcher.poll().empty
+
+    assert isinstance(watcher.failed['03339000'], requests.HTTPError)
+    pd.testing.assert_series_equal(watcher.polled, polled)
+    pd.testing.assert_series_equal(watcher.high_water, high_water)
+
+    monkeypatch.setattr(requests, 'get', lambda url, **kwargs: response(404))
+    assert watcher.poll().empty
+
+    assert not watcher.failed
+    assert (watcher.polled > polled).all()
+
+
+def test_run_and_stream(service):
+    emitted = []
+    IVWatcher(SITES, lookback='PT1H').run(emitted.append, interval=0, polls=2)
+
+    # the second poll finds nothing new, so is not emitted
+    assert len(emitted) == 1
+
+    async def collect():
+        watcher = IVWatcher(SITES, lookback='PT1H')
+        return [rows async for rows in watcher.stream(interval=0, polls=2)]
+
+    assert len(asyncio.run(collect())) == 1
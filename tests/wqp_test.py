@@ -0,0 +1,239 @@
+import io
+import zipfile
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from data_retrieval import wqp
+
+CSV = ('MonitoringLocationIdentifier,CharacteristicName,ResultMeasureValue\n'
+       'USGS-03339000,Phosphorus,0.1\n'
+       'USGS-03339000,Nitrate,1.5\n'
+       'USGS-05447500,Phosphorus,0.2\n')
+
+
+def zipped(text, name='result.csv'):
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, 'w', zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr(name, text)
+    buf.seek(0)
+    return buf
+
+
+def test_read_zipped_csv():
+    df = wqp.read_zipped_csv(zipped(CSV))
+
+    assert df.shape == (3, 3)
+    assert df['ResultMeasureValue'].tolist() == [0.1, 1.5, 0.2]
+
+
+def test_read_zipped_csv_chunks():
+    chunks = list(wqp.read_zipped_csv(zipped(CSV), chunksize=2))
+
+    assert [len(chunk) for chunk in chunks] == [2, 1]
+    assert pd.concat(chunks, ignore_index=True).equals(
+        wqp.read_zipped_csv(zipped(CSV)))
+
+
+NARROW_CSV = ('ActivityIdentifier,ActivityStartDate,ActivityStartTime/Time,'
+              'ActivityStartTime/TimeZoneCode,MonitoringLocationIdentifier,'
+              'CharacteristicName,ResultMeasureValue,USGSPCode,ResultIdentifier\n'
+              '01,2018-01-24,10:30:00,CST,USGS-03339000,Phosphorus,0.1,00665,1\n'
+              '02,2018-01-24,,CST,USGS-03339000,Phosphorus,<0.5,00665,2\n'
+              '03,2018-07-01,08:00:00,EDT,USGS-05447500,pH,7.2,00400,3\n')
+
+
+def test_narrow_result_schema():
+    df = wqp.read_zipped_csv(zipped(NARROW_CSV), profile='narrowResult')
+
+    assert df['CharacteristicName'].dtype.name == 'category'
+    # identifiers and codes keep their leading zeros
+    assert df['ActivityIdentifier'].tolist() == ['01', '02', '03']
+    assert df['USGSPCode'].tolist() == ['00665', '00665', '00400']
+    # non-numeric results are coerced
+    assert df['ResultMeasureValue'].isnull().tolist() == [False, True, False]
+
+    expected = pd.to_datetime(['2018-01-24 16:30', None, '2018-07-01 12:00'],
+                              utc=True)
+    assert df['ActivityStartDateTime'].dt.tz is not None
+    assert pd.DatetimeIndex(df['ActivityStartDateTime']).equals(expected)
+
+
+def test_usecols():
+    usecols = ['CharacteristicName', 'ActivityStartDateTime']
+    df = wqp.read_zipped_csv(zipped(NARROW_CSV), profile='narrowResult',
+                             usecols=usecols)
+
+    assert df.columns.tolist() == usecols
+
+
+def test_split_params_values():
+    parts = wqp.split_params('statecode', statecode='US:17;US:18',
+                             characteristicName='pH')
+
+    assert parts == [{'statecode': 'US:17', 'characteristicName': 'pH'},
+                     {'statecode': 'US:18', 'characteristicName': 'pH'}]
+
+
+def test_split_params_dates():
+    parts = wqp.split_params(['huc', 'date'], window='365D',
+                             huc=['07090001', '07090002'],
+                             startDateLo='01-01-2016', startDateHi='06-30-2017')
+
+    assert len(parts) == 4
+    assert [(part['startDateLo'], part['startDateHi']) for part in parts[:2]] == \
+        [('01-01-2016', '12-30-2016'), ('12-31-2016', '06-30-2017')]
+
+
+def test_split_params_missing():
+    with pytest.raises(TypeError):
+        wqp.split_params('countycode', statecode='US:17')
+
+
+def test_split_query(monkeypatch):
+    """Parts are fetched separately, failed parts are retried, and rows
+    returned by more than one part are dropped.
+    """
+    monkeypatch.setattr(wqp, 'RETRY_DELAY', 0)
+    attempts = []
+
+    def download(url, **kwargs):
+        attempts.append(kwargs['statecode'])
+        if kwargs['statecode'] == 'US:18' and attempts.count('US:18') == 1:
+            raise wqp.requests.ConnectionError()
+        rows = NARROW_CSV.splitlines()
+        # both states return the first result, each returns one of its own
+        own = rows[2] if kwargs['statecode'] == 'US:17' else rows[3]
+        return zipped('\n'.join([rows[0], rows[1], own]) + '\n')
+
+    monkeypatch.setattr(wqp, 'download', download)
+
+    df = wqp.get_results(statecode=['US:17', 'US:18'], split='statecode')
+
+    assert attempts.count('US:18') == 2
+    assert sorted(df['ActivityIdentifier']) == ['01', '02', '03']
+    assert df['CharacteristicName'].dtype.name == 'category'
+
+
+def test_split_query_usecols(monkeypatch):
+    """Parts are de-duplicated on the whole key even if usecols leaves
+    part of it out.
+    """
+    rows = NARROW_CSV.splitlines()
+    # a second result of activity 01, and the first result in both parts
+    other = rows[1].replace('0.1,00665,1', '0.4,00665,4')
+
+    def download(url, **kwargs):
+        own = rows[2] if kwargs['statecode'] == 'US:17' else other
+        return zipped('\n'.join([rows[0], rows[1], own]) + '\n')
+
+    monkeypatch.setattr(wqp, 'download', download)
+    usecols = ['ActivityIdentifier', 'CharacteristicName', 'ResultMeasureValue']
+
+    df = wqp.get_results(statecode=['US:17', 'US:18'], split='statecode',
+                         usecols=usecols)
+
+    assert df.columns.tolist() == usecols
+    assert sorted(df['ResultMeasureValue'].dropna()) == [0.1, 0.4]
+    assert len(df) == 3
+
+
+def test_download_timeout(monkeypatch):
+    requested = {}
+
+    def get(url, **kwargs):
+        requested.update(kwargs)
+        raise wqp.requests.ConnectTimeout()
+
+    monkeypatch.setattr(wqp.requests, 'get', get)
+
+    with pytest.raises(wqp.requests.ConnectTimeout):
+        wqp.download(wqp.wqp_url('Result'), statecode='US:17')
+
+    assert requested['timeout'] == wqp.TIMEOUT
+
+
+@pytest.fixture
+def results():
+    """narrowResult rows with a duplicated Phosphorus result in sample 01.
+    """
+    return pd.DataFrame({
+        'ActivityIdentifier': ['01', '01', '01', '02', '02'],
+        'CharacteristicName': pd.Categorical(['Phosphorus', 'Phosphorus',
+                                              'pH', 'Phosphorus', 'Nitrate']),
+        'ResultMeasureValue': [0.1, 0.3, 7.2, 0.2, 1.5],
+        'ResultMeasure/MeasureUnitCode': ['mg/l', 'mg/l', 'std units',
+                                          'mg/l', 'mg/l as N'],
+        'ResultStatusIdentifier': ['Preliminary', 'Accepted', 'Accepted',
+                                   'Accepted', 'Accepted']})
+
+
+@pytest.mark.parametrize('duplicates, expected', [('first', 0.1), ('last', 0.3),
+                                                  ('mean', 0.2), ('accepted', 0.3)])
+def test_pivot_results(results, duplicates, expected):
+    df = wqp.pivot_results(results, duplicates=duplicates)
+
+    assert df.columns.tolist() == ['Nitrate', 'Phosphorus', 'pH']
+    assert df.index.tolist() == ['01', '02']
+    assert df.loc['01', 'Phosphorus'] == pytest.approx(expected)
+    assert df.loc['02', 'Phosphorus'] == 0.2
+    assert pd.isnull(df.loc['01', 'Nitrate'])
+    assert df.attrs['units'] == {'Nitrate': 'mg/l as N', 'Phosphorus': 'mg/l',
+                                 'pH': 'std units'}
+
+
+def test_pivot_results_sparse(results):
+    pytest.importorskip('scipy')
+
+    df = wqp.pivot_results(results, duplicates='mean', sparse=True)
+    dense = wqp.pivot_results(results, duplicates='mean')
+
+    assert df.sparse.density == 4 / 6
+    pd.testing.assert_frame_equal(df.sparse.to_dense(), dense)
+
+
+@pytest.mark.parametrize('sparse', [False, True])
+def test_pivot_results_missing_keys(results, sparse):
+    if sparse:
+        pytest.importorskip('scipy')
+
+    results.loc[4, 'CharacteristicName'] = None
+    results.loc[2, 'ActivityIdentifier'] = None
+
+    df = wqp.pivot_results(results, duplicates='mean', sparse=sparse)
+    if sparse:
+        df = df.sparse.to_dense()
+
+    # missing keys are a row and column of their own
+    assert df.index[:2].tolist() == ['01', '02'] and pd.isnull(df.index[2])
+    assert df.columns[:2].tolist() == ['Phosphorus', 'pH']
+    assert pd.isnull(df.columns[2])
+    assert df.loc['01', 'Phosphorus'] == pytest.approx(0.2)
+    assert df.loc['02', 'Phosphorus'] == 0.2
+    assert pd.isnull(df.loc['01', 'pH'])
+    assert df.iloc[2, 1] == 7.2
+    assert df.iloc[1, 2] == 1.5
+
+
+@pytest.mark.parametrize('duplicates, expected', [('first', [1, 5]), ('last', [4, 8]),
+                                                  ('accepted', [3, 5])])
+def test_pivot_results_many_duplicates(duplicates, expected):
+    n = 4
+    df = pd.DataFrame({'ActivityIdentifier': ['01'] * n + ['02'] * n,
+                       'CharacteristicName': ['pH'] * 2 * n,
+                       'ResultMeasureValue': np.arange(1, 2 * n + 1, dtype=float),
+                       'ResultStatusIdentifier': ['Preliminary', 'Preliminary',
+                                                  'Accepted', 'Accepted',
+                                                  'Preliminary', 'Preliminary',
+                                                  'Preliminary', 'Preliminary']})
+
+    df = wqp.pivot_results(df, duplicates=duplicates)
+
+    assert df['pH'].tolist() == expected
+
+
+def test_pivot_results_without_status(results):
+    with pytest.raises(ValueError):
+        wqp.pivot_results(results.drop(columns='ResultStatusIdentifier'),
+                          duplicates='accepted')